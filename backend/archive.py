@@ -0,0 +1,336 @@
+'''
+Tiered storage of old expenses. Months older than a cutoff are moved from Postgres to compressed Parquet files on local
+disk, one file per shard and month, and read back transparently by db_helper_postgre. Files and row groups are skipped
+using the month of the file and the min/max statistics Parquet keeps per row group.
+
+Usage:
+    python -m backend.archive archive --before 2024-09-01
+    python -m backend.archive restore --month 2024-08
+'''
+import argparse
+import datetime
+import operator
+import os
+import re
+from backend import shard_router
+from backend.log_setup import logger_setup
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError: #Only needed once months are archived
+    pa=None
+    pc=None
+    pq=None
+
+#%% Global variables
+ARCHIVE_DIR =os.getenv("ARCHIVE_DIR","archive")
+ARCHIVE_COLUMNS =["id","expense_date","amount","category","notes","owner_id"] #Category is archived by name, Parquet dictionary encodes the repeated names
+ROW_GROUP_SIZE =65536 #Rows per row group. Smaller groups prune better, bigger groups compress better
+COMPRESSION ="zstd"
+COMPARATORS ={">":operator.gt,">=":operator.ge,"<":operator.lt,"<=":operator.le,"=":operator.eq,"!=":operator.ne}
+
+#%% Logging config
+logger=logger_setup("logger_setup","server.log")
+
+#%% Functions
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required to read or write archived expenses")
+
+def archive_schema():
+    require_pyarrow()
+    return pa.schema([
+        ("id",pa.int64()),
+        ("expense_date",pa.date32()),
+        ("amount",pa.float64()),
+        ("category",pa.string()),
+        ("notes",pa.string()),
+        ("owner_id",pa.string())
+    ])
+
+def shard_dir(shard):
+    return os.path.join(ARCHIVE_DIR,f"shard_{shard.index}")
+
+def month_path(shard,month):
+    '''
+        Description:
+            Function to get the Parquet file of a shard and month
+        Inputs:
+            shard (Shard): Shard of the expenses
+            month (date): First day of the month
+        Returns:
+            path (str): Path of the month file
+    '''
+    return os.path.join(shard_dir(shard),f"{month:%Y-%m}.parquet")
+
+def archived_months(shard):
+    '''
+        Description:
+            Function to list the archived months of a shard
+        Returns:
+            months (list): First day of each archived month, sorted
+    '''
+    if not os.path.isdir(shard_dir(shard)):
+        return []
+    months=[]
+    for file_name in os.listdir(shard_dir(shard)):
+        match=re.fullmatch(r"(\d{4})-(\d{2})\.parquet",file_name)
+        if match:
+            months.append(datetime.date(int(match.group(1)),int(match.group(2)),1))
+    return sorted(months)
+
+def month_end(month):
+    return (month.replace(day=28)+datetime.timedelta(days=4)).replace(day=1)-datetime.timedelta(days=1)
+
+def coerce_value(column,value):
+    '''
+        Description:
+            Function to convert a where value to the type of the archived column. Payload values can come as strings
+    '''
+    if column=="expense_date":
+        return value if isinstance(value,datetime.date) else datetime.date.fromisoformat(str(value))
+    if column=="amount":
+        return float(value)
+    return str(value)
+
+def like_to_regex(pattern):
+    '''
+        Description:
+            Function to translate a SQL LIKE pattern to a regular expression
+    '''
+    return re.compile("".join(".*" if char=="%" else "." if char=="_" else re.escape(char) for char in pattern),re.DOTALL)
+
+def form_conditions(where_dict,operator_dict,owner=None,start_date=None,end_date=None):
+    '''
+        Description:
+            Function to form the (column, operator, value) conditions evaluated on archived rows
+        Inputs:
+            where_dict (dictionary): Validated where conditions
+            operator_dict (dictionary): Validated operators
+            owner (str): Optional owner id
+            start_date, end_date (date): Optional date range
+        Returns:
+            conditions (list): Conditions with values coerced to the column types
+    '''
+    conditions=[(key,operator_dict[key],coerce_value(key,value)) for key,value in where_dict.items()]
+    if owner is not None:
+        conditions.append(("owner_id","=",owner))
+    if start_date is not None:
+        conditions.append(("expense_date",">=",coerce_value("expense_date",start_date)))
+    if end_date is not None:
+        conditions.append(("expense_date","<=",coerce_value("expense_date",end_date)))
+    return conditions
+
+def range_may_match(column,low,high,conditions):
+    '''
+        Description:
+            Function to check if a column with values between low and high can satisfy the conditions. Used to skip files and row groups
+        Returns:
+            may_match (bool): False only when no value of the range can match
+    '''
+    for condition_column,condition_operator,value in conditions:
+        if condition_column!=column or low is None or high is None:
+            continue
+        if condition_operator=="=" and not low<=value<=high:
+            return False
+        if condition_operator==">" and not high>value:
+            return False
+        if condition_operator==">=" and not high>=value:
+            return False
+        if condition_operator=="<" and not low<value:
+            return False
+        if condition_operator=="<=" and not low<=value:
+            return False
+        if condition_operator=="!=" and low==high==value:
+            return False
+    return True
+
+def row_matches(row,conditions):
+    '''
+        Description:
+            Function to evaluate the conditions on one archived row. NULL values never match, as in SQL
+    '''
+    for column,condition_operator,value in conditions:
+        row_value=row[column]
+        if row_value is None:
+            return False
+        if condition_operator=="like":
+            if not like_to_regex(value).fullmatch(row_value):
+                return False
+        elif not COMPARATORS[condition_operator](row_value,value):
+            return False
+    return True
+
+def read_archive(shard,where_dict=None,operator_dict=None,owner=None,start_date=None,end_date=None):
+    '''
+        Description:
+            Function to read the archived rows of a shard matching the conditions. Month files and row groups whose
+            expense_date, amount, category and owner_id statistics can not match are not read
+        Inputs:
+            shard (Shard): Shard of the expenses
+            where_dict (dictionary): Validated where conditions
+            operator_dict (dictionary): Validated operators
+            owner (str): Optional owner id
+            start_date, end_date (date): Optional date range
+        Returns:
+            rows (list): Matching rows as dictionaries with ARCHIVE_COLUMNS
+    '''
+    months=archived_months(shard)
+    if not months:
+        return []
+    conditions=form_conditions(where_dict or {},operator_dict or {},owner,start_date,end_date)
+    rows=[]
+    for month in months:
+        if not range_may_match("expense_date",month,month_end(month),conditions):
+            continue
+        require_pyarrow()
+        parquet_file=pq.ParquetFile(month_path(shard,month))
+        metadata=parquet_file.metadata
+        row_groups=[]
+        for group_index in range(metadata.num_row_groups):
+            row_group=metadata.row_group(group_index)
+            may_match=True
+            for column_index in range(row_group.num_columns):
+                column=row_group.column(column_index)
+                statistics=column.statistics
+                if statistics is not None and statistics.has_min_max:
+                    may_match=may_match and range_may_match(column.path_in_schema,statistics.min,statistics.max,conditions)
+            if may_match:
+                row_groups.append(group_index)
+        if row_groups:
+            table=parquet_file.read_row_groups(row_groups,columns=ARCHIVE_COLUMNS)
+            rows+=[row for row in table.to_pylist() if row_matches(row,conditions)]
+    logger.info(f"Archive read: shard {shard.index} | results:{len(rows)}")
+    return rows
+
+def summarize_archive(shard,owner=None,start_date=None,end_date=None,top=5):
+    '''
+        Description:
+            Function to compute the analytics of the archived rows of a date range with Arrow compute, so archived rows never become
+            Python objects. Only id, amount and category are read for the totals, the full columns only for the top expenses
+        Inputs:
+            shard (Shard): Shard of the expenses
+            owner (str): Optional owner id
+            start_date, end_date (date): Optional date range
+            top (int): Number of top expenses
+        Returns:
+            category_totals (list): Category, records and total_expense of every archived category of the range
+            top_expenses (list): Top expenses of the range as dictionaries with ARCHIVE_COLUMNS
+    '''
+    conditions=form_conditions({},{},owner,start_date,end_date)
+    filters=[(column,"==" if condition_operator=="=" else condition_operator,value) for column,condition_operator,value in conditions] or None
+    totals={}
+    top_expenses=[]
+    for month in archived_months(shard):
+        if not range_may_match("expense_date",month,month_end(month),conditions):
+            continue
+        require_pyarrow()
+        path=month_path(shard,month)
+        table=pq.read_table(path,columns=["id","amount","category"],filters=filters) #Row groups are pruned with the filter statistics
+        if table.num_rows==0:
+            continue
+        grouped=table.group_by("category").aggregate([("amount","count"),("amount","sum")])
+        for category,records,total in zip(grouped["category"].to_pylist(),grouped["amount_count"].to_pylist(),grouped["amount_sum"].to_pylist()):
+            category_total=totals.setdefault(category,[0,0.0])
+            category_total[0]+=records
+            category_total[1]+=total
+        top_ids=table.take(pc.select_k_unstable(table,k=top,sort_keys=[("amount","descending")]))["id"].to_pylist()
+        top_expenses+=pq.read_table(path,columns=ARCHIVE_COLUMNS,filters=[("id","in",top_ids)]).to_pylist()
+    category_totals=[{"category":category,"records":records,"total_expense":total} for category,(records,total) in totals.items()]
+    return category_totals,sorted(top_expenses,key=lambda row:row["amount"],reverse=True)[:top]
+
+def write_month(shard,month,rows):
+    '''
+        Description:
+            Function to write (or extend) the Parquet file of a month. Rows are sorted by owner and date so row group statistics prune well.
+            The file is replaced atomically
+        Inputs:
+            shard (Shard): Shard of the expenses
+            month (date): First day of the month
+            rows (list): Rows as dictionaries with ARCHIVE_COLUMNS
+    '''
+    require_pyarrow()
+    path=month_path(shard,month)
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    if os.path.exists(path):
+        rows=pq.read_table(path).to_pylist()+rows
+    rows=sorted({row["id"]:row for row in rows}.values(),key=lambda row:(row["owner_id"],row["expense_date"],row["id"])) #Ids already archived by an interrupted run are kept once
+    table=pa.Table.from_pylist([{column:row[column] for column in ARCHIVE_COLUMNS} for row in rows],schema=archive_schema())
+    pq.write_table(table,path+".tmp",compression=COMPRESSION,row_group_size=ROW_GROUP_SIZE,write_statistics=True)
+    os.replace(path+".tmp",path)
+
+def archive_before(cutoff_date):
+    '''
+        Description:
+            Function to move every full month before the month of cutoff_date from Postgres to Parquet, on every shard.
+            The file is written before the delete is committed, so a failure can leave a month in both tiers but never in none.
+            Reads take a month from its file once it exists, the Postgres copies are not counted twice. Running the archive again removes them
+        Inputs:
+            cutoff_date (str as yyyy-mm-dd or date): Months before the month of this date are archived
+        Returns:
+            archived (dictionary): Month as key and number of archived rows as value
+    '''
+    from backend import db_helper_postgre
+    cutoff_month=coerce_value("expense_date",cutoff_date).replace(day=1)
+    archived={}
+    for shard in shard_router.router.shards:
+        with db_helper_postgre.get_db_cursor(shard=shard) as cursor:
+            cursor.execute("SELECT DISTINCT date_trunc('month',expense_date)::date AS month FROM expenses WHERE expense_date<%s ORDER BY month",(cutoff_month,))
+            months=[row["month"] for row in cursor.fetchall()]
+
+        for month in months:
+            with db_helper_postgre.get_db_cursor(commit=True,shard=shard) as cursor:
+                cursor.execute(f"""SELECT {db_helper_postgre.validate_columns(None)} FROM {db_helper_postgre.EXPENSES_FROM}
+                               WHERE expense_date BETWEEN %s AND %s FOR UPDATE OF expenses""",(month,month_end(month)))
+                rows=cursor.fetchall()
+                write_month(shard,month,[dict(row) for row in rows])
+                cursor.execute("DELETE FROM expenses WHERE id = ANY(%s)",([row["id"] for row in rows],))
+            archived[f"{month:%Y-%m}"]=archived.get(f"{month:%Y-%m}",0)+len(rows)
+            logger.info(f"Archive: shard {shard.index} | month {month:%Y-%m} | records:{len(rows)}")
+    return archived
+
+def restore_month(month):
+    '''
+        Description:
+            Function to bring an archived month back to Postgres on every shard, keeping the original ids. The file is removed once the rows are committed
+        Inputs:
+            month (str as yyyy-mm or date): Month to restore
+        Returns:
+            num_records (int): Number of restored records
+    '''
+    from backend import db_helper_postgre
+    from psycopg2.extras import execute_values
+    month=coerce_value("expense_date",f"{month}-01" if isinstance(month,str) and len(month)==7 else month).replace(day=1)
+    num_records=0
+    for shard in shard_router.router.shards:
+        path=month_path(shard,month)
+        if not os.path.exists(path):
+            continue
+        require_pyarrow()
+        rows=pq.read_table(path).to_pylist()
+        columns=["category_id" if column=="category" else column for column in ARCHIVE_COLUMNS]
+        values=[tuple(db_helper_postgre.category_id(shard,row[column]) if column=="category" else row[column] for column in ARCHIVE_COLUMNS) for row in rows]
+        with db_helper_postgre.get_db_cursor(commit=True,shard=shard) as cursor:
+            execute_values(cursor,f"INSERT INTO expenses ({', '.join(columns)}) VALUES %s ON CONFLICT (id) DO NOTHING",values)
+        os.remove(path)
+        num_records+=len(rows)
+        logger.info(f"Restore: shard {shard.index} | month {month:%Y-%m} | records:{len(rows)}")
+    return num_records
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Archive and restore old expenses")
+    subparsers=parser.add_subparsers(dest="command",required=True)
+    archive_parser=subparsers.add_parser("archive",help="Move full months before a date to Parquet")
+    archive_parser.add_argument("--before",required=True,help="yyyy-mm-dd. Months before the month of this date are archived")
+    restore_parser=subparsers.add_parser("restore",help="Bring an archived month back to Postgres")
+    restore_parser.add_argument("--month",required=True,help="yyyy-mm")
+    args=parser.parse_args()
+
+    if args.command=="archive":
+        print(archive_before(args.before))
+    else:
+        print(f"Restored {restore_month(args.month)} records")
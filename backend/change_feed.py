@@ -0,0 +1,226 @@
+import asyncio
+import json
+import select
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from backend import db_helper_postgre,shard_router
+from backend.log_setup import logger_setup
+
+#%% Global variables
+SUBSCRIBER_QUEUE_SIZE =1000 #Events kept per subscriber. A slow subscriber that overflows is closed and resumes with its last event id
+LISTEN_TIMEOUT =5 #Seconds between connection checks while waiting for notifications
+RECONNECT_DELAY =2 #Seconds to wait before listening again after a lost connection
+REPLAY_PAGE_SIZE =1000 #Events read per query when replaying missed events
+
+#%% Logging config
+logger=logger_setup("logger_setup","server.log")
+
+#%% Functions
+
+def event_matches(event,start_date=None,end_date=None,category=None,owner=None):
+    '''
+        Description:
+            Function to check if a change event affects a date range and a category
+        Inputs:
+            event (dictionary): Change event with owner, expense_dates and categories
+            start_date (str as yyyy-mm-dd): Optional start of the date range
+            end_date (str as yyyy-mm-dd): Optional end of the date range
+            category (str): Optional category
+            owner (str): Optional owner id
+        Returns:
+            matches (bool): True when the event has to be sent to the subscriber
+    '''
+    if owner is not None and event["owner"]!=owner:
+        return False
+    if category is not None and category not in event["categories"]:
+        return False
+    for expense_date in event["expense_dates"]: #yyyy-mm-dd strings compare in date order
+        if (start_date is None or expense_date>=str(start_date)) and (end_date is None or expense_date<=str(end_date)):
+            return True
+    return False
+
+def format_sse(event):
+    '''
+        Description:
+            Function to format a change event as a server-sent event. The id lets clients resume with Last-Event-ID
+        Inputs:
+            event (dictionary): Change event
+        Returns:
+            message (str): Server-sent event message
+    '''
+    return f"id: {event['id']}\nevent: {event['action']}\ndata: {json.dumps(event)}\n\n"
+
+async def replay_and_follow(subscription,last_event_id,retrieve_page,is_disconnected,keep_alive):
+    '''
+        Description:
+            Async generator of the messages of one subscriber. Events missed after last_event_id are replayed page by page until a short page,
+            then live events are sent. Events of an owner commit in id order (see record_change), so the replay after last_event_id misses none.
+            Live events are still only skipped when the replay sent them, not by comparing ids
+        Inputs:
+            subscription (Subscription): Subscription registered before the replay, so events committed during the replay are not lost
+            last_event_id (int): Last-Event-ID of the client. No replay when None
+            retrieve_page (function): Function receiving an event id and a limit, returning the events after that id ordered by id
+            is_disconnected (function): Coroutine function returning True once the client is gone
+            keep_alive (float): Seconds without events before a keep-alive comment is sent
+        Returns:
+            messages (str): Server-sent event messages
+    '''
+    replayed=set()
+    after=last_event_id
+    while after is not None:
+        events=await asyncio.to_thread(retrieve_page,after,REPLAY_PAGE_SIZE)
+        for event in events:
+            replayed.add(event["id"])
+            if subscription.matches(event):
+                yield format_sse(event)
+        if len(events)<REPLAY_PAGE_SIZE:
+            break
+        after=events[-1]["id"]
+
+    while not await is_disconnected():
+        try:
+            event=await asyncio.wait_for(subscription.queue.get(),timeout=keep_alive)
+        except asyncio.TimeoutError:
+            yield ": keep-alive\n\n"
+            continue
+        if event is None: #Subscriber overflow. The client reconnects with Last-Event-ID
+            break
+        if event["id"] in replayed: #Committed before the replay read it, already sent
+            replayed.discard(event["id"])
+            continue
+        yield format_sse(event)
+
+class Subscription:
+    '''
+        Description:
+            Queue of change events for one subscriber, filtered by date range and category
+    '''
+    def __init__(self,loop,owner,start_date=None,end_date=None,category=None):
+        self.loop=loop
+        self.owner=owner
+        self.queue=asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.start_date=start_date
+        self.end_date=end_date
+        self.category=category
+
+    def matches(self,event):
+        return event_matches(event,self.start_date,self.end_date,self.category,self.owner)
+
+    def put(self,event):
+        '''
+            Description:
+                Add an event to the queue. Called in the event loop. None is queued on overflow to close the stream
+        '''
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Change feed subscriber overflow, closing stream")
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+class ChangeFeed:
+    '''
+        Description:
+            Background listener of the expense_changes channel of one shard. One dedicated connection per process and shard LISTENs and fans the events out to the subscribers
+    '''
+    def __init__(self,shard,channel=db_helper_postgre.CHANGE_CHANNEL):
+        self.shard=shard
+        self.channel=channel
+        self.subscribers=set()
+        self.lock=threading.Lock()
+        self.thread=None
+
+    def start(self):
+        '''
+            Description:
+                Start the listener thread if it is not running
+        '''
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread=threading.Thread(target=self.run,name=f"change_feed_{self.shard.index}",daemon=True)
+                self.thread.start()
+
+    def subscribe(self,owner,start_date=None,end_date=None,category=None):
+        '''
+            Description:
+                Register a subscriber. Must be called from the event loop serving the subscriber
+            Returns:
+                subscription (Subscription): Queue of matching events
+        '''
+        subscription=Subscription(asyncio.get_running_loop(),owner,start_date,end_date,category)
+        with self.lock:
+            self.subscribers.add(subscription)
+        self.start()
+        return subscription
+
+    def unsubscribe(self,subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def dispatch(self,event):
+        '''
+            Description:
+                Send an event to the matching subscribers. Called from the listener thread
+        '''
+        with self.lock:
+            subscribers=list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.loop.call_soon_threadsafe(subscription.put,event)
+
+    def handle_notification(self,payload):
+        '''
+            Description:
+                Parse a NOTIFY payload. Truncated events are read back from expense_events
+        '''
+        event=json.loads(payload)
+        if event.get("truncated"):
+            events=db_helper_postgre.retrieve_events_since(event["id"]-1,limit=1,owner=event["owner"])
+            if len(events)==0:
+                return
+            event=events[0]
+        self.dispatch(event)
+
+    def run(self):
+        '''
+            Description:
+                Listener loop. Reconnects when the connection is lost, subscribers recover the gap through Last-Event-ID
+        '''
+        while True:
+            connect=None
+            try:
+                connect=psycopg2.connect(self.shard.dsn)
+                connect.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor=connect.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                logger.info(f"Change feed: listening on {self.channel} | shard {self.shard.index}")
+
+                while True:
+                    if select.select([connect],[],[],LISTEN_TIMEOUT)==([],[],[]):
+                        continue
+                    connect.poll()
+                    while connect.notifies:
+                        notification=connect.notifies.pop(0)
+                        self.handle_notification(notification.payload)
+            except Exception as e:
+                logger.error(f"Change feed: listener failed, reconnecting. {e}")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                if connect is not None:
+                    connect.close()
+
+change_feeds=[ChangeFeed(shard) for shard in shard_router.router.shards]
+
+def change_feed_for(owner):
+    '''
+        Description:
+            Function to get the change feed of the shard holding an owner
+        Inputs:
+            owner (str): Owner id
+        Returns:
+            change_feed (ChangeFeed): Listener of the owner shard
+    '''
+    return change_feeds[shard_router.router.shard_for(owner).index]
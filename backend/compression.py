@@ -0,0 +1,197 @@
+'''
+Negotiated response compression for the backend. Picks zstd, brotli or gzip from the Accept-Encoding header of the
+request, in that order of preference when the client accepts several, and compresses the body chunk by chunk so
+streamed responses are compressed as they are sent. Small bodies, already encoded bodies, server-sent events and
+bodiless responses are sent as they are. Big bodies and chunks are compressed in a worker thread so the event loop
+keeps serving the other requests of the process.
+'''
+import asyncio
+import os
+import re
+import zlib
+
+try:
+    import zstandard
+except ImportError: #zstd is only offered when installed
+    zstandard=None
+
+try:
+    import brotli
+except ImportError: #brotli is only offered when installed
+    brotli=None
+
+#%% Global variables
+COMPRESSION_MIN_BYTES =int(os.getenv("COMPRESSION_MIN_BYTES","1024")) #Smaller bodies are sent uncompressed, the headers would cost more than the savings
+COMPRESSION_THREAD_BYTES =int(os.getenv("COMPRESSION_THREAD_BYTES","65536")) #Bigger bodies and chunks are compressed off the event loop. Smaller ones take less than the thread hop
+COMPRESSION_LEVEL_RANGES ={"zstd":(1,9),"br":(1,6),"gzip":(1,6)} #Higher levels cost much more CPU for a few percent less bytes
+COMPRESSION_LEVELS ={
+    "zstd":int(os.getenv("COMPRESSION_LEVEL_ZSTD","3")),
+    "br":int(os.getenv("COMPRESSION_LEVEL_BR","4")),
+    "gzip":int(os.getenv("COMPRESSION_LEVEL_GZIP","5"))
+}
+UNCOMPRESSED_TYPES =("text/event-stream","image/","video/","audio/","application/zip","application/gzip")
+
+#%% Functions
+
+def available_encodings():
+    '''
+        Description:
+            Function to list the encodings this process can produce, in order of preference
+    '''
+    return [encoding for encoding,module in [("zstd",zstandard),("br",brotli),("gzip",zlib)] if module is not None]
+
+def bounded_level(encoding,level=None):
+    '''
+        Description:
+            Function to clamp a compression level to the allowed range of an encoding
+        Inputs:
+            encoding (str): zstd, br or gzip
+            level (int): Requested level. The configured level when None
+        Returns:
+            level (int): Level inside COMPRESSION_LEVEL_RANGES
+    '''
+    low,high=COMPRESSION_LEVEL_RANGES[encoding]
+    return min(max(COMPRESSION_LEVELS[encoding] if level is None else level,low),high)
+
+def select_encoding(accept_encoding,encodings=None):
+    '''
+        Description:
+            Function to negotiate the response encoding from an Accept-Encoding header. Highest q value wins, server preference breaks ties
+        Inputs:
+            accept_encoding (str): Accept-Encoding header of the request
+            encodings (list): Encodings the server can produce, in order of preference
+        Returns:
+            encoding (str): Selected encoding. None when the response has to be sent uncompressed
+    '''
+    encodings=available_encodings() if encodings is None else encodings
+    weights={}
+    for item in (accept_encoding or "").lower().split(","):
+        match=re.fullmatch(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*",item)
+        if match:
+            try:
+                weights[match.group(1)]=float(match.group(2)) if match.group(2) is not None else 1.0
+            except ValueError:
+                continue
+    candidates=[(weights.get(encoding,weights.get("*",0.0)),-index,encoding) for index,encoding in enumerate(encodings)]
+    candidates=[candidate for candidate in candidates if candidate[0]>0]
+    return max(candidates)[2] if candidates else None
+
+class StreamCompressor:
+    '''
+        Description:
+            Incremental compressor of one response. compress returns the bytes ready to send for a chunk, finish closes the stream
+    '''
+    def __init__(self,encoding,level=None):
+        level=bounded_level(encoding,level)
+        self.encoding=encoding
+        if encoding=="zstd":
+            self.compressor=zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding=="br":
+            self.compressor=brotli.Compressor(quality=level)
+        else:
+            self.compressor=zlib.compressobj(level,zlib.DEFLATED,31) #31 writes the gzip header and trailer
+
+    def compress(self,chunk,flush=False):
+        '''
+            Description:
+                Compress a chunk. Flushed chunks can be decoded by the client right away, used between the chunks of streamed responses
+        '''
+        if self.encoding=="br":
+            data=self.compressor.process(chunk)
+            return data+self.compressor.flush() if flush else data
+        data=self.compressor.compress(chunk)
+        if not flush:
+            return data
+        if self.encoding=="zstd":
+            return data+self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return data+self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding=="br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def compress_body(body,encoding,level=None):
+    '''
+        Description:
+            Function to compress a whole body, used by the benchmark and the tests
+    '''
+    compressor=StreamCompressor(encoding,level)
+    return compressor.compress(body)+compressor.finish()
+
+class CompressionMiddleware:
+    '''
+        Description:
+            ASGI middleware compressing the responses with the encoding negotiated with the client.
+            The decision is taken on the first body chunk: a single chunk under minimum_size is sent as it is
+    '''
+    def __init__(self,app,minimum_size=COMPRESSION_MIN_BYTES,encodings=None,thread_size=COMPRESSION_THREAD_BYTES):
+        self.app=app
+        self.minimum_size=minimum_size
+        self.encodings=available_encodings() if encodings is None else encodings
+        self.thread_size=thread_size
+
+    async def run(self,function,data,*args):
+        '''
+            Description:
+                Run a compression call, in a worker thread when the data is big enough to block the event loop
+        '''
+        if len(data)>=self.thread_size:
+            return await asyncio.to_thread(function,data,*args)
+        return function(data,*args)
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"]!="http":
+            await self.app(scope,receive,send)
+            return
+        headers={key.decode("latin-1").lower():value.decode("latin-1") for key,value in scope["headers"]}
+        encoding=select_encoding(headers.get("accept-encoding"),self.encodings)
+        if encoding is None:
+            await self.app(scope,receive,send)
+            return
+
+        state={"start":None,"compressor":None,"passthrough":False}
+
+        async def compressed_send(message):
+            if message["type"]=="http.response.start":
+                response_headers={key.decode("latin-1").lower():value.decode("latin-1") for key,value in message.get("headers",[])}
+                content_type=response_headers.get("content-type","")
+                state["passthrough"]=(message["status"] in (204,304) or "content-encoding" in response_headers
+                                      or content_type.startswith(UNCOMPRESSED_TYPES))
+                if state["passthrough"]:
+                    await send(message)
+                else:
+                    state["start"]=message #Held until the first body chunk shows if the body is worth compressing
+                return
+            if message["type"]!="http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body=message.get("body",b"")
+            more_body=message.get("more_body",False)
+            if state["start"] is not None:
+                start=state["start"]
+                state["start"]=None
+                if not more_body and len(body)<self.minimum_size:
+                    state["passthrough"]=True
+                    await send(start)
+                    await send(message)
+                    return
+                start_headers=[(key,value) for key,value in start.get("headers",[]) if key.lower() not in (b"content-length",b"vary")]
+                vary=[value.decode("latin-1") for key,value in start.get("headers",[]) if key.lower()==b"vary"]
+                start_headers+=[(b"content-encoding",encoding.encode("latin-1")),
+                                (b"vary",", ".join(vary+["Accept-Encoding"]).encode("latin-1"))]
+                if not more_body:
+                    compressed=await self.run(compress_body,body,encoding)
+                    start_headers.append((b"content-length",str(len(compressed)).encode("latin-1")))
+                    await send({**start,"headers":start_headers})
+                    await send({"type":"http.response.body","body":compressed,"more_body":False})
+                    return
+                state["compressor"]=StreamCompressor(encoding)
+                await send({**start,"headers":start_headers})
+
+            compressor=state["compressor"] #Chunks of a response are sent in order, so one thread at a time uses the compressor
+            data=await self.run(compressor.compress,body,more_body)+(b"" if more_body else compressor.finish())
+            await send({"type":"http.response.body","body":data,"more_body":more_body})
+
+        await self.app(scope,receive,compressed_send)
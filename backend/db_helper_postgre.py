@@ -1,330 +1,1325 @@
-import psycopg2
-from psycopg2 import extensions
-from psycopg2.extras import RealDictCursor
-import contextlib
-from contextlib import contextmanager
-from backend.log_setup import logger_setup
-import os
-#%% Global variables
-ALLOWED_COLUMNS =["expense_date","amount","category","notes"]
-ALLOWED_OPERATORS =[">",">=","<","<=","=","!=","like"]
-
-#%% Logging config
-logger=logger_setup("logger_setup","server.log")
-
-
-#%% Functions
-
-@contextmanager #This decorator will help us to use the cursor object (which execute queries) along all CRUD operations
-def get_db_cursor(commit=False): #We will set commit option as false to only commit changes that come from Create Update and Delete operations
-    '''
-        Description:
-            Generator to establish connection with a cloud postgre serverand manage the transaction scope
-        Inputs:
-            commit (Bool): Set to False as default, when set to true in Create Update and Delete operations will commit changes to the database    
-    '''
-    
-    #******* Establishing connection
-    logger.info(f"Connection attempt...")
-    connect = psycopg2.connect(os.getenv("DATABASE_URL"))
-
-    if connect.status==extensions.STATUS_READY:
-        logger.info("Connection result: Success")
-    else:
-        logger.error("Connection result: Failed")
-        raise ConnectionError ("Python was unable to connect to local host")
-        
-    #****** Setting the cursor object. This will help us execute and extract the results from queries
-    cursor = connect.cursor(cursor_factory=RealDictCursor) # Dict option will return results as a python dictionary instead of tuples
-
-    yield cursor # This will work as the generator that will save us code in the rest of the CRUD processes
-
-    #****** Commit changes if needed
-
-    if commit:
-        connect.commit()
-        logger.info("Changes committed successfully")
-
-    cursor.close()
-    connect.close()
-    logger.info("Disconnection: Success \n")
-
-def create_record(expense_date,amount,category,notes):
-    '''
-        Description:
-            Function for Create operation in expenses table
-        Inputs:
-            expense_date (str as yyy-mm-dd): Expense date
-            amount(float): Amount of the expense
-            category (str): Category of the expense
-            notes (str): Descriptive note of the expense 
-    '''
-    logger.info(f"Function call: create_record")
-    #********* Executing the query
-    with get_db_cursor(commit=True) as cursor: #This will use the generator and save us the effort to write close and commit in the conding and during the unitary testing
-        query='''
-            INSERT INTO
-                expenses (expense_date,amount,category,notes)
-            VALUES
-                (%s,%s,%s,%s)
-        ''' # %s works as a place holder where we will insert our parammeters
-        
-        #Try to execute the query. Raise 
-        try:
-            cursor.execute(query,(expense_date,amount,category,notes)) #We pass all the arguments tu cursor execution
-            logger.info(f"Record creation: |date:{expense_date} | amount:{amount} | category:{category} | notes:{notes}| with success")
-        except Exception as e:
-            logger.error(f"creating record expense date:{expense_date} | amount:{amount} | category:{category} | notes:{notes}. {e}")
-            raise RuntimeError(f"Unable to create record. {e}")
-    
-def retrieve_date(date_retrieval):
-    '''
-        Description:
-            Function used to retrieve information from a certain date from expenses table
-        Inputs:
-            date_retrieval (str as yyyy-mm-dd): Date to retrieve information
-    '''
-    logger.info(f"Function call: retrieve_date")
-    #********* Executing the query
-    with get_db_cursor() as cursor: 
-        query='''
-            SELECT
-                *
-            FROM
-                expenses
-            WHERE
-                expense_date=(%s) 
-        '''
-        #Try to execute the query
-        try:
-            cursor.execute(query,(date_retrieval,)) #query execution
-            results=cursor.fetchall() #Get the query results
-            logger.info(f"Data retrieved: date {date_retrieval} with success | results:{len(results)}")
-        except Exception as e:
-            logger.error(f"Retrieving information for date {date_retrieval} Failed - {e}")
-            raise RuntimeError("Error at retrieving date information. Check syntax")
- 
-    return results
-
-
-def validate_where_clause(where_dict,operator_dict):
-    '''
-        Description:
-            Function used to validate if the given where clause conditions are valid according to existing column names and possible operators
-        Inputs
-            where_dict (dictionary): Dictionary to retrieve information based on where conditions. Contains column name and value
-            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
-    '''
-    logger.info(f"Where dict received: {where_dict}")
-    logger.info(f"Operator dict received: {operator_dict}")
-
-    for key in where_dict.keys():
-        if key not in ALLOWED_COLUMNS:
-            logger.error("Passing invalid column name in payload")
-            raise ValueError(f"Column name not in allowed columns")
-        if operator_dict[key] not in ALLOWED_OPERATORS:
-            logger.error("Passing invalid operator in payload")
-            raise ValueError(f"Operator {operator_dict[key]} not in allowed operators")
-
-def keys_to_remove(in_dict):
-    '''
-        Description:
-            Function to remove all inputs that are None from in_dict
-        Inputs:
-            in_dict(dictionary): Dictionary to clean
-        Outputs:
-            in_dict: Dictionary updated
-    '''
-
-    keys_to_remove = [key for key, val in in_dict.items() if val is None] #Get the items to remove from the dictionary
-    
-    for key in keys_to_remove:
-        in_dict.pop(key,None)
-    
-    return in_dict 
-def retrieve_custom_query(where_dict,operator_dict):
-    '''
-        Description:
-            Function used to execute a custom query given by user in expenses table. READ ONLY QUERY
-        Inputs:
-            where_dict (dictionary): Dictionary to retrieve information based on where conditions. Contains column name and value
-            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
-    '''
-    logger.info(f"Function call: retrieve_custom_query")
-
-    where_dict=keys_to_remove(where_dict)
-    operator_dict=keys_to_remove(operator_dict)
-
-    #******** Validating the where clause conditions
-    validate_where_clause(where_dict,operator_dict)
-
-    #******** Forming the query
-    where_clause=" And ".join([f"{key} {operator_dict[key]} %s" for key in where_dict.keys()])
-    query=f"SELECT * FROM expenses WHERE {where_clause}"
-    params=list(where_dict.values())
-
-    #******** Executing the custom query
-    with get_db_cursor() as cursor:
-        try:
-            cursor.execute(query,params)
-        except Exception as e:
-            logger.error(f"Failed at executing custom query. Check syntax")
-            raise RuntimeError (f"Database error {e}")
-        results=cursor.fetchall()
-        logger.info(f"Data retrieved: Custom query executed with success | results:{len(results)}")
-
-    return results
-
-def update_record(set_dict,where_dict,operator_dict):
-    '''
-        Description:
-            Function to update a record in expenses table
-        Inputs:
-            set_dict (dictonary): Dictionary with key as column name, and value as new value for column
-            where_dict (dictionary): Dictionary containing the mapping for where clause, where key is column name, and value is mapping parammeter 
-            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
-        Returns
-            num_records (float): Number of records affected 
-    '''    
-    logger.info(f"Function call: update_record")
-    
-    #******** Validating the where clause conditions
-    set_dict=keys_to_remove(set_dict)
-    where_dict=keys_to_remove(where_dict)
-    operator_dict=keys_to_remove(operator_dict)
-
-    validate_where_clause(where_dict,operator_dict)
-    
-    #******** Form the query
-    set_query= ", ".join([f"{key}=%s" for key in set_dict.keys()]) 
-    where_clause=" AND ".join([f"{key} {operator_dict[key]} %s" for key in where_dict.keys()])
-    query=f"UPDATE expenses SET {set_query} WHERE {where_clause}"
-    logger.info(f"Update query {query}")
-    #Form the placeholder list
-    params=list(set_dict.values())+list(where_dict.values())
-
-    #******** Execute the query
-    with get_db_cursor(commit=True) as cursor:
-        try:
-            cursor.execute(query,params)
-            num_records=cursor.rowcount
-            logger.info(f"Update: Record updated successfully")
-        except Exception as e:
-            logger.error(f"Unable to update record. Error {e}")
-            raise RuntimeError ("Query syntax error")
-    return num_records
-
-def delete_record(where_dict,operator_dict):
-    '''
-     Description:
-        Function to delete records from the expenses table based on WHERE conditions.
-    Inputs:
-        where_dict (dict): Column names and values to match.
-        operator_dict (dict): Operators to apply to each column condition.
-    Returns:
-        num_records (int): Number of records deleted.
-    ''' 
-    logger.info(f"Function call: delete_record")
-
-    #******** Validating the where clause conditions
-    where_dict=keys_to_remove(where_dict)
-    operator_dict=keys_to_remove(operator_dict)
-    validate_where_clause(where_dict,operator_dict)
-
-    #******** Form the query
-    where_clause=" AND ".join([f"{key} {operator_dict[key]} %s" for key in where_dict.keys()])
-    query=f"DELETE FROM expenses WHERE {where_clause}"
-
-    #Form the placeholder list
-    params=list(where_dict.values())
-
-    #******** Execute the query
-    with get_db_cursor(commit=True) as cursor:
-        try:
-            cursor.execute(query,params)
-            num_records=cursor.rowcount
-            logger.warinng(f"Deleting {num_records} from expenses table")
-            logger.info(f"Record delete: Record deleted successfully")
-        except Exception as e:
-            logger.error(f"Unable to delete record. Error {e}")
-            raise RuntimeError ("Query syntax error")
-    return num_records
-
-def expense_summary(start_date,end_date):
-    '''
-        Description
-            Function to return analytics informatation of the expenseses between a start date and an end_date
-        Inputs
-            start_date (str): Initial date of the date range
-            end_date (str): Final date of the date range
-        Returns
-            total_expenses (dictionary): Expense by category in the date range. Contains Total expenses, and number of expenses
-            top_expenses (dictionary): Top 5 expenses in the date range. Contains expense date, total expense, category, notes      
-    '''
-    logger.info("Function call: Expense analytics")
-
-    #****************************** Summary of expenses
-    #Form the query
-    query='''
-        WITH top_categories AS (
-            SELECT 
-                category,
-                SUM(amount) AS total_expense
-            FROM expenses
-            WHERE expense_date BETWEEN %s AND %s
-            GROUP BY category
-            ORDER BY total_expense DESC
-            LIMIT 5
-        ),
-        total_sum AS (
-            SELECT SUM(total_expense) AS grand_total FROM top_categories
-        )
-        SELECT 
-            t.category,
-            t.total_expense,
-            ROUND((t.total_expense * 100 / NULLIF(ts.grand_total, 0))::numeric, 2) AS perc_expense
-        FROM top_categories t
-        CROSS JOIN total_sum ts
-        '''
-
-    #Placeholder for parameters
-    params=list([start_date,end_date])
-
-    with get_db_cursor() as cursor:
-        try:
-            cursor.execute(query,params)
-            total_expenses=cursor.fetchall()
-            logger.info("Date range retrieved successfuly for analytics")
-        except Exception as e:
-            logger.error("Failed to retrieve date range for analytics")
-            raise RuntimeError("Error retrieving date range")
-
-    #****************************** Top expenses
-    #Form the query
-    query="SELECT * FROM expenses WHERE expense_date BETWEEN %s AND %s ORDER BY amount  DESC LIMIT 5"
-
-    #Placeholder for parameters
-    params=list([start_date,end_date])
-
-    with get_db_cursor() as cursor:
-        try:
-            cursor.execute(query, params)
-            top_expenses = cursor.fetchall()
-            if len(top_expenses) == 0 and len(total_expenses) == 0:
-                logger.warning(f"No expenses found for range {start_date} to {end_date}")
-                raise RuntimeError("No data available for the selected date range")
-            logger.info(f"Retrieved {len(top_expenses)} top expenses for range {start_date} to {end_date}")
-        except Exception as e:
-            logger.error(f"Failed to retrieve top expenses: {e}")
-            raise RuntimeError("Error retrieving top expenses")
-
-    return total_expenses,top_expenses
-
-
-
-
-
-
-
-
-
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor,execute_values
+import contextlib
+from contextlib import contextmanager
+from dataclasses import make_dataclass
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import threading
+from backend.log_setup import logger_setup
+from backend import shard_router,archive
+from backend.slow_query import RecordingCursor,RecordingRealDictCursor
+import os
+#%% Global variables
+ALLOWED_COLUMNS =["expense_date","amount","category","notes"]
+ALLOWED_OPERATORS =[">",">=","<","<=","=","!=","like"]
+ALLOWED_AGGREGATES ={ #Aggregate function and the columns it can be applied to
+    "count":["*","expense_date","amount","category","notes"],
+    "sum":["amount"],
+    "avg":["amount"],
+    "min":["expense_date","amount"],
+    "max":["expense_date","amount"],
+    "percentile":["amount"]
+}
+ALLOWED_DATE_BUCKETS =["day","week","month","quarter","year"]
+ALLOWED_HAVING_OPERATORS =[">",">=","<","<=","=","!="]
+CHANGE_CHANNEL ="expense_changes" #Postgres NOTIFY channel for create, update and delete events
+MAX_NOTIFY_BYTES =7000 #Postgres limits NOTIFY payloads to 8000 bytes. Bigger events are only sent by id
+DEFAULT_OWNER ="public" #Owner of the expenses created before accounts existed
+ALLOWED_SAMPLE_METHODS =["system","bernoulli"] #TABLESAMPLE methods. system reads only the sampled pages, bernoulli samples rows over a full scan
+SAMPLE_UNITS ={"system":"(ctid::text::point)[0]","bernoulli":"ctid"} #Unit drawn by each method, heap page or row. Margins are computed over these units
+MIN_SAMPLE_ROWS =1000 #Approximate analytics fall back to exact totals when the sample has fewer rows in the date range
+CONFIDENCE_Z =1.96 #95% confidence bounds
+EXPENSES_FROM ="expenses JOIN categories ON categories.id=expenses.category_id" #category is stored as a SMALLINT key, reads join its name back
+COLUMN_EXPRESSIONS ={ #Select expression of each column of the joined expenses
+    "id":"expenses.id",
+    "expense_date":"expenses.expense_date",
+    "amount":"expenses.amount",
+    "category":"categories.name AS category",
+    "notes":"expenses.notes",
+    "owner_id":"expenses.owner_id"
+}
+
+#%% Logging config
+logger=logger_setup("logger_setup","server.log")
+
+#%% Category cache
+category_cache={} #Shard index as key and {name:id} of the categories table as value. Categories are reference data, loaded once per process
+category_lock=threading.Lock()
+
+#%% Functions
+
+@contextmanager #This decorator will help us to use the cursor object (which execute queries) along all CRUD operations
+def get_db_cursor(commit=False,compact=False,shard=None,uow=None): #We will set commit option as false to only commit changes that come from Create Update and Delete operations
+    '''
+        Description:
+            Generator to check out a connection from the shard pool and manage the transaction scope
+        Inputs:
+            commit (Bool): Set to False as default, when set to true in Create Update and Delete operations will commit changes to the database    
+            compact (Bool): Set to False as default, when set to true the cursor returns tuples instead of dictionaries (see compact_rows)
+            shard (Shard): Shard to connect to (see shard_router). Shard of the default owner as default
+            uow (UnitOfWork): Optional unit of work. The cursor runs in its transaction and commit is left to the unit of work
+    '''
+    if uow is not None:
+        if shard is not None and shard is not uow.shard:
+            raise ValueError(f"Unit of work is bound to shard {uow.shard.index}, not to shard {shard.index}")
+        with uow.cursor(compact) as cursor:
+            yield cursor
+        return
+
+    shard=shard or shard_router.router.shard_for(DEFAULT_OWNER)
+
+    #******* Establishing connection
+    logger.info(f"Connection attempt: shard {shard.index}")
+    connect = shard.getconn()
+
+    if connect.status==extensions.STATUS_READY:
+        logger.info("Connection result: Success")
+    else:
+        logger.error("Connection result: Failed")
+        shard.putconn(connect,close=True)
+        raise ConnectionError ("Python was unable to connect to local host")
+        
+    #****** Setting the cursor object. This will help us execute and extract the results from queries. Recording cursors feed the slow query log
+    cursor = connect.cursor(cursor_factory=RecordingCursor if compact else RecordingRealDictCursor) # Dict option will return results as a python dictionary instead of tuples
+
+    try:
+        yield cursor # This will work as the generator that will save us code in the rest of the CRUD processes
+
+        #****** Commit changes if needed. Otherwise the read transaction is closed before the connection goes back to the pool
+        if commit:
+            connect.commit()
+            logger.info("Changes committed successfully")
+        else:
+            connect.rollback()
+    except Exception:
+        if not connect.closed:
+            connect.rollback()
+        raise
+    finally:
+        cursor.close()
+        shard.putconn(connect,close=bool(connect.closed))
+        logger.info("Disconnection: Success \n")
+
+class UnitOfWork:
+    '''
+        Description:
+            One connection and transaction of a shard shared by several helper calls, i.e. a write and the read back of a request.
+            Committed once when the block ends without error, rolled back otherwise. Calls nested inside another call of the unit of work
+            run in a savepoint, so a failed nested call is undone without aborting the outer one. A failed top level call fails the unit of work
+
+        Usage:
+            with UnitOfWork(owner) as uow:
+                create_record(expense_date,amount,category,notes,owner,uow=uow)
+                rows=retrieve_date(expense_date,owner=owner,uow=uow)
+    '''
+    def __init__(self,owner=DEFAULT_OWNER,shard=None):
+        self.shard=shard or shard_router.router.shard_for(owner)
+        self.connect=None
+        self.depth=0
+
+    def __enter__(self):
+        logger.info(f"Unit of work: shard {self.shard.index}")
+        self.connect=self.shard.getconn()
+        if self.connect.status!=extensions.STATUS_READY:
+            logger.error("Connection result: Failed")
+            self.shard.putconn(self.connect,close=True)
+            self.connect=None
+            raise ConnectionError ("Python was unable to connect to local host")
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        connect,self.connect=self.connect,None
+        try:
+            if exc_type is None:
+                try:
+                    connect.commit()
+                    logger.info("Unit of work committed successfully")
+                except Exception as e:
+                    logger.error(f"Unable to commit unit of work. {e}")
+                    raise RuntimeError(f"Unable to commit unit of work. {e}")
+            elif not connect.closed:
+                connect.rollback()
+                logger.warning(f"Unit of work rolled back. {exc_value}")
+        finally:
+            if not connect.closed and connect.status!=extensions.STATUS_READY:
+                connect.rollback() #Failed commit
+            self.shard.putconn(connect,close=bool(connect.closed))
+        return False
+
+    @contextmanager
+    def cursor(self,compact=False):
+        '''
+            Description:
+                Cursor of one helper call. Nested calls get a savepoint, top level calls run directly in the transaction to save the round trips
+            Inputs:
+                compact (bool): When true the cursor returns tuples instead of dictionaries
+        '''
+        if self.connect is None:
+            raise RuntimeError("Unit of work is not active, use it as a context manager")
+        savepoint=f"unit_of_work_{self.depth}" if self.depth>0 else None
+        self.depth+=1
+        control=self.connect.cursor(cursor_factory=extensions.cursor) #Savepoint statements stay out of the slow query log
+        cursor=self.connect.cursor(cursor_factory=RecordingCursor if compact else RecordingRealDictCursor)
+        try:
+            if savepoint:
+                control.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield cursor
+            except Exception:
+                if savepoint and not self.connect.closed:
+                    control.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                raise
+            if savepoint:
+                control.execute(f"RELEASE SAVEPOINT {savepoint}")
+        finally:
+            cursor.close()
+            control.close()
+            self.depth-=1
+
+@lru_cache(maxsize=None)
+def compact_row_type(columns):
+    '''
+        Description:
+            Function to create (once per column set) a __slots__ row class. Rows take a fraction of the memory of a dictionary and serialize directly with orjson
+        Inputs:
+            columns (tuple): Column names of the result set
+        Returns:
+            row_type (class): Frozen slots dataclass with one attribute per column
+    '''
+    return make_dataclass("ExpenseRow",columns,slots=True,frozen=True)
+
+def compact_rows(cursor):
+    '''
+        Description:
+            Function to fetch the results of a compact (tuple) cursor as compact rows
+        Inputs:
+            cursor (cursor): Executed cursor from get_db_cursor(compact=True)
+        Returns:
+            rows (list): List of compact rows
+    '''
+    row_type=compact_row_type(tuple(column.name for column in cursor.description))
+    return [row_type(*row) for row in cursor.fetchall()]
+
+def validate_columns(columns):
+    '''
+        Description:
+            Function used to validate the columns requested in a select clause
+        Inputs:
+            columns (list): Column names to retrieve
+        Returns:
+            select_clause (str): Column expressions joined for the select clause over EXPENSES_FROM. All columns when no columns are given
+    '''
+    if not columns:
+        return ", ".join(COLUMN_EXPRESSIONS[column] for column in archive.ARCHIVE_COLUMNS)
+    for column in columns:
+        if column not in ALLOWED_COLUMNS:
+            logger.error("Passing invalid select column")
+            raise ValueError(f"Column {column} not in allowed columns")
+    return ", ".join(COLUMN_EXPRESSIONS[column] for column in columns)
+
+def load_categories(shard,cursor=None,uow=None):
+    '''
+        Description:
+            Function to read the categories table of a shard into the category cache
+        Inputs:
+            shard (Shard): Shard to read
+            cursor (cursor): Optional dictionary cursor of an open transaction, so no second connection is checked out
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            categories (dictionary): Category name as key and id as value
+    '''
+    if cursor is None:
+        with get_db_cursor(shard=shard,uow=uow) as cursor:
+            return load_categories(shard,cursor)
+    try:
+        cursor.execute("SELECT id,name FROM categories")
+        categories={row["name"]:row["id"] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Failed to retrieve categories | shard {shard.index}: {e}")
+        raise RuntimeError("Error retrieving categories")
+    with category_lock:
+        category_cache[shard.index]=categories
+    logger.info(f"Categories loaded | shard {shard.index} | categories:{len(categories)}")
+    return categories
+
+def category_ids(shard,cursor=None,uow=None):
+    '''
+        Description:
+            Function to get the cached categories of a shard, loading them on first use
+        Returns:
+            categories (dictionary): Category name as key and id as value
+    '''
+    categories=category_cache.get(shard.index)
+    return categories if categories is not None else load_categories(shard,cursor,uow)
+
+def category_id(shard,name,uow=None):
+    '''
+        Description:
+            Function to validate the category of a write and translate it to its id. The cache is reloaded once before rejecting a name,
+            in case the category was added after it was loaded
+        Inputs:
+            shard (Shard): Shard of the write
+            name (str): Category name
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            category_id (int): Id of the category
+    '''
+    categories=category_ids(shard,uow=uow)
+    if name not in categories:
+        categories=load_categories(shard,uow=uow)
+    if name not in categories:
+        logger.error(f"Passing invalid category {name}")
+        raise ValueError(f"Category {name} not in categories {sorted(categories)}")
+    return categories[name]
+
+def category_names(shard,ids,cursor=None):
+    '''
+        Description:
+            Function to get the id to name mapping of a shard covering the given ids
+        Inputs:
+            shard (Shard): Shard the ids come from
+            ids (list): Category ids to translate
+            cursor (cursor): Optional dictionary cursor of an open transaction, used when the cache has to be reloaded
+        Returns:
+            names (dictionary): Category id as key and name as value
+    '''
+    categories=category_ids(shard,cursor)
+    if not set(ids)<=set(categories.values()):
+        categories=load_categories(shard,cursor)
+    return {value:key for key,value in categories.items()}
+
+def with_category_names(rows,shard,cursor=None):
+    '''
+        Description:
+            Function to replace the category_id of returned rows by the category name
+        Inputs:
+            rows (list): Dictionary rows with category_id
+            shard (Shard): Shard the rows come from
+            cursor (cursor): Optional dictionary cursor of an open transaction
+        Returns:
+            rows (list): Dictionaries with category instead of category_id
+    '''
+    names=category_names(shard,[row["category_id"] for row in rows],cursor)
+    return [{("category" if key=="category_id" else key):(names[value] if key=="category_id" else value) for key,value in row.items()} for row in rows]
+
+def matching_category_ids(shard,operator,value,uow=None):
+    '''
+        Description:
+            Function to evaluate a category condition over the cached category names, so the database compares SMALLINT keys.
+            An = or like condition matching no name reloads the cache once, in case the category was added after it was loaded
+        Inputs:
+            shard (Shard): Shard of the query
+            operator (str): One of ALLOWED_OPERATORS
+            value (str): Category name or LIKE pattern
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            ids (list): Ids of the categories matching the condition
+    '''
+    if operator=="like":
+        pattern=archive.like_to_regex(str(value))
+        condition=lambda name: pattern.fullmatch(name)
+    else:
+        condition=lambda name: archive.COMPARATORS[operator](name,str(value))
+    ids=sorted(category for name,category in category_ids(shard,uow=uow).items() if condition(name))
+    if not ids and operator in ("=","like"):
+        ids=sorted(category for name,category in load_categories(shard,uow=uow).items() if condition(name))
+    return ids
+
+def archived_rows_as(rows,columns=None,compact=False):
+    '''
+        Description:
+            Function to give archived rows the format of the Postgres results they are merged with
+        Inputs:
+            rows (list): Archived rows as dictionaries
+            columns (list): Selected columns. All columns as default
+            compact (bool): When true rows are returned as compact rows instead of dictionaries
+        Returns:
+            rows (list): Rows with the selected columns
+    '''
+    columns=columns or archive.ARCHIVE_COLUMNS
+    if compact:
+        row_type=compact_row_type(tuple(columns))
+        return [row_type(*[row[column] for column in columns]) for row in rows]
+    return [{column:row[column] for column in columns} for row in rows]
+
+def reject_archived_matches(shard,where_dict,operator_dict,owner,action):
+    '''
+        Description:
+            Function to stop a write whose where conditions match archived expenses. Parquet files are read only, the write
+            would change the Postgres rows only while reads keep returning the archived ones
+        Inputs:
+            shard (Shard): Shard of the owner
+            where_dict (dictionary): Validated where conditions
+            operator_dict (dictionary): Validated operators
+            owner (str): Owner id of the expenses
+            action (str): update or delete, for the error message
+    '''
+    archived_rows=archive.read_archive(shard,where_dict,operator_dict,owner)
+    if archived_rows:
+        months=sorted({f"{row['expense_date']:%Y-%m}" for row in archived_rows})
+        raise ValueError(f"Unable to {action} archived expenses: {len(archived_rows)} matching records in {', '.join(months)}. Restore the months first")
+
+def reject_archived_dates(shard,expense_dates,action):
+    '''
+        Description:
+            Function to stop a write that would put expenses in an archived month. Reads take archived months from Parquet only,
+            a new Postgres row there would be hidden from the analytics
+        Inputs:
+            shard (Shard): Shard of the owner
+            expense_dates (list): Dates the write puts expenses on
+            action (str): create or update, for the error message
+    '''
+    months=set(archive.archived_months(shard))
+    archived=sorted({f"{month:%Y-%m}" for month in (archive.coerce_value("expense_date",date).replace(day=1) for date in expense_dates) if month in months})
+    if archived:
+        raise ValueError(f"Unable to {action} expenses in archived months {', '.join(archived)}. Restore the months first")
+
+def archived_months_clause(shard,start_date=None,end_date=None,table=None):
+    '''
+        Description:
+            Function to form the condition leaving out the Postgres rows of archived months. An archived month lives in its Parquet file,
+            Postgres rows left there by an archive or restore in progress, or interrupted, are copies of the archived ones
+        Inputs:
+            shard (Shard): Shard of the query
+            start_date, end_date (date): Optional date range, only its archived months are listed
+            table (str): Optional table name or alias to qualify expense_date
+        Returns:
+            condition (str): Condition starting with AND. Empty string when no archived month is in the range
+            params (list): Placeholder values
+    '''
+    start_date=archive.coerce_value("expense_date",start_date) if start_date is not None else None
+    end_date=archive.coerce_value("expense_date",end_date) if end_date is not None else None
+    months=[month for month in archive.archived_months(shard)
+            if (start_date is None or archive.month_end(month)>=start_date) and (end_date is None or month<=end_date)]
+    if not months:
+        return "",[]
+    prefix=f"{table}." if table else ""
+    return f" AND date_trunc('month',{prefix}expense_date)::date <> ALL(%s::date[])",[months]
+
+def form_where_clause(where_dict,operator_dict,owner=None,table=None,shard=None,uow=None):
+    '''
+        Description:
+            Function to form a validated where clause and its placeholder list. The owner condition goes first so the (owner_id, expense_date) index is used.
+            Category conditions are evaluated on the category names and become a condition on category_id
+        Inputs:
+            where_dict (dictionary): Column name as key and value to compare as value
+            operator_dict (dictionary): Column name as key and operator as value
+            owner (str): Optional owner id condition
+            table (str): Optional table name or alias to qualify the columns
+            shard (Shard): Shard of the query. Shard of the owner as default
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            where_clause (str): Conditions joined by AND. Empty string when there are no conditions
+            params (list): Placeholder values in order
+    '''
+    prefix=f"{table}." if table else ""
+    conditions=[]
+    params=[]
+    for key,value in where_dict.items():
+        if key=="category":
+            conditions.append(f"{prefix}category_id = ANY(%s::smallint[])")
+            params.append(matching_category_ids(shard or shard_router.router.shard_for(owner or DEFAULT_OWNER),operator_dict[key],value,uow))
+        else:
+            conditions.append(f"{prefix}{key} {operator_dict[key]} %s")
+            params.append(value)
+    if owner is not None:
+        conditions.insert(0,f"{prefix}owner_id = %s")
+        params.insert(0,owner)
+    return " AND ".join(conditions),params
+
+def create_record(expense_date,amount,category,notes,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function for Create operation in expenses table. Raises ValueError for dates of archived months
+        Inputs:
+            expense_date (str as yyy-mm-dd): Expense date
+            amount(float): Amount of the expense
+            category (str): Category of the expense
+            notes (str): Descriptive note of the expense 
+            owner (str): Owner id of the expense. Routes the record to the owner shard
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+    '''
+    logger.info(f"Function call: create_record")
+    shard=shard_router.router.shard_for(owner)
+    reject_archived_dates(shard,[expense_date],"create")
+    category=category_id(shard,category,uow) #Validated before the transaction, unknown categories are rejected
+    #********* Executing the query
+    with get_db_cursor(commit=True,shard=shard,uow=uow) as cursor: #This will use the generator and save us the effort to write close and commit in the conding and during the unitary testing
+        query='''
+            INSERT INTO
+                expenses (expense_date,amount,category_id,notes,owner_id)
+            VALUES
+                (%s,%s,%s,%s,%s)
+            RETURNING expense_date,category_id
+        ''' # %s works as a place holder where we will insert our parammeters
+        
+        #Try to execute the query. Raise 
+        try:
+            cursor.execute(query,(expense_date,amount,category,notes,owner)) #We pass all the arguments tu cursor execution
+            record_change(cursor,"create",with_category_names(cursor.fetchall(),shard,cursor),owner)
+            logger.info(f"Record creation: |date:{expense_date} | amount:{amount} | category:{category} | notes:{notes}| with success")
+        except Exception as e:
+            logger.error(f"creating record expense date:{expense_date} | amount:{amount} | category:{category} | notes:{notes}. {e}")
+            raise RuntimeError(f"Unable to create record. {e}")
+    
+def create_records(expense_date,entries,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function for bulk Create operation in expenses table. All entries are inserted in one statement and one transaction.
+            Raises ValueError for dates of archived months
+        Inputs:
+            expense_date (str as yyy-mm-dd): Expense date of all the entries
+            entries (list): List of dictionaries with amount, category and notes
+            owner (str): Owner id of the expenses. Routes the records to the owner shard
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            num_records (int): Number of records created
+    '''
+    logger.info(f"Function call: create_records")
+    shard=shard_router.router.shard_for(owner)
+    reject_archived_dates(shard,[expense_date],"create")
+    values=[(expense_date,entry["amount"],category_id(shard,entry["category"],uow),entry.get("notes"),owner) for entry in entries]
+    if len(values)==0:
+        return 0
+
+    with get_db_cursor(commit=True,shard=shard,uow=uow) as cursor:
+        query="INSERT INTO expenses (expense_date,amount,category_id,notes,owner_id) VALUES %s RETURNING expense_date,category_id"
+        try:
+            changed_rows=execute_values(cursor,query,values,fetch=True)
+            record_change(cursor,"create",with_category_names(changed_rows,shard,cursor),owner)
+            logger.info(f"Record creation: |date:{expense_date} | records:{len(values)}| with success")
+        except Exception as e:
+            logger.error(f"creating records expense date:{expense_date} | records:{len(values)}. {e}")
+            raise RuntimeError(f"Unable to create records. {e}")
+    return len(values)
+
+def retrieve_date(date_retrieval,columns=None,compact=False,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function used to retrieve information from a certain date from expenses table
+        Inputs:
+            date_retrieval (str as yyyy-mm-dd): Date to retrieve information
+            columns (list): Optional subset of ALLOWED_COLUMNS to retrieve. All columns as default
+            compact (bool): When true results are returned as compact rows instead of dictionaries
+            owner (str): Owner id of the expenses
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+    '''
+    logger.info(f"Function call: retrieve_date")
+    select_clause=validate_columns(columns)
+    #********* Executing the query
+    shard=shard_router.router.shard_for(owner)
+    archived_rows=archive.read_archive(shard,owner=owner,start_date=date_retrieval,end_date=date_retrieval)
+    archived_ids=[row["id"] for row in archived_rows] #Each id is read from one tier, archived copies win
+    with get_db_cursor(compact=compact,shard=shard,uow=uow) as cursor: 
+        query=f'''
+            SELECT
+                {select_clause}
+            FROM
+                {EXPENSES_FROM}
+            WHERE
+                expenses.owner_id=(%s) AND expenses.expense_date=(%s) {"AND NOT (expenses.id = ANY(%s))" if archived_ids else ""}
+        '''
+        #Try to execute the query
+        try:
+            cursor.execute(query,(owner,date_retrieval)+((archived_ids,) if archived_ids else ())) #query execution
+            results=compact_rows(cursor) if compact else cursor.fetchall() #Get the query results
+            logger.info(f"Data retrieved: date {date_retrieval} with success | results:{len(results)}")
+        except Exception as e:
+            logger.error(f"Retrieving information for date {date_retrieval} Failed - {e}")
+            raise RuntimeError("Error at retrieving date information. Check syntax")
+
+    #********* Adding the archived expenses of the date
+    results+=archived_rows_as(archived_rows,columns,compact)
+ 
+    return results
+
+
+def validate_where_clause(where_dict,operator_dict):
+    '''
+        Description:
+            Function used to validate if the given where clause conditions are valid according to existing column names and possible operators
+        Inputs
+            where_dict (dictionary): Dictionary to retrieve information based on where conditions. Contains column name and value
+            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
+    '''
+    logger.info(f"Where dict received: {where_dict}")
+    logger.info(f"Operator dict received: {operator_dict}")
+
+    for key in where_dict.keys():
+        if key not in ALLOWED_COLUMNS:
+            logger.error("Passing invalid column name in payload")
+            raise ValueError(f"Column name not in allowed columns")
+        if operator_dict[key] not in ALLOWED_OPERATORS:
+            logger.error("Passing invalid operator in payload")
+            raise ValueError(f"Operator {operator_dict[key]} not in allowed operators")
+
+def keys_to_remove(in_dict):
+    '''
+        Description:
+            Function to remove all inputs that are None from in_dict
+        Inputs:
+            in_dict(dictionary): Dictionary to clean
+        Outputs:
+            in_dict: Dictionary updated
+    '''
+
+    keys_to_remove = [key for key, val in in_dict.items() if val is None] #Get the items to remove from the dictionary
+    
+    for key in keys_to_remove:
+        in_dict.pop(key,None)
+    
+    return in_dict 
+def retrieve_custom_query(where_dict,operator_dict,compact=False,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function used to execute a custom query given by user in expenses table. READ ONLY QUERY
+        Inputs:
+            where_dict (dictionary): Dictionary to retrieve information based on where conditions. Contains column name and value
+            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
+            compact (bool): When true results are returned as compact rows instead of dictionaries
+            owner (str): Owner id of the expenses
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+    '''
+    logger.info(f"Function call: retrieve_custom_query")
+
+    where_dict=keys_to_remove(where_dict)
+    operator_dict=keys_to_remove(operator_dict)
+
+    #******** Validating the where clause conditions
+    validate_where_clause(where_dict,operator_dict)
+
+    #******** Forming the query
+    shard=shard_router.router.shard_for(owner)
+    where_clause,params=form_where_clause(where_dict,operator_dict,owner,table="expenses",shard=shard,uow=uow)
+    archived_rows=archive.read_archive(shard,where_dict,operator_dict,owner)
+    if archived_rows: #Each id is read from one tier, archived copies win
+        where_clause+=" AND NOT (expenses.id = ANY(%s))"
+        params.append([row["id"] for row in archived_rows])
+    query=f"SELECT {validate_columns(None)} FROM {EXPENSES_FROM} WHERE {where_clause}"
+
+    #******** Executing the custom query
+    with get_db_cursor(compact=compact,shard=shard,uow=uow) as cursor:
+        try:
+            cursor.execute(query,params)
+        except Exception as e:
+            logger.error(f"Failed at executing custom query. Check syntax")
+            raise RuntimeError (f"Database error {e}")
+        results=compact_rows(cursor) if compact else cursor.fetchall()
+        logger.info(f"Data retrieved: Custom query executed with success | results:{len(results)}")
+
+    #******** Adding the archived expenses matching the conditions
+    results+=archived_rows_as(archived_rows,compact=compact)
+
+    return results
+
+def update_record(set_dict,where_dict,operator_dict,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function to update a record in expenses table. Raises ValueError when the where conditions match archived expenses
+            or the new expense_date is in an archived month
+        Inputs:
+            set_dict (dictonary): Dictionary with key as column name, and value as new value for column
+            where_dict (dictionary): Dictionary containing the mapping for where clause, where key is column name, and value is mapping parammeter 
+            operator_dict (dictionary): Dictionary with operators to perform the custom query between column and value of where dict items.
+            owner (str): Owner id of the expenses. Only the owner records are updated
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns
+            num_records (float): Number of records affected 
+    '''    
+    logger.info(f"Function call: update_record")
+    
+    #******** Validating the where clause conditions
+    set_dict=keys_to_remove(set_dict)
+    where_dict=keys_to_remove(where_dict)
+    operator_dict=keys_to_remove(operator_dict)
+
+    validate_where_clause(where_dict,operator_dict)
+    if len(where_dict)==0:
+        raise ValueError("At least one where condition is required")
+    
+    #******** Form the query
+    #The self join keeps the values before the update so the change event covers the dates and categories rows moved out of
+    shard=shard_router.router.shard_for(owner)
+    reject_archived_matches(shard,where_dict,operator_dict,owner,"update")
+    if "expense_date" in set_dict:
+        reject_archived_dates(shard,[set_dict["expense_date"]],"update")
+    if "category" in set_dict:
+        set_dict["category_id"]=category_id(shard,set_dict.pop("category"),uow)
+    set_query= ", ".join([f"{key}=%s" for key in set_dict.keys()]) 
+    where_clause,where_params=form_where_clause(where_dict,operator_dict,owner,table="expenses",shard=shard,uow=uow)
+    query=f'''UPDATE expenses SET {set_query} FROM expenses AS previous WHERE previous.id=expenses.id AND {where_clause}
+        RETURNING previous.expense_date AS previous_date,previous.category_id AS previous_category_id,expenses.expense_date,expenses.category_id'''
+    logger.info(f"Update query {query}")
+    #Form the placeholder list
+    params=list(set_dict.values())+where_params
+
+    #******** Execute the query
+    with get_db_cursor(commit=True,shard=shard,uow=uow) as cursor:
+        try:
+            cursor.execute(query,params)
+            num_records=cursor.rowcount
+            changed_rows=cursor.fetchall()
+            previous_rows=[{"expense_date":row["previous_date"],"category_id":row["previous_category_id"]} for row in changed_rows]
+            changed_rows=[{"expense_date":row["expense_date"],"category_id":row["category_id"]} for row in changed_rows]
+            record_change(cursor,"update",with_category_names(previous_rows+changed_rows,shard,cursor),owner,records=num_records)
+            logger.info(f"Update: Record updated successfully")
+        except Exception as e:
+            logger.error(f"Unable to update record. Error {e}")
+            raise RuntimeError ("Query syntax error")
+    return num_records
+
+def delete_record(where_dict,operator_dict,owner=DEFAULT_OWNER,uow=None):
+    '''
+     Description:
+        Function to delete records from the expenses table based on WHERE conditions.
+        Raises ValueError when the where conditions match archived expenses.
+    Inputs:
+        where_dict (dict): Column names and values to match.
+        operator_dict (dict): Operators to apply to each column condition.
+        owner (str): Owner id of the expenses. Only the owner records are deleted.
+        uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default.
+    Returns:
+        num_records (int): Number of records deleted.
+    ''' 
+    logger.info(f"Function call: delete_record")
+
+    #******** Validating the where clause conditions
+    where_dict=keys_to_remove(where_dict)
+    operator_dict=keys_to_remove(operator_dict)
+    validate_where_clause(where_dict,operator_dict)
+    if len(where_dict)==0:
+        raise ValueError("At least one where condition is required")
+
+    #******** Form the query
+    shard=shard_router.router.shard_for(owner)
+    reject_archived_matches(shard,where_dict,operator_dict,owner,"delete")
+    where_clause,params=form_where_clause(where_dict,operator_dict,owner,shard=shard,uow=uow)
+    query=f"DELETE FROM expenses WHERE {where_clause} RETURNING expense_date,category_id"
+
+    #******** Execute the query
+    with get_db_cursor(commit=True,shard=shard,uow=uow) as cursor:
+        try:
+            cursor.execute(query,params)
+            num_records=cursor.rowcount
+            record_change(cursor,"delete",with_category_names(cursor.fetchall(),shard,cursor),owner)
+            logger.warning(f"Deleting {num_records} from expenses table")
+            logger.info(f"Record delete: Record deleted successfully")
+        except Exception as e:
+            logger.error(f"Unable to delete record. Error {e}")
+            raise RuntimeError ("Query syntax error")
+    return num_records
+
+def change_event(event_id,action,expense_dates,categories,records,owner):
+    '''
+        Description:
+            Function to form the change event sent through NOTIFY and returned on replays
+        Inputs:
+            event_id (int): Id of the event in the expense_events table of the owner shard
+            action (str): create, update or delete
+            expense_dates (list): Dates affected by the change
+            categories (list): Categories affected by the change
+            records (int): Number of records affected
+            owner (str): Owner id of the changed expenses
+        Returns:
+            event (dictionary): Event with dates as yyyy-mm-dd strings
+    '''
+    return {
+        "id":event_id,
+        "owner":owner,
+        "action":action,
+        "expense_dates":[str(expense_date) for expense_date in expense_dates],
+        "categories":list(categories),
+        "records":records
+    }
+
+def record_change(cursor,action,changed_rows,owner,records=None):
+    '''
+        Description:
+            Function to store a change event and NOTIFY it in the transaction of the change. Listeners only receive it once the change is committed.
+            The event id is taken under a transaction lock of the owner, so the events of an owner commit in id order and a client resuming
+            after its last event id misses none. Also bumps the content version of the affected months
+        Inputs:
+            cursor (cursor): Dictionary cursor of the write transaction
+            action (str): create, update or delete
+            changed_rows (list): Rows with expense_date and category of the affected rows
+            owner (str): Owner id of the changed expenses
+            records (int): Number of records affected. Number of changed rows as default
+        Returns:
+            event (dictionary): Change event. None when no rows were affected
+    '''
+    if len(changed_rows)==0:
+        return None
+    expense_dates=sorted({row["expense_date"] for row in changed_rows})
+    categories=sorted({row["category"] for row in changed_rows})
+    records=len(changed_rows) if records is None else records
+
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s),hashtext(%s))",(CHANGE_CHANNEL,owner)) #Released at commit or rollback
+    cursor.execute(
+        "INSERT INTO expense_events (action,expense_dates,categories,records,owner_id) VALUES (%s,%s,%s,%s,%s) RETURNING id",
+        (action,expense_dates,categories,records,owner)
+    )
+    event=change_event(cursor.fetchone()["id"],action,expense_dates,categories,records,owner)
+
+    payload=json.dumps(event)
+    if len(payload.encode("utf-8"))>MAX_NOTIFY_BYTES:
+        payload=json.dumps({"id":event["id"],"owner":owner,"action":action,"truncated":True}) #Listener reads the full event from expense_events
+    cursor.execute("SELECT pg_notify(%s,%s)",(CHANGE_CHANNEL,payload))
+    logger.info(f"Change event {event['id']}: {action} | records:{records}")
+
+    bump_versions(cursor,expense_dates,owner)
+    return event
+
+def bump_versions(cursor,expense_dates,owner):
+    '''
+        Description:
+            Function to increase the content version of the months of the changed expenses. Read endpoints derive their ETag from it
+        Inputs:
+            cursor (cursor): Cursor of the write transaction
+            expense_dates (list): Dates of the changed expenses
+            owner (str): Owner id of the changed expenses
+    '''
+    months=sorted({expense_date.replace(day=1) for expense_date in expense_dates}) #Sorted so concurrent writers lock the months in the same order
+    query='''
+        INSERT INTO expense_versions (owner_id,month,version,updated_at)
+        SELECT %s,month,1,now() FROM unnest(%s::date[]) AS month
+        ON CONFLICT (owner_id,month) DO UPDATE SET version=expense_versions.version+1,updated_at=now()
+    '''
+    cursor.execute(query,(owner,months))
+
+def shard_content_version(shard,start_date,end_date,owner=None,uow=None):
+    '''
+        Description:
+            Function to read the content version of the months of a date range in one shard
+        Inputs:
+            shard (Shard): Shard to query
+            start_date (str): Initial date of the date range
+            end_date (str): Final date of the date range
+            owner (str): Optional owner id. All owners of the shard when None
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            version (dictionary): Number of versioned months, sum of their versions and last update
+    '''
+    owner_clause="owner_id = %s AND " if owner is not None else ""
+    params=([owner] if owner is not None else [])+[start_date,end_date]
+    query=f'''
+        SELECT COUNT(*) AS months,COALESCE(SUM(version),0) AS version,MAX(updated_at) AS updated_at
+        FROM expense_versions
+        WHERE {owner_clause}month BETWEEN date_trunc('month',%s::date)::date AND %s::date
+    '''
+    with get_db_cursor(shard=shard,uow=uow) as cursor:
+        try:
+            cursor.execute(query,params)
+            return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Failed to retrieve content version | shard {shard.index}: {e}")
+            raise RuntimeError("Error retrieving content version")
+
+def content_version(start_date,end_date,owner=None,uow=None):
+    '''
+        Description:
+            Function to get a cheap fingerprint of the expenses of a date range. Versions only grow, so the number of versioned
+            months and the sum of their versions change with every create, update and delete of the range
+        Inputs:
+            start_date (str): Initial date of the date range
+            end_date (str): Final date of the date range
+            owner (str): Optional owner id. Every shard is queried in parallel when None
+            uow (UnitOfWork): Optional unit of work. Used for the query of its shard
+        Returns:
+            version (str): Fingerprint of the range
+            last_modified (datetime): Last change of the range. None when the range was never changed
+    '''
+    logger.info("Function call: content_version")
+    shards=[shard_router.router.shard_for(owner)] if owner is not None else shard_router.router.shards
+    partials=run_on_shards(shards,lambda shard: shard_content_version(shard,start_date,end_date,owner,shard_unit_of_work(shard,uow)))
+    version=f"{sum(partial['months'] for partial in partials)}.{sum(partial['version'] for partial in partials)}"
+    updates=[partial["updated_at"] for partial in partials if partial["updated_at"] is not None]
+    return version,max(updates,default=None)
+
+def retrieve_events_since(last_event_id,limit=1000,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function to retrieve the change events after a given event id. Used to resume change feeds after a reconnect
+        Inputs:
+            last_event_id (int): Last event id received by the subscriber
+            limit (int): Maximum number of events to return
+            owner (str): Owner id of the events. Event ids are sequential within the owner shard
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            events (list): Change events ordered by id
+    '''
+    logger.info(f"Function call: retrieve_events_since")
+    with get_db_cursor(shard=shard_router.router.shard_for(owner),uow=uow) as cursor:
+        query="SELECT * FROM expense_events WHERE owner_id=%s AND id>%s ORDER BY id LIMIT %s"
+        try:
+            cursor.execute(query,(owner,last_event_id,limit))
+            results=cursor.fetchall()
+            logger.info(f"Data retrieved: events after {last_event_id} with success | results:{len(results)}")
+        except Exception as e:
+            logger.error(f"Retrieving events after {last_event_id} Failed - {e}")
+            raise RuntimeError("Error at retrieving change events")
+
+    return [change_event(row["id"],row["action"],row["expense_dates"],row["categories"],row["records"],row["owner_id"]) for row in results]
+
+def shard_expense_summary(shard,start_date,end_date,owner=None,sample_method=None,sample_percent=None,uow=None):
+    '''
+        Description
+            Function to compute the analytics of one shard. Totals are returned for every category so they can be merged across shards
+        Inputs
+            shard (Shard): Shard to query
+            start_date (str): Initial date of the date range
+            end_date (str): Final date of the date range
+            owner (str): Optional owner id. All owners of the shard when None
+            sample_method (str): Optional TABLESAMPLE method. When given category totals are computed over a sample
+            sample_percent (float): Percentage of the table to sample
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns
+            category_totals (list): Category, records and total_expense of every category in the date range.
+                                    When sampling, sampled rows, sum and the products of the unit sums with every category (sampled_products).
+                                    A shard whose range is too small to sample returns its exact totals flagged exact
+            top_expenses (list): Top 5 expenses of the shard in the date range. Always exact
+            Archived expenses of the range are added with their exact totals
+    '''
+    months_clause,months_params=archived_months_clause(shard,start_date,end_date) #Archived months are summarized from Parquet below
+    where_clause=("owner_id = %s AND " if owner is not None else "")+"expense_date BETWEEN %s AND %s"+months_clause
+    params=([owner] if owner is not None else [])+[start_date,end_date]+months_params
+    sampled=sample_method is not None
+
+    with get_db_cursor(shard=shard,uow=uow) as cursor:
+        #****************************** Summary of expenses
+        if sampled and estimated_rows(cursor,where_clause,params)*sample_percent/100<MIN_SAMPLE_ROWS:
+            logger.info(f"Date range too small to sample, computing exact totals | shard {shard.index}")
+            sampled=False
+        if not sampled:
+            query=f'''
+                SELECT 
+                    category_id,
+                    COUNT(*) AS records,
+                    SUM(amount) AS total_expense
+                FROM expenses
+                WHERE {where_clause}
+                GROUP BY category_id
+                '''
+            summary_params=params
+        else:
+            #Rows of a heap page are alike (same dates and owners), so SYSTEM samples are clustered. Sums and their cross products
+            #are computed per sampled unit so the margins use the variance between pages, not between rows
+            query=f'''
+                WITH units AS (
+                    SELECT {SAMPLE_UNITS[sample_method]} AS unit,category_id,COUNT(*) AS unit_rows,SUM(amount::float8) AS unit_sum
+                    FROM expenses TABLESAMPLE {sample_method.upper()} (%s)
+                    WHERE {where_clause}
+                    GROUP BY 1,2
+                )
+                SELECT category_id,NULL::smallint AS other_category_id,SUM(unit_rows)::bigint AS sampled_rows,SUM(unit_sum) AS sampled_sum
+                FROM units GROUP BY category_id
+                UNION ALL
+                SELECT units.category_id,other.category_id,NULL,SUM(units.unit_sum*other.unit_sum)
+                FROM units JOIN units AS other ON other.unit=units.unit GROUP BY units.category_id,other.category_id
+                '''
+            summary_params=[sample_percent]+params
+        try:
+            cursor.execute(query,summary_params)
+            rows=cursor.fetchall()
+            names=category_names(shard,[row["category_id"] for row in rows],cursor) #Grouped by the SMALLINT key, names are mapped from the cache
+            logger.info(f"Date range retrieved successfuly for analytics | shard {shard.index}")
+        except Exception as e:
+            logger.error(f"Failed to retrieve date range for analytics | shard {shard.index}")
+            raise RuntimeError("Error retrieving date range")
+        if not sampled:
+            category_totals=[{"category":names[row["category_id"]],"records":row["records"],"total_expense":row["total_expense"]} for row in rows]
+        else:
+            samples={}
+            for row in rows:
+                sample=samples.setdefault(row["category_id"],{"category":names[row["category_id"]],"sampled_products":{}})
+                if row["other_category_id"] is None:
+                    sample.update(sampled_rows=row["sampled_rows"],sampled_sum=row["sampled_sum"])
+                else:
+                    sample["sampled_products"][names[row["other_category_id"]]]=row["sampled_sum"]
+            category_totals=list(samples.values())
+
+        #****************************** Top expenses
+        query=f"SELECT {validate_columns(None)} FROM {EXPENSES_FROM} WHERE {where_clause} ORDER BY amount  DESC LIMIT 5"
+        try:
+            cursor.execute(query, params)
+            top_expenses = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Failed to retrieve top expenses: {e}")
+            raise RuntimeError("Error retrieving top expenses")
+
+    #****************************** Archived expenses. Totals per category are appended, merge_* functions add them up by category
+    archived_totals,archived_top=archive.summarize_archive(shard,owner,start_date,end_date)
+    category_totals+=archived_totals
+    if sample_method is not None: #Exact totals in the format of the samples, they are not scaled
+        category_totals=[row if "sampled_sum" in row else {"category":row["category"],"sampled_rows":row["records"],"sampled_sum":row["total_expense"],"exact":True}
+                         for row in category_totals]
+    top_expenses=top_expenses+archived_top
+
+    return category_totals,top_expenses
+
+def estimated_rows(cursor,where_clause,params):
+    '''
+        Description
+            Function to get the planner estimate of the expenses matching a where clause, without running the query
+        Inputs
+            cursor (cursor): Dictionary cursor of the shard
+            where_clause (str): Where clause over the expenses table
+            params (list): Parameters of the where clause
+        Returns
+            rows (float): Estimated rows
+    '''
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM expenses WHERE {where_clause}",params)
+        return cursor.fetchone()["QUERY PLAN"][0]["Plan"]["Plan Rows"]
+    except Exception as e:
+        logger.error(f"Failed to estimate rows: {e}")
+        raise RuntimeError("Error estimating rows")
+
+def shard_unit_of_work(shard,uow):
+    '''
+        Description
+            Function to pick the unit of work for one shard of a scatter query. Only the shard of the unit of work uses it
+    '''
+    return uow if uow is not None and uow.shard is shard else None
+
+def run_on_shards(shards,function):
+    '''
+        Description
+            Function to run a function on several shards in parallel
+        Inputs
+            shards (list): Shards to query
+            function (function): Function receiving a shard
+        Returns
+            results (list): Result of each shard in the order of shards
+    '''
+    if len(shards)==1:
+        return [function(shards[0])]
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        return list(executor.map(function,shards))
+
+def merge_expense_summaries(partials):
+    '''
+        Description
+            Function to merge the analytics of several shards. Keeps the top 5 categories and their percentage over the top 5 total, and the top 5 expenses
+        Inputs
+            partials (list): (category_totals, top_expenses) of each shard
+        Returns
+            total_expenses (list): Category, total_expense and perc_expense of the top 5 categories
+            top_expenses (list): Top 5 expenses
+    '''
+    totals={}
+    for category_totals,_ in partials:
+        for row in category_totals:
+            totals[row["category"]]=totals.get(row["category"],0)+row["total_expense"]
+
+    top_categories=sorted(totals.items(),key=lambda item:item[1],reverse=True)[:5]
+    grand_total=sum(total for _,total in top_categories)
+    total_expenses=[{
+        "category":category,
+        "total_expense":total,
+        "perc_expense":round(total*100/grand_total,2) if grand_total else None
+    } for category,total in top_categories]
+
+    top_expenses=sorted([row for _,top in partials for row in top],key=lambda row:row["amount"],reverse=True)[:5]
+    return total_expenses,top_expenses
+
+def expense_summary(start_date,end_date,owner=None,uow=None):
+    '''
+        Description
+            Function to return analytics informatation of the expenseses between a start date and an end_date
+        Inputs
+            start_date (str): Initial date of the date range
+            end_date (str): Final date of the date range
+            owner (str): Optional owner id. When None every shard is queried in parallel and the results are merged
+            uow (UnitOfWork): Optional unit of work. Used for the query of its shard
+        Returns
+            total_expenses (dictionary): Expense by category in the date range. Contains Total expenses, and number of expenses
+            top_expenses (dictionary): Top 5 expenses in the date range. Contains expense date, total expense, category, notes      
+    '''
+    logger.info("Function call: Expense analytics")
+
+    shards=[shard_router.router.shard_for(owner)] if owner is not None else shard_router.router.shards
+    partials=run_on_shards(shards,lambda shard: shard_expense_summary(shard,start_date,end_date,owner,uow=shard_unit_of_work(shard,uow)))
+
+    total_expenses,top_expenses=merge_expense_summaries(partials)
+    if len(top_expenses) == 0 and len(total_expenses) == 0:
+        logger.warning(f"No expenses found for range {start_date} to {end_date}")
+        raise RuntimeError("No data available for the selected date range")
+    logger.info(f"Retrieved {len(top_expenses)} top expenses for range {start_date} to {end_date} | shards:{len(shards)}")
+
+    return total_expenses,top_expenses
+
+def merge_sampled_summaries(partials,sample_percent):
+    '''
+        Description
+            Function to estimate the category totals from the samples of several shards. Each unit (page or row) is in the sample with
+            probability q, so a total is estimated as sum/q and the covariance of two category totals as (1-q)/q^2 * sum over the sampled
+            units of the product of their sums. Percentage bounds use the delta method with these covariances, categories sharing pages are correlated
+        Inputs
+            partials (list): (sampled category totals, top_expenses) of each shard. Totals flagged exact (archived expenses, small ranges) are not scaled
+            sample_percent (float): Percentage of the table sampled
+        Returns
+            total_expenses (list): Top 5 categories with estimated total_expense, perc_expense, their margins and estimated_records
+            top_expenses (list): Top 5 expenses
+            sampled_rows (int): Rows of the date range in the sample
+    '''
+    estimates={}
+    covariances={} #(category, other category) as key
+    sampled_rows=0
+    for category_samples,_ in partials:
+        for row in category_samples:
+            q=1 if row.get("exact") else sample_percent/100
+            estimate=estimates.setdefault(row["category"],{"rows":0.0,"total":0.0})
+            estimate["rows"]+=row["sampled_rows"]/q
+            estimate["total"]+=row["sampled_sum"]/q
+            for other,product in row.get("sampled_products",{}).items(): #Shards are sampled independently, their covariances add up
+                covariances[(row["category"],other)]=covariances.get((row["category"],other),0.0)+(1-q)/q**2*product
+            sampled_rows+=0 if row.get("exact") else row["sampled_rows"]
+
+    top_categories=sorted(estimates.items(),key=lambda item:item[1]["total"],reverse=True)[:5]
+    top_names=[category for category,_ in top_categories]
+    grand_total=sum(estimate["total"] for _,estimate in top_categories)
+    grand_covariances={category:sum(covariances.get((category,other),0.0) for other in top_names) for category in top_names} #Covariance with the top 5 total
+    grand_variance=sum(grand_covariances.values())
+
+    total_expenses=[]
+    for category,estimate in top_categories:
+        variance=covariances.get((category,category),0.0)
+        perc=estimate["total"]/grand_total if grand_total else None
+        perc_variance=(variance-2*perc*grand_covariances[category]+perc**2*grand_variance)/grand_total**2 if grand_total else None
+        total_expenses.append({
+            "category":category,
+            "total_expense":round(estimate["total"],2),
+            "perc_expense":round(perc*100,2) if perc is not None else None,
+            "total_expense_margin":round(CONFIDENCE_Z*math.sqrt(variance),2),
+            "perc_expense_margin":round(CONFIDENCE_Z*math.sqrt(max(perc_variance,0))*100,2) if perc_variance is not None else None,
+            "estimated_records":round(estimate["rows"])
+        })
+
+    top_expenses=sorted([row for _,top in partials for row in top],key=lambda row:row["amount"],reverse=True)[:5]
+    return total_expenses,top_expenses,sampled_rows
+
+def expense_summary_approx(start_date,end_date,owner=None,sample_percent=1.0,sample_method="system",uow=None):
+    '''
+        Description
+            Function to return approximate analytics of the expenses between a start date and an end_date. Category totals are estimated
+            from a TABLESAMPLE with 95% confidence margins, top expenses are exact. Shards whose range is estimated too small to sample
+            compute exact totals in the same query round. Falls back to exact analytics only when the estimate was wrong and the sample is too small
+        Inputs
+            start_date (str): Initial date of the date range
+            end_date (str): Final date of the date range
+            owner (str): Optional owner id. When None every shard is sampled in parallel
+            sample_percent (float): Percentage of the table to sample, between 0 and 100
+            sample_method (str): system (reads only the sampled pages, fastest) or bernoulli (row level sample over a full scan).
+                                 Both report margins computed over the units they draw
+            uow (UnitOfWork): Optional unit of work. Used for the query of its shard
+        Returns
+            total_expenses (list): Estimated expense by category with margins
+            top_expenses (list): Top 5 expenses in the date range
+            approximation (dictionary): approximate flag, sample method and percent, sampled rows and confidence of the margins
+    '''
+    logger.info("Function call: Approximate expense analytics")
+    if sample_method not in ALLOWED_SAMPLE_METHODS:
+        raise ValueError(f"Sample method {sample_method} not in allowed sample methods")
+    if not 0<sample_percent<=100:
+        raise ValueError("Sample percent must be between 0 and 100")
+
+    shards=[shard_router.router.shard_for(owner)] if owner is not None else shard_router.router.shards
+    partials=run_on_shards(shards,lambda shard: shard_expense_summary(shard,start_date,end_date,owner,sample_method,sample_percent,shard_unit_of_work(shard,uow)))
+    total_expenses,top_expenses,sampled_rows=merge_sampled_summaries(partials,sample_percent)
+
+    if sampled_rows==0: #No shard was sampled, the totals are exact
+        partials=[([{"category":row["category"],"total_expense":row["sampled_sum"]} for row in category_totals],top) for category_totals,top in partials]
+        total_expenses,top_expenses=merge_expense_summaries(partials)
+        if len(top_expenses)==0 and len(total_expenses)==0:
+            logger.warning(f"No expenses found for range {start_date} to {end_date}")
+            raise RuntimeError("No data available for the selected date range")
+        return total_expenses,top_expenses,{"approximate":False,"sampled_rows":0}
+
+    if sampled_rows<MIN_SAMPLE_ROWS:
+        logger.info(f"Sample of {sampled_rows} rows too small for range {start_date} to {end_date}, computing exact analytics")
+        total_expenses,top_expenses=expense_summary(start_date,end_date,owner,uow)
+        return total_expenses,top_expenses,{"approximate":False,"sampled_rows":sampled_rows}
+
+    logger.info(f"Estimated analytics for range {start_date} to {end_date} | sampled rows:{sampled_rows}")
+    return total_expenses,top_expenses,{
+        "approximate":True,
+        "sample_method":sample_method,
+        "sample_percent":sample_percent,
+        "sampled_rows":sampled_rows,
+        "confidence":0.95
+    }
+
+def aggregate_alias(function,column,percentile=None):
+    '''
+        Description:
+            Function to form the output column name of an aggregate. i.e. sum_amount, count, p95_amount, p99_9_amount.
+            Percentiles are written with at most 4 decimals of percent and never with an exponent, so the alias is a valid SQL name
+        Inputs:
+            function (str): Aggregate function as one of ALLOWED_AGGREGATES
+            column (str): Column the aggregate is applied to. "*" or None for count of rows
+            percentile (float): Fraction between 0 and 1, only for percentile aggregates
+        Returns:
+            alias (str): Output column name
+    '''
+    if function=="count" and column in (None,"*"):
+        return "count"
+    if function=="percentile":
+        return f"p{f'{percentile*100:.4f}'.rstrip('0').rstrip('.')}_{column}".replace(".","_")
+    return f"{function}_{column}"
+
+def validate_aggregate_query(group_by,aggregates,date_bucket,having_dict,having_operator_dict,order_by,limit):
+    '''
+        Description:
+            Function used to validate the group by columns, aggregates, having, order and limit of an aggregation query
+        Inputs:
+            group_by (list): Column names to group by
+            aggregates (list): List of dictionaries with function, column and percentile (only for percentile function)
+            date_bucket (str): Optional date_trunc unit applied to expense_date
+            having_dict (dictionary): Aggregate alias as key and value to compare as value
+            having_operator_dict (dictionary): Aggregate alias as key and operator as value
+            order_by (list): Output column names to sort by
+            limit (int): Maximum number of groups to return
+    '''
+    logger.info(f"Aggregate query received: group_by {group_by} | aggregates {aggregates} | bucket {date_bucket}")
+
+    for column in group_by:
+        if column not in ALLOWED_COLUMNS:
+            logger.error("Passing invalid group by column in payload")
+            raise ValueError(f"Group by column {column} not in allowed columns")
+    if date_bucket is not None and date_bucket not in ALLOWED_DATE_BUCKETS:
+        logger.error("Passing invalid date bucket in payload")
+        raise ValueError(f"Date bucket {date_bucket} not in allowed buckets")
+    if len(aggregates)==0:
+        raise ValueError("At least one aggregate is required")
+
+    aliases=[]
+    for aggregate in aggregates:
+        function=aggregate.get("function")
+        column=aggregate.get("column") or "*"
+        if function not in ALLOWED_AGGREGATES:
+            logger.error("Passing invalid aggregate function in payload")
+            raise ValueError(f"Aggregate {function} not in allowed aggregates")
+        if column not in ALLOWED_AGGREGATES[function]:
+            logger.error("Passing invalid aggregate column in payload")
+            raise ValueError(f"Aggregate {function} can not be applied to column {column}")
+        if function=="percentile":
+            percentile=aggregate.get("percentile")
+            if not isinstance(percentile,(int,float)) or not 0<=percentile<=1:
+                raise ValueError("Percentile must be a number between 0 and 1")
+        alias=aggregate_alias(function,column,aggregate.get("percentile"))
+        if alias in aliases:
+            logger.error("Passing duplicated aggregate in payload")
+            raise ValueError(f"Aggregate {alias} is requested more than once")
+        aliases.append(alias)
+
+    for key in having_dict.keys():
+        if key not in aliases:
+            logger.error("Passing invalid having alias in payload")
+            raise ValueError(f"Having column {key} is not one of the requested aggregates")
+        if having_operator_dict.get(key) not in ALLOWED_HAVING_OPERATORS:
+            logger.error("Passing invalid having operator in payload")
+            raise ValueError(f"Operator {having_operator_dict.get(key)} not in allowed having operators")
+
+    output_columns=group_by+aliases+(["bucket"] if date_bucket else [])
+    for column in order_by:
+        if column not in output_columns:
+            logger.error("Passing invalid order by column in payload")
+            raise ValueError(f"Order by column {column} is not part of the output")
+
+    if limit is not None and (not isinstance(limit,int) or limit<=0):
+        raise ValueError("Limit must be a positive integer")
+
+def retrieve_aggregate(group_by,aggregates,where_dict=None,operator_dict=None,date_bucket=None,
+                       having_dict=None,having_operator_dict=None,order_by=None,descending=False,limit=None,owner=DEFAULT_OWNER,uow=None):
+    '''
+        Description:
+            Function used to execute a GROUP BY query in expenses table so that only the aggregated rows leave the database. READ ONLY QUERY.
+            Archived months are not included: groups, having and percentiles can not be merged from Postgres results, restore the months to aggregate them
+        Inputs:
+            group_by (list): Column names to group by, from ALLOWED_COLUMNS
+            aggregates (list): List of dictionaries with keys function (count, sum, avg, min, max, percentile), column and percentile (0-1)
+            where_dict (dictionary): Dictionary to filter rows before grouping. Contains column name and value
+            operator_dict (dictionary): Dictionary with operators between column and value of where dict items
+            date_bucket (str): Optional unit (day, week, month, quarter, year) to group expense_date with date_trunc. Returned as bucket
+            having_dict (dictionary): Aggregate alias as key (i.e. sum_amount) and value to filter groups
+            having_operator_dict (dictionary): Aggregate alias as key and operator as value
+            order_by (list): Output column names to sort by
+            descending (bool): Sort order of order_by columns
+            limit (int): Maximum number of groups to return
+            owner (str): Owner id of the expenses
+            uow (UnitOfWork): Optional unit of work to run in. Own connection and transaction as default
+        Returns:
+            results (list): One dictionary per group with group columns and aggregate aliases
+    '''
+    logger.info(f"Function call: retrieve_aggregate")
+
+    where_dict=keys_to_remove(dict(where_dict or {}))
+    operator_dict=keys_to_remove(dict(operator_dict or {}))
+    having_dict=keys_to_remove(dict(having_dict or {}))
+    having_operator_dict=keys_to_remove(dict(having_operator_dict or {}))
+    group_by=list(group_by or [])
+    order_by=list(order_by or [])
+
+    #******** Validating the where clause and aggregate conditions
+    validate_where_clause(where_dict,operator_dict)
+    validate_aggregate_query(group_by,aggregates,date_bucket,having_dict,having_operator_dict,order_by,limit)
+
+    #******** Forming the aggregate expressions. Having needs the full expression since Postgres does not accept output aliases there
+    expressions={}
+    for aggregate in aggregates:
+        function=aggregate["function"]
+        column=aggregate.get("column") or "*"
+        alias=aggregate_alias(function,column,aggregate.get("percentile"))
+        column="expenses.category_id" if column=="category" else column #Same count as the names, category is NOT NULL
+        if function=="percentile":
+            expressions[alias]=(f"percentile_cont(%s) WITHIN GROUP (ORDER BY {column})",[float(aggregate["percentile"])])
+        else:
+            expressions[alias]=(f"{function}({column})",[])
+
+    #******** Forming the query
+    select_items=[]
+    params=[]
+    if date_bucket:
+        select_items.append(f"date_trunc('{date_bucket}',expense_date)::date AS bucket")
+    select_items+=[COLUMN_EXPRESSIONS[column] for column in group_by]
+    for alias,(expression,expression_params) in expressions.items():
+        select_items.append(f"{expression} AS {alias}")
+        params+=expression_params
+    num_keys=len(group_by)+(1 if date_bucket else 0)
+
+    shard=shard_router.router.shard_for(owner)
+    where_clause,where_params=form_where_clause(where_dict,operator_dict,owner,table="expenses",shard=shard,uow=uow)
+    months_clause,months_params=archived_months_clause(shard,table="expenses") #Also leaves out copies of an archive in progress
+    query=f"SELECT {', '.join(select_items)} FROM {EXPENSES_FROM} WHERE {where_clause}{months_clause}"
+    params+=where_params+months_params
+    if num_keys>0:
+        query+=" GROUP BY "+", ".join([str(position) for position in range(1,num_keys+1)])
+    if having_dict:
+        having_items=[]
+        for key,value in having_dict.items():
+            expression,expression_params=expressions[key]
+            having_items.append(f"{expression} {having_operator_dict[key]} %s")
+            params+=expression_params+[value]
+        query+=" HAVING "+" AND ".join(having_items)
+    if order_by:
+        query+=" ORDER BY "+", ".join([f"{column} {'DESC' if descending else 'ASC'}" for column in order_by])
+    if limit is not None:
+        query+=" LIMIT %s"
+        params.append(limit)
+    logger.info(f"Aggregate query {query}")
+
+    #******** Executing the aggregate query
+    with get_db_cursor(shard=shard,uow=uow) as cursor:
+        try:
+            cursor.execute(query,params)
+        except Exception as e:
+            logger.error(f"Failed at executing aggregate query. Check syntax")
+            raise RuntimeError (f"Database error {e}")
+        results=cursor.fetchall()
+        logger.info(f"Data retrieved: Aggregate query executed with success | groups:{len(results)}")
+
+    return results
@@ -1,68 +1,113 @@
--- PostgreSQL version of expense_manager dump
-
-DROP TABLE IF EXISTS expenses;
-
-CREATE TABLE expenses (
-  id SERIAL PRIMARY KEY,
-  expense_date DATE NOT NULL,
-  amount REAL NOT NULL,
-  category VARCHAR(255) NOT NULL,
-  notes TEXT
-);
-
--- Data insert
-INSERT INTO expenses (id, expense_date, amount, category, notes) VALUES
-(3,'2024-08-02',50,'Entertainment','Movie tickets'),
-(4,'2024-08-02',150,'Shopping','New shoes'),
-(5,'2024-08-03',100,'Food','Dinner at a restaurant'),
-(11,'2024-08-02',400,'Food','Groceries for the week'),
-(12,'2024-08-02',80,'Entertainment','Concert tickets'),
-(13,'2024-08-02',100,'Shopping','Clothes'),
-(14,'2024-08-02',50,'Other','Gasoline'),
-(15,'2024-08-03',60,'Food','Dinner at a restaurant'),
-(16,'2024-08-03',20,'Entertainment','Video rental'),
-(17,'2024-08-03',120,'Shopping','Gadgets'),
-(18,'2024-08-03',15,'Other','Coffee'),
-(19,'2024-08-04',25,'Food','Lunch'),
-(20,'2024-08-04',200,'Shopping','Home supplies'),
-(21,'2024-08-04',10,'Other','Parking'),
-(22,'2024-08-05',350,'Rent','Shared rent payment'),
-(23,'2024-08-05',40,'Food','Snacks'),
-(24,'2024-08-05',75,'Entertainment','Theater tickets'),
-(25,'2024-08-05',100,'Shopping','Books'),
-(26,'2024-08-05',15,'Other','Miscellaneous'),
-(27,'2024-08-06',30,'Food','Breakfast'),
-(28,'2024-08-06',100,'Shopping','Shoes'),
-(29,'2024-08-06',80,'Entertainment','Movies'),
-(30,'2024-08-06',15,'Other','Public transport'),
-(31,'2024-09-01',1200,'Rent','Monthly rent payment'),
-(32,'2024-09-01',300,'Food','Groceries for the week'),
-(33,'2024-09-01',50,'Entertainment','Movie tickets'),
-(34,'2024-09-01',150,'Shopping','New shoes'),
-(35,'2024-09-01',20,'Other','Bus fare'),
-(36,'2024-09-02',400,'Food','Groceries for the week'),
-(37,'2024-09-02',80,'Entertainment','Concert tickets'),
-(38,'2024-09-02',100,'Shopping','Clothes'),
-(39,'2024-09-02',50,'Other','Gasoline'),
-(40,'2024-09-03',60,'Food','Dinner at a restaurant'),
-(41,'2024-09-03',20,'Entertainment','Video rental'),
-(42,'2024-09-03',120,'Shopping','Gadgets'),
-(43,'2024-09-03',15,'Other','Coffee'),
-(44,'2024-09-04',25,'Food','Lunch'),
-(45,'2024-09-04',200,'Shopping','Home supplies'),
-(46,'2024-09-04',10,'Other','Parking'),
-(47,'2024-09-05',350,'Rent','Shared rent payment'),
-(48,'2024-09-05',40,'Food','Snacks'),
-(49,'2024-09-05',75,'Entertainment','Theater tickets'),
-(50,'2024-09-05',100,'Shopping','Books'),
-(51,'2024-09-05',15,'Other','Miscellaneous'),
-(52,'2024-09-30',1000,'Rent','Monthly rent payment'),
-(53,'2024-09-30',250,'Food','Groceries for the week'),
-(54,'2024-09-30',40,'Entertainment','Cinema tickets'),
-(55,'2024-09-30',100,'Shopping','Clothes'),
-(56,'2024-09-30',20,'Other','Public transport'),
-(62,'2024-08-15',10,'Shopping','Bought potatoes'),
-(63,'2024-08-01',1227,'Rent','Monthly rent payment'),
-(64,'2024-08-01',300,'Food','Groceries for the week'),
-(65,'2024-08-01',1200,'Rent','Monthly rent payment'),
-(66,'2024-08-01',300,'Food','Groceries for the week');
+-- PostgreSQL version of expense_manager dump
+
+DROP TABLE IF EXISTS expenses;
+DROP TABLE IF EXISTS expense_events;
+DROP TABLE IF EXISTS expense_versions;
+DROP TABLE IF EXISTS categories;
+
+-- Category dimension. Ids are fixed so they match on every shard, new categories are added with the next id on all shards
+CREATE TABLE categories (
+  id SMALLINT PRIMARY KEY,
+  name VARCHAR(64) NOT NULL UNIQUE
+);
+
+INSERT INTO categories (id, name) VALUES
+(1,'Food'),
+(2,'Rent'),
+(3,'Shopping'),
+(4,'Entertainment'),
+(5,'Other');
+
+CREATE TABLE expenses (
+  id SERIAL PRIMARY KEY,
+  expense_date DATE NOT NULL,
+  amount REAL NOT NULL,
+  category_id SMALLINT NOT NULL REFERENCES categories (id),
+  notes TEXT,
+  owner_id VARCHAR(64) NOT NULL DEFAULT 'public'
+);
+
+CREATE INDEX idx_expenses_owner_date ON expenses (owner_id, expense_date);
+CREATE INDEX idx_expenses_amount ON expenses (amount DESC); -- Top expenses of large ranges without sorting the range
+
+-- Change events sent through NOTIFY expense_changes. Kept so change feed subscribers can resume by event id
+CREATE TABLE expense_events (
+  id BIGSERIAL PRIMARY KEY,
+  action VARCHAR(16) NOT NULL,
+  expense_dates DATE[] NOT NULL,
+  categories TEXT[] NOT NULL,
+  records INTEGER NOT NULL,
+  owner_id VARCHAR(64) NOT NULL DEFAULT 'public',
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_expense_events_owner_id ON expense_events (owner_id, id);
+
+-- Content version per owner and month, bumped by every change. Read endpoints use it for ETag and Last-Modified
+CREATE TABLE expense_versions (
+  owner_id VARCHAR(64) NOT NULL,
+  month DATE NOT NULL,
+  version BIGINT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (owner_id, month)
+);
+
+-- Data insert
+INSERT INTO expenses (id, expense_date, amount, category_id, notes)
+SELECT seed.id, seed.expense_date::date, seed.amount, categories.id, seed.notes FROM (VALUES
+(3,'2024-08-02',50,'Entertainment','Movie tickets'),
+(4,'2024-08-02',150,'Shopping','New shoes'),
+(5,'2024-08-03',100,'Food','Dinner at a restaurant'),
+(11,'2024-08-02',400,'Food','Groceries for the week'),
+(12,'2024-08-02',80,'Entertainment','Concert tickets'),
+(13,'2024-08-02',100,'Shopping','Clothes'),
+(14,'2024-08-02',50,'Other','Gasoline'),
+(15,'2024-08-03',60,'Food','Dinner at a restaurant'),
+(16,'2024-08-03',20,'Entertainment','Video rental'),
+(17,'2024-08-03',120,'Shopping','Gadgets'),
+(18,'2024-08-03',15,'Other','Coffee'),
+(19,'2024-08-04',25,'Food','Lunch'),
+(20,'2024-08-04',200,'Shopping','Home supplies'),
+(21,'2024-08-04',10,'Other','Parking'),
+(22,'2024-08-05',350,'Rent','Shared rent payment'),
+(23,'2024-08-05',40,'Food','Snacks'),
+(24,'2024-08-05',75,'Entertainment','Theater tickets'),
+(25,'2024-08-05',100,'Shopping','Books'),
+(26,'2024-08-05',15,'Other','Miscellaneous'),
+(27,'2024-08-06',30,'Food','Breakfast'),
+(28,'2024-08-06',100,'Shopping','Shoes'),
+(29,'2024-08-06',80,'Entertainment','Movies'),
+(30,'2024-08-06',15,'Other','Public transport'),
+(31,'2024-09-01',1200,'Rent','Monthly rent payment'),
+(32,'2024-09-01',300,'Food','Groceries for the week'),
+(33,'2024-09-01',50,'Entertainment','Movie tickets'),
+(34,'2024-09-01',150,'Shopping','New shoes'),
+(35,'2024-09-01',20,'Other','Bus fare'),
+(36,'2024-09-02',400,'Food','Groceries for the week'),
+(37,'2024-09-02',80,'Entertainment','Concert tickets'),
+(38,'2024-09-02',100,'Shopping','Clothes'),
+(39,'2024-09-02',50,'Other','Gasoline'),
+(40,'2024-09-03',60,'Food','Dinner at a restaurant'),
+(41,'2024-09-03',20,'Entertainment','Video rental'),
+(42,'2024-09-03',120,'Shopping','Gadgets'),
+(43,'2024-09-03',15,'Other','Coffee'),
+(44,'2024-09-04',25,'Food','Lunch'),
+(45,'2024-09-04',200,'Shopping','Home supplies'),
+(46,'2024-09-04',10,'Other','Parking'),
+(47,'2024-09-05',350,'Rent','Shared rent payment'),
+(48,'2024-09-05',40,'Food','Snacks'),
+(49,'2024-09-05',75,'Entertainment','Theater tickets'),
+(50,'2024-09-05',100,'Shopping','Books'),
+(51,'2024-09-05',15,'Other','Miscellaneous'),
+(52,'2024-09-30',1000,'Rent','Monthly rent payment'),
+(53,'2024-09-30',250,'Food','Groceries for the week'),
+(54,'2024-09-30',40,'Entertainment','Cinema tickets'),
+(55,'2024-09-30',100,'Shopping','Clothes'),
+(56,'2024-09-30',20,'Other','Public transport'),
+(62,'2024-08-15',10,'Shopping','Bought potatoes'),
+(63,'2024-08-01',1227,'Rent','Monthly rent payment'),
+(64,'2024-08-01',300,'Food','Groceries for the week'),
+(65,'2024-08-01',1200,'Rent','Monthly rent payment'),
+(66,'2024-08-01',300,'Food','Groceries for the week')
+) AS seed (id, expense_date, amount, category, notes)
+JOIN categories ON categories.name = seed.category;
@@ -0,0 +1,67 @@
+'''
+Production entry point of the backend. Runs several uvicorn worker processes, each one with its own connection pools
+and loggers created after the worker starts. The connection budget of each database is split across the workers so
+workers x (pool + change feed listener) stays under it.
+
+Workers share nothing but the port: caches and the slow query statistics of /admin/slow_queries are per worker, so each
+request sees the statistics of the worker that answers it. slow_query.log has the slow statements of every worker.
+
+Usage:
+    python -m backend.launcher --workers 4 --db-connection-budget 90
+    kill -HUP <launcher pid>     #Graceful reload: workers are restarted one at a time, each old worker drains its requests
+                                 #and exits before its replacement starts, so one worker less serves during each restart
+'''
+import argparse
+import os
+import uvicorn
+
+#%% Global variables
+DB_CONNECTION_BUDGET =int(os.getenv("DB_CONNECTION_BUDGET","90")) #Connections this deployment may open per database
+LISTENER_CONNECTIONS =1 #Change feed connection per worker and database, outside the pool
+GRACEFUL_TIMEOUT =int(os.getenv("GRACEFUL_TIMEOUT","30")) #Seconds a stopping worker waits for in flight requests and streams
+
+#%% Functions
+
+def pool_size_per_worker(budget,workers):
+    '''
+        Description:
+            Function to split the connection budget of a database across the workers
+        Inputs:
+            budget (int): Maximum connections to one database
+            workers (int): Number of worker processes
+        Returns:
+            pool_size (int): Maximum pool connections of each worker
+    '''
+    pool_size=budget//workers-LISTENER_CONNECTIONS
+    if pool_size<1:
+        raise ValueError(f"Connection budget {budget} too small for {workers} workers, at least {workers*(LISTENER_CONNECTIONS+1)} needed")
+    return pool_size
+
+def run(host="0.0.0.0",port=8000,workers=None,budget=DB_CONNECTION_BUDGET,graceful_timeout=GRACEFUL_TIMEOUT):
+    '''
+        Description:
+            Function to start the worker processes. Workers import the app after they start, so the pool size is passed through the environment
+        Inputs:
+            host (str), port (int): Address to bind
+            workers (int): Number of worker processes. One per core as default
+            budget (int): Maximum connections to one database
+            graceful_timeout (int): Seconds to drain a worker on reload or shutdown
+    '''
+    workers=workers or os.cpu_count() or 1
+    pool_size=pool_size_per_worker(budget,workers)
+    os.environ["POOL_MAX_CONN"]=str(pool_size)
+    os.environ["POOL_MIN_CONN"]=str(min(int(os.getenv("POOL_MIN_CONN","1")),pool_size))
+    print(f"Starting {workers} workers | pool size {pool_size} | connection budget {budget} per database")
+    uvicorn.run("backend.server:server",host=host,port=port,workers=workers,
+                timeout_graceful_shutdown=graceful_timeout,proxy_headers=True)
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Run the expenses API with several worker processes")
+    parser.add_argument("--host",default="0.0.0.0")
+    parser.add_argument("--port",type=int,default=int(os.getenv("PORT","8000")))
+    parser.add_argument("--workers",type=int,default=int(os.getenv("WEB_CONCURRENCY","0")) or None,help="One per core as default")
+    parser.add_argument("--db-connection-budget",type=int,default=DB_CONNECTION_BUDGET,help="Maximum connections to each database")
+    parser.add_argument("--graceful-timeout",type=int,default=GRACEFUL_TIMEOUT,help="Seconds to drain a worker on reload or shutdown")
+    args=parser.parse_args()
+    run(args.host,args.port,args.workers,args.db_connection_budget,args.graceful_timeout)
@@ -1,18 +1,39 @@
-import logging
-
-def logger_setup(name,file_name):
-
-    logger=logging.getLogger(name) #Configure the logger for debugging and errors
-    logger.setLevel(logging.DEBUG)
-    if not logger.handlers:
-        file_handler=logging.FileHandler(file_name)
-        formatter=logging.Formatter("%(asctime)s- %(name)s - %(levelname)s - %(message)s\n")
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_formatter = logging.Formatter('[%(levelname)s] %(message)s')
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-    return logger
\ No newline at end of file
+import logging
+import os
+
+class ProcessHandler(logging.Handler):
+    '''
+        Description:
+            Handler creating its real handler on the first record of each process. Modules set their loggers up at import,
+            which can happen in the launcher before the workers exist, so no file or stream is opened before the process that writes it
+    '''
+    def __init__(self,factory,level=logging.NOTSET):
+        super().__init__(level)
+        self.factory=factory
+        self.pid=None
+        self.handler=None
+
+    def emit(self,record):
+        if self.pid!=os.getpid(): #First record of this process, or a process forked after an inherited handler was created
+            self.handler=self.factory()
+            self.pid=os.getpid()
+        self.handler.handle(record)
+
+def file_handler(file_name):
+    handler=logging.FileHandler(file_name)
+    handler.setFormatter(logging.Formatter("%(asctime)s- %(name)s - %(levelname)s - %(message)s\n"))
+    return handler
+
+def console_handler():
+    handler=logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+    return handler
+
+def logger_setup(name,file_name):
+
+    logger=logging.getLogger(name) #Configure the logger for debugging and errors
+    logger.setLevel(logging.DEBUG)
+    if not logger.handlers:
+        logger.addHandler(ProcessHandler(lambda: file_handler(file_name)))
+        logger.addHandler(ProcessHandler(console_handler,logging.INFO))
+    return logger
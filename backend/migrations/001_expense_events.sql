@@ -0,0 +1,10 @@
+-- Change events for the NOTIFY expense_changes feed. Run once on databases created before the change feed
+
+CREATE TABLE IF NOT EXISTS expense_events (
+  id BIGSERIAL PRIMARY KEY,
+  action VARCHAR(16) NOT NULL,
+  expense_dates DATE[] NOT NULL,
+  categories TEXT[] NOT NULL,
+  records INTEGER NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,8 @@
+-- Owner dimension for sharded deployments. Run once on every shard created before owners existed.
+-- Existing expenses belong to the public owner, which stays on the shard backend.shard_router maps it to.
+
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS owner_id VARCHAR(64) NOT NULL DEFAULT 'public';
+CREATE INDEX IF NOT EXISTS idx_expenses_owner_date ON expenses (owner_id, expense_date);
+
+ALTER TABLE expense_events ADD COLUMN IF NOT EXISTS owner_id VARCHAR(64) NOT NULL DEFAULT 'public';
+CREATE INDEX IF NOT EXISTS idx_expense_events_owner_id ON expense_events (owner_id, id);
@@ -0,0 +1,4 @@
+-- Index for the exact top expenses of approximate analytics. Lets Postgres walk expenses by amount and stop at the first 5 rows of the range.
+-- CONCURRENTLY avoids blocking writes while it is built. Run it outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_expenses_amount ON expenses (amount DESC);
@@ -0,0 +1,9 @@
+-- Content version per owner and month for ETag / conditional GET. Run once on every shard.
+
+CREATE TABLE IF NOT EXISTS expense_versions (
+  owner_id VARCHAR(64) NOT NULL,
+  month DATE NOT NULL,
+  version BIGINT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (owner_id, month)
+);
@@ -0,0 +1,33 @@
+-- Category dimension with SMALLINT keys. Run once on every shard, in one transaction.
+-- Categories found in existing rows that are not one of the five frontend categories get the next ids. Run the same
+-- statements in the same order on every shard so ids match, and check SELECT * FROM categories agrees everywhere.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS categories (
+  id SMALLINT PRIMARY KEY,
+  name VARCHAR(64) NOT NULL UNIQUE
+);
+
+INSERT INTO categories (id, name) VALUES
+(1,'Food'),
+(2,'Rent'),
+(3,'Shopping'),
+(4,'Entertainment'),
+(5,'Other')
+ON CONFLICT DO NOTHING;
+
+INSERT INTO categories (id, name)
+SELECT (SELECT MAX(id) FROM categories) + ROW_NUMBER() OVER (ORDER BY extra.category), extra.category
+FROM (SELECT DISTINCT category FROM expenses WHERE category NOT IN (SELECT name FROM categories)) AS extra;
+
+ALTER TABLE expenses ADD COLUMN category_id SMALLINT;
+UPDATE expenses SET category_id = categories.id FROM categories WHERE categories.name = expenses.category;
+ALTER TABLE expenses ALTER COLUMN category_id SET NOT NULL;
+ALTER TABLE expenses ADD CONSTRAINT expenses_category_id_fkey FOREIGN KEY (category_id) REFERENCES categories (id);
+ALTER TABLE expenses DROP COLUMN category;
+
+COMMIT;
+
+-- DROP COLUMN only hides the text column. Rewrite the table (and its indexes) to get the smaller rows:
+-- VACUUM FULL expenses;
@@ -1,170 +1,420 @@
-#%% Import and app initialization
-
-#Library imports
-from fastapi import FastAPI,HTTPException
-from datetime import date
-from backend import db_helper_postgre 
-from typing import List,Optional,Dict
-import pydantic
-from pydantic import BaseModel
-import datetime
-from datetime import date
-
-#Initializing the app
-server=FastAPI()
-
-#%% Defining response base model
-
-class expense_model(BaseModel): #This class will to retrieve a subset for fetch date queries
-    amount:float
-    category:str
-    notes:Optional[str]=None
-
-class expense_payload(BaseModel):
-    expense_date:date
-    entries:List[expense_model]
-
-class expense_model_where_mapping(BaseModel): #This class contains a flexible type hint for all columns. This will help to manage custom select and where clauses
-    expense_date:Optional[date]=None
-    amount:Optional[float]=None
-    category:Optional[str]=None
-    notes:Optional[str]=None
-
-class operator_model(BaseModel): #This class contains a flexible type hint for all operators. This will help to manage custom select and where clauses
-    expense_date:Optional[str]=None
-    amount:Optional[str]=None
-    category:Optional[str]=None
-    notes:Optional[str]=None
-
-class expense_custom_query(BaseModel):
-    where_info:expense_model_where_mapping
-    operator_info:operator_model
-
-class expense_set_mapping(BaseModel):
-    set_info:expense_model_where_mapping
-    where_info:expense_model_where_mapping
-    operator_info:operator_model
- 
-class expense_date_range(BaseModel):
-    start_date:date
-    end_date:date
-
-#%% Endpoint to check backend health
-@server.get("/")
-def root():
-    return {"message": "PostgreSQL backend is alive!"}
-
-#%% Endpoint for retrieve date
-
-@server.get("/expenses/fetch_date/{expense_date}",response_model=List[expense_model]) #This will return the subset defined in fetch_date_model
-def server_fetch_date(expense_date:date):
-    '''
-    Description
-        Retrieve all expenses from a given date in format YYYY-MM-DD
-    Inputs:
-        expense_date (date): Date in format YYYY-MM-DD
-    Returns
-        List[expense_model]: List of expenses for the specified date
-    '''
-    results=db_helper_postgre.retrieve_date(expense_date)
-    if len(results)==0: 
-        raise HTTPException(status_code=500,detail="Failed to retrieve data or date does not exist in database")
-    return results
-#%% Endpoint to create a record
-
-@server.post("/expenses")
-def server_create_expense(expense_info:expense_payload):
-    '''
-    Description:
-        Create an expense using information of: 
-    Inputs:
-        expense_date (date): as YYYY-MM-DD
-        amount (float): Amount of the expense
-        category (str): As one of Shopping, Food, Entertainment, Rent, Other
-        notes (str): Optional field for notes of the expense
-    Returns
-        None
-    '''
-    for entry in expense_info.entries:
-        db_helper_postgre.create_record(
-            expense_date=expense_info.expense_date,
-            amount=entry.amount,
-            category=entry.category,
-            notes=entry.notes
-        ) 
-#%% Endpoint to custom query
-@server.post("/expenses/custom_query")
-def server_custom_query(payload:expense_custom_query):
-    '''
-    Description:
-        Query expenses based on Where conditions of: 
-    Inputs:
-        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
-        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
-    Returns
-        results (int): Number of records updated
-    '''
-    #****** Form the where query
-    where_dict=payload.where_info.model_dump()
-    operator_dict=payload.operator_info.model_dump()
-    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict)
-    if len(results)==0: 
-        raise HTTPException(status_code=500,detail="No records match the where conditions")
-
-    return results
-
-#%% Endpoint to delete record
-@server.delete("/expenses")
-def server_delete(payload:expense_custom_query):
-    '''
-    Description:
-        Delete expenses based on Where conditions
-    Inputs:
-        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
-        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
-    Returns
-        results (int): Number of records updated
-    '''
-
-    where_dict=payload.where_info.model_dump()
-    operator_dict=payload.operator_info.model_dump()
-    num_records=db_helper_postgre.delete_record(where_dict,operator_dict)
-    return {"action":"delete","status": "Success","records_deleted":num_records}
-#%% Endpoint to update record
-@server.put("/expenses")
-def server_update(payload:expense_set_mapping):
-    '''
-    Description:
-        Update expenses based on Set of new values and Where conditions 
-    Inputs:
-        set_dict (json): json payload containing the column as key and new values as values.
-        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
-        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
-    Returns
-        message of status
-    '''
-    
-    set_dict=payload.set_info.model_dump()
-    where_dict=payload.where_info.model_dump()
-    operator_dict=payload.operator_info.model_dump()
-    num_records=db_helper_postgre.update_record(set_dict,where_dict,operator_dict)
-    return {"action":"update","status": "Success","records_updated":num_records}
-
-#%% Endpoint for analytics
-@server.post("/analytics")
-def server_analytics(payload:expense_date_range):
-    '''
-    Description:
-        Execute the analytics dashboard based on a date range
-    Inputs:
-        expense_date_date (json): json payload containing start date and end date
-    Returns
-        dictionary containing summary of expenses and top expenses. 
-    '''
-    start_date=payload.start_date
-    end_date=payload.end_date
-    total_expense,top_expense=db_helper_postgre.expense_summary(start_date,end_date)
-    return {
-        "summary_by_category": total_expense,
-        "top_expenses": top_expense
-    }
+#%% Import and app initialization
+
+#Library imports
+from fastapi import FastAPI,HTTPException,Request,Header,Depends
+from fastapi.responses import ORJSONResponse,StreamingResponse,Response
+from datetime import date
+from backend import db_helper_postgre,shard_router
+from backend.change_feed import change_feed_for,replay_and_follow
+from backend.compression import CompressionMiddleware
+from backend.slow_query import recorder
+import os
+import hashlib
+import hmac
+from contextlib import asynccontextmanager
+from email.utils import format_datetime,parsedate_to_datetime
+from typing import List,Optional,Dict,Annotated
+import pydantic
+from pydantic import BaseModel
+import datetime
+from datetime import date
+
+#Initializing the app
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    shard_router.router.close() #Runs once the worker drained its requests, so the connections are returned to Postgres on reload and shutdown
+
+server=FastAPI(lifespan=lifespan)
+server.add_middleware(CompressionMiddleware) #zstd, brotli or gzip as negotiated with Accept-Encoding
+
+#Owner of the expenses of a request. Routes the request to the owner shard
+owner_header=Annotated[str,Header(alias="X-Owner-Id",min_length=1,max_length=64)]
+
+def unit_of_work(owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Request scoped unit of work on the owner shard. Helper calls of the request share one connection and transaction,
+        committed once the endpoint returns and rolled back when it raises
+    '''
+    with db_helper_postgre.UnitOfWork(owner) as uow:
+        yield uow
+
+request_uow=Annotated[db_helper_postgre.UnitOfWork,Depends(unit_of_work)]
+
+#%% Defining response base model
+
+class expense_model(BaseModel): #This class will to retrieve a subset for fetch date queries
+    amount:float
+    category:str
+    notes:Optional[str]=None
+
+FETCH_DATE_COLUMNS=list(expense_model.model_fields) #Columns returned by fetch date, selected in the database instead of filtered by the response model
+
+class expense_payload(BaseModel):
+    expense_date:date
+    entries:List[expense_model]
+
+class expense_model_where_mapping(BaseModel): #This class contains a flexible type hint for all columns. This will help to manage custom select and where clauses
+    expense_date:Optional[date]=None
+    amount:Optional[float]=None
+    category:Optional[str]=None
+    notes:Optional[str]=None
+
+class operator_model(BaseModel): #This class contains a flexible type hint for all operators. This will help to manage custom select and where clauses
+    expense_date:Optional[str]=None
+    amount:Optional[str]=None
+    category:Optional[str]=None
+    notes:Optional[str]=None
+
+class expense_custom_query(BaseModel):
+    where_info:expense_model_where_mapping
+    operator_info:operator_model
+
+class expense_set_mapping(BaseModel):
+    set_info:expense_model_where_mapping
+    where_info:expense_model_where_mapping
+    operator_info:operator_model
+ 
+class expense_date_range(BaseModel):
+    start_date:date
+    end_date:date
+    approximate:bool=False #Estimate category totals from a sample of the table. Meant for large date ranges
+    sample_percent:float=1.0
+    sample_method:str="system" #Reads only the sampled pages. bernoulli samples rows over a full scan
+
+class aggregate_model(BaseModel): #This class describes one aggregate of an aggregation query, i.e. sum of amount or 95th percentile of amount
+    function:str
+    column:Optional[str]=None
+    percentile:Optional[float]=None
+
+class expense_aggregate_query(BaseModel):
+    where_info:expense_model_where_mapping=expense_model_where_mapping()
+    operator_info:operator_model=operator_model()
+    group_by:List[str]=[]
+    date_bucket:Optional[str]=None
+    aggregates:List[aggregate_model]
+    having_info:Dict[str,float]={}
+    having_operator_info:Dict[str,str]={}
+    order_by:List[str]=[]
+    descending:bool=False
+    limit:Optional[int]=None
+
+#%% Conditional requests
+
+def entity_tag(scope,version):
+    '''
+        Description:
+            Function to form the weak ETag of a read response from what was asked and the content version of the data it reads
+        Inputs:
+            scope (str): Route, parameters and owner of the request
+            version (str): Content version from db_helper_postgre.content_version
+        Returns:
+            etag (str): Weak entity tag
+    '''
+    return f'W/"{hashlib.md5(f"{scope}|{version}".encode("utf-8")).hexdigest()}"'
+
+def not_modified(request,etag,last_modified):
+    '''
+        Description:
+            Function to evaluate If-None-Match, or If-Modified-Since when there is no If-None-Match, with a weak comparison
+        Inputs:
+            request (Request): Incoming request
+            etag (str): Current ETag of the response
+            last_modified (datetime): Last change of the data. None when it was never changed
+        Returns:
+            not_modified (bool): True when the client copy is still valid and a 304 can be sent
+    '''
+    if_none_match=request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags=[tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since=request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return last_modified.replace(microsecond=0)<=parsedate_to_datetime(if_modified_since)
+    except (TypeError,ValueError):
+        return False
+
+def cache_headers(etag,last_modified):
+    headers={"ETag":etag,"Cache-Control":"no-cache"} #Clients may keep the response but have to revalidate it
+    if last_modified is not None:
+        headers["Last-Modified"]=format_datetime(last_modified,usegmt=True)
+    return headers
+
+#%% Endpoint to check backend health
+@server.get("/")
+def root():
+    return {"message": "PostgreSQL backend is alive!"}
+
+#%% Endpoint for retrieve date
+
+@server.get("/expenses/fetch_date/{expense_date}",response_model=List[expense_model]) #This will return the subset defined in fetch_date_model
+def server_fetch_date(request:Request,expense_date:date,uow:request_uow,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description
+        Retrieve all expenses from a given date in format YYYY-MM-DD
+    Inputs:
+        expense_date (date): Date in format YYYY-MM-DD
+        X-Owner-Id (header): Owner of the expenses, public as default
+        If-None-Match, If-Modified-Since (headers): Optional validators of a previous response
+    Returns
+        List[expense_model]: List of expenses for the specified date. 304 without body when the validators still match
+    '''
+    version,last_modified=db_helper_postgre.content_version(expense_date,expense_date,owner=owner,uow=uow)
+    headers=cache_headers(entity_tag(f"fetch_date|{expense_date}|{owner}",version),last_modified)
+    if not_modified(request,headers["ETag"],last_modified):
+        return Response(status_code=304,headers=headers)
+
+    results=db_helper_postgre.retrieve_date(expense_date,columns=FETCH_DATE_COLUMNS,compact=True,owner=owner,uow=uow)
+    if len(results)==0: 
+        raise HTTPException(status_code=500,detail="Failed to retrieve data or date does not exist in database")
+    return ORJSONResponse(results,headers=headers) #Rows are already typed by the database, returning the response directly skips the per row pydantic validation
+#%% Endpoint to create a record
+
+@server.post("/expenses")
+def server_create_expense(expense_info:expense_payload,uow:request_uow,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Create an expense using information of: 
+    Inputs:
+        expense_date (date): as YYYY-MM-DD
+        amount (float): Amount of the expense
+        category (str): As one of Shopping, Food, Entertainment, Rent, Other
+        notes (str): Optional field for notes of the expense
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        None
+    '''
+    try:
+        db_helper_postgre.create_records(
+            expense_date=expense_info.expense_date,
+            entries=[entry.model_dump() for entry in expense_info.entries],
+            owner=owner,
+            uow=uow
+        )
+    except ValueError as e: #Unknown category or archived month
+        raise HTTPException(status_code=400,detail=str(e))
+#%% Endpoint to custom query
+@server.post("/expenses/custom_query")
+def server_custom_query(payload:expense_custom_query,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Query expenses based on Where conditions of: 
+    Inputs:
+        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
+        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        results (int): Number of records updated
+    '''
+    #****** Form the where query
+    where_dict=payload.where_info.model_dump()
+    operator_dict=payload.operator_info.model_dump()
+    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict,compact=True,owner=owner)
+    if len(results)==0: 
+        raise HTTPException(status_code=500,detail="No records match the where conditions")
+
+    return ORJSONResponse(results)
+
+#%% Endpoint to aggregate query
+@server.post("/expenses/aggregate")
+def server_aggregate(payload:expense_aggregate_query,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Aggregate expenses in the database (GROUP BY) so that only the aggregated rows are returned.
+        Archived months are excluded, their totals are only in /analytics and the row endpoints
+    Inputs:
+        where_info (json): json payload containing the Where clause column as key names and conditions to query as values
+        operator_info (json): json payload containg the relational operator between column name and value of where_info
+        group_by (list): Columns to group by
+        date_bucket (str): Optional day, week, month, quarter or year bucketing of expense_date
+        aggregates (list): Aggregates as function (count, sum, avg, min, max, percentile), column and percentile
+        having_info, having_operator_info (json): Conditions over the aggregate aliases, i.e. {"sum_amount":100} and {"sum_amount":">"}
+        order_by (list), descending (bool), limit (int): Sorting and size of the result
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        results (list): One record per group
+    '''
+    try:
+        results=db_helper_postgre.retrieve_aggregate(
+            group_by=payload.group_by,
+            aggregates=[aggregate.model_dump() for aggregate in payload.aggregates],
+            where_dict=payload.where_info.model_dump(),
+            operator_dict=payload.operator_info.model_dump(),
+            date_bucket=payload.date_bucket,
+            having_dict=payload.having_info,
+            having_operator_dict=payload.having_operator_info,
+            order_by=payload.order_by,
+            descending=payload.descending,
+            limit=payload.limit,
+            owner=owner
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400,detail=str(e))
+    return results
+
+#%% Endpoint to delete record
+@server.delete("/expenses")
+def server_delete(payload:expense_custom_query,uow:request_uow,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Delete expenses based on Where conditions. Conditions matching archived expenses are rejected with 400
+    Inputs:
+        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
+        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        results (int): Number of records updated
+    '''
+
+    where_dict=payload.where_info.model_dump()
+    operator_dict=payload.operator_info.model_dump()
+    try:
+        num_records=db_helper_postgre.delete_record(where_dict,operator_dict,owner=owner,uow=uow)
+    except ValueError as e: #Missing where conditions or archived expenses
+        raise HTTPException(status_code=400,detail=str(e))
+    return {"action":"delete","status": "Success","records_deleted":num_records}
+#%% Endpoint to update record
+@server.put("/expenses")
+def server_update(payload:expense_set_mapping,uow:request_uow,owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Update expenses based on Set of new values and Where conditions. Conditions matching archived expenses are rejected with 400
+    Inputs:
+        set_dict (json): json payload containing the column as key and new values as values.
+        where_dict (json): json payload containing the Where clause column as key names and conditions to query as values 
+        operator_dict (json): json payload containg the relational operator between column name and value of where_dict
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        message of status
+    '''
+    
+    set_dict=payload.set_info.model_dump()
+    where_dict=payload.where_info.model_dump()
+    operator_dict=payload.operator_info.model_dump()
+    try:
+        num_records=db_helper_postgre.update_record(set_dict,where_dict,operator_dict,owner=owner,uow=uow)
+    except ValueError as e: #Unknown category, missing where conditions or archived expenses
+        raise HTTPException(status_code=400,detail=str(e))
+    return {"action":"update","status": "Success","records_updated":num_records}
+
+#%% Endpoint for analytics
+@server.post("/analytics")
+def server_analytics(payload:expense_date_range,owner:Annotated[Optional[str],Header(alias="X-Owner-Id",max_length=64)]=None):
+    '''
+    Description:
+        Execute the analytics dashboard based on a date range
+    Inputs:
+        expense_date_date (json): json payload containing start date and end date.
+                                  Optional approximate, sample_percent and sample_method to estimate the summary from a sample
+        X-Owner-Id (header): Optional owner of the expenses. Analytics of every owner across all shards when missing
+    Returns
+        dictionary containing summary of expenses and top expenses. 
+        Approximate requests also contain the margins of each category and the approximation details
+    '''
+    return analytics(payload,owner)
+
+@server.get("/analytics")
+def server_analytics_conditional(request:Request,response:Response,start_date:date,end_date:date,approximate:bool=False,sample_percent:float=1.0,
+                                 sample_method:str="system",owner:Annotated[Optional[str],Header(alias="X-Owner-Id",max_length=64)]=None):
+    '''
+    Description:
+        Same analytics as POST /analytics with query parameters, so clients can revalidate a previous response
+    Inputs:
+        start_date, end_date (date): Date range
+        approximate, sample_percent, sample_method: Optional estimation from a sample
+        X-Owner-Id (header): Optional owner of the expenses. Analytics of every owner across all shards when missing
+        If-None-Match, If-Modified-Since (headers): Optional validators of a previous response
+    Returns
+        Same dictionary as POST /analytics. 304 without body when the validators still match
+    '''
+    payload=expense_date_range(start_date=start_date,end_date=end_date,approximate=approximate,
+                               sample_percent=sample_percent,sample_method=sample_method)
+    version,last_modified=db_helper_postgre.content_version(start_date,end_date,owner=owner)
+    headers=cache_headers(entity_tag(f"analytics|{payload.model_dump_json()}|{owner}",version),last_modified)
+    if not_modified(request,headers["ETag"],last_modified):
+        return Response(status_code=304,headers=headers)
+    response.headers.update(headers)
+    return analytics(payload,owner)
+
+def analytics(payload,owner):
+    '''
+        Description:
+            Function to run the exact or approximate analytics of both analytics endpoints
+    '''
+    start_date=payload.start_date
+    end_date=payload.end_date
+    if not payload.approximate:
+        total_expense,top_expense=db_helper_postgre.expense_summary(start_date,end_date,owner=owner)
+        return {
+            "summary_by_category": total_expense,
+            "top_expenses": top_expense
+        }
+
+    try:
+        total_expense,top_expense,approximation=db_helper_postgre.expense_summary_approx(
+            start_date,end_date,owner=owner,sample_percent=payload.sample_percent,sample_method=payload.sample_method)
+    except ValueError as e:
+        raise HTTPException(status_code=400,detail=str(e))
+    return {
+        "summary_by_category": total_expense,
+        "top_expenses": top_expense,
+        "approximation": approximation
+    }
+
+#%% Endpoint for change feed
+KEEP_ALIVE_SECONDS=15 #Comment sent to idle streams so proxies keep the connection open
+
+@server.get("/expenses/changes")
+async def server_changes(request:Request,start_date:Optional[date]=None,end_date:Optional[date]=None,
+                         category:Optional[str]=None,last_event_id:Optional[int]=Header(default=None),
+                         owner:owner_header=db_helper_postgre.DEFAULT_OWNER):
+    '''
+    Description:
+        Server-sent events stream of created, updated and deleted expenses
+    Inputs:
+        start_date, end_date (date): Optional date range of the events to receive
+        category (str): Optional category of the events to receive
+        Last-Event-ID (header): Id of the last event received. Missed events are replayed before the live ones
+        X-Owner-Id (header): Owner of the expenses, public as default
+    Returns
+        text/event-stream with one event per change
+    '''
+    change_feed=change_feed_for(owner)
+    subscription=change_feed.subscribe(owner,start_date,end_date,category) #Subscribe before the replay so no event is lost in between
+
+    def retrieve_page(after,limit):
+        return db_helper_postgre.retrieve_events_since(after,limit=limit,owner=owner)
+
+    async def event_stream():
+        try:
+            async for message in replay_and_follow(subscription,last_event_id,retrieve_page,request.is_disconnected,KEEP_ALIVE_SECONDS):
+                yield message
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(),media_type="text/event-stream",headers={"Cache-Control":"no-cache"})
+
+#%% Endpoint for slow query log
+@server.get("/admin/slow_queries")
+def server_slow_queries(order_by:str="total",limit:int=20,admin_token:Annotated[Optional[str],Header(alias="X-Admin-Token")]=None):
+    '''
+    Description:
+        Query shapes of this server process with the highest total or p99 time, with the last EXPLAIN plan of the slow ones.
+        With several workers each one keeps its own statistics and the answer comes from the worker serving the request
+    Inputs:
+        order_by (str): total or p99
+        limit (int): Number of query shapes to return
+        X-Admin-Token (header): Must match ADMIN_TOKEN. The endpoint is closed while ADMIN_TOKEN is not configured
+    Returns
+        List of query shapes with calls, slow calls, total, mean, p99 and max time in ms, rows and last plan
+    '''
+    expected_token=os.getenv("ADMIN_TOKEN")
+    if not expected_token or not admin_token or not hmac.compare_digest(admin_token.encode(),expected_token.encode()):
+        raise HTTPException(status_code=403,detail="Invalid admin token")
+    try:
+        return recorder.top_shapes(order_by,limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400,detail=str(e))
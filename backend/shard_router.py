@@ -0,0 +1,114 @@
+import bisect
+import hashlib
+import os
+import threading
+from psycopg2 import pool
+
+#%% Global variables
+VIRTUAL_NODES =100 #Points per shard in the hash ring. More points give a more even split of owners
+POOL_MIN_CONN =int(os.getenv("POOL_MIN_CONN","1"))
+POOL_MAX_CONN =int(os.getenv("POOL_MAX_CONN","10"))
+POOL_TIMEOUT =float(os.getenv("POOL_TIMEOUT","30")) #Seconds waiting for a free connection before the request fails
+
+#%% Functions
+
+def ring_hash(key):
+    '''
+        Description:
+            Function to hash a key into the 64 bit hash ring. md5 is used for its even spread, not for security
+        Inputs:
+            key (str): Owner id or virtual node name
+        Returns:
+            position (int): Position in the ring
+    '''
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8],"big")
+
+def shard_dsns_from_env():
+    '''
+        Description:
+            Function to read the shard connection strings. SHARD_DATABASE_URLS is a comma separated list, DATABASE_URL is used as a single shard otherwise
+        Returns:
+            dsns (list): Connection string of each shard
+    '''
+    dsns=[dsn.strip() for dsn in os.getenv("SHARD_DATABASE_URLS","").split(",") if dsn.strip()]
+    return dsns or [os.getenv("DATABASE_URL")]
+
+class Shard:
+    '''
+        Description:
+            One Postgres database of the deployment with its own connection pool. The pool is created on first use
+            in each process, so a pool inherited through fork is never shared with the parent
+    '''
+    def __init__(self,index,dsn):
+        self.index=index
+        self.dsn=dsn
+        self.pool=None
+        self.semaphore=None
+        self.pid=None
+        self.lock=threading.Lock()
+
+    def getconn(self):
+        '''
+            Description:
+                Check out a connection. Waits up to POOL_TIMEOUT seconds for a free connection when the pool is exhausted,
+                then raises ConnectionError as any other connection failure
+        '''
+        with self.lock:
+            if self.pool is None or self.pid!=os.getpid(): #Connections of a parent process are left to the parent
+                self.pool=pool.ThreadedConnectionPool(POOL_MIN_CONN,POOL_MAX_CONN,self.dsn)
+                self.semaphore=threading.BoundedSemaphore(POOL_MAX_CONN)
+                self.pid=os.getpid()
+        if not self.semaphore.acquire(timeout=POOL_TIMEOUT):
+            raise ConnectionError(f"No free connection of shard {self.index} after {POOL_TIMEOUT} seconds")
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.semaphore.release()
+            raise
+
+    def putconn(self,connect,close=False):
+        '''
+            Description:
+                Return a connection to the pool. Broken connections are closed instead of reused
+        '''
+        try:
+            self.pool.putconn(connect,close=close)
+        finally:
+            self.semaphore.release()
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None and self.pid==os.getpid():
+                self.pool.closeall()
+            self.pool=None
+
+class ShardRouter:
+    '''
+        Description:
+            Consistent hash ring mapping each owner to one shard. Adding a shard only moves the owners of the ring segments it takes over
+    '''
+    def __init__(self,dsns,virtual_nodes=VIRTUAL_NODES):
+        self.shards=[Shard(index,dsn) for index,dsn in enumerate(dsns)]
+        ring=sorted((ring_hash(f"shard-{index}-{node}"),index) for index in range(len(dsns)) for node in range(virtual_nodes))
+        self.positions=[position for position,_ in ring]
+        self.indexes=[index for _,index in ring]
+
+    def shard_for(self,owner):
+        '''
+            Description:
+                Find the shard of an owner. First ring point clockwise from the owner hash
+            Inputs:
+                owner (str): Owner id
+            Returns:
+                shard (Shard): Shard holding the owner expenses
+        '''
+        if len(self.shards)==1:
+            return self.shards[0]
+        position=bisect.bisect(self.positions,ring_hash(owner))%len(self.positions)
+        return self.shards[self.indexes[position]]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+router=ShardRouter(shard_dsns_from_env())
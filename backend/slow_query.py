@@ -0,0 +1,213 @@
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from backend.log_setup import logger_setup
+
+#%% Global variables
+SLOW_QUERY_MS =float(os.getenv("SLOW_QUERY_MS","200")) #Statements slower than this are logged
+SLOW_QUERY_SAMPLE_RATE =float(os.getenv("SLOW_QUERY_SAMPLE_RATE","1.0")) #Fraction of slow statements that get an EXPLAIN plan
+SLOW_QUERY_EXPLAINS_PER_MINUTE =int(os.getenv("SLOW_QUERY_EXPLAINS_PER_MINUTE","6")) #EXPLAIN limit per query shape
+DURATIONS_PER_SHAPE =1000 #Most recent durations kept per shape for the p99
+ANALYZE_PREFIXES =("select","with") #Statements EXPLAINed with ANALYZE. Always inside a rolled back savepoint since a WITH can write
+
+#%% Logging config
+logger=logger_setup("slow_query","slow_query.log")
+
+#%% Functions
+
+def normalize_query(query):
+    '''
+        Description:
+            Function to reduce a statement to its shape. Literals and placeholders become ? and value lists collapse, so calls with different values group together
+        Inputs:
+            query (str or bytes): SQL statement
+        Returns:
+            shape (str): Normalized statement
+    '''
+    if isinstance(query,bytes):
+        query=query.decode("utf-8","replace")
+    shape=re.sub(r"'(?:[^']|'')*'","?",query) #String literals
+    shape=re.sub(r"%s|%\(\w+\)s","?",shape) #Placeholders
+    shape=re.sub(r"\b\d+(?:\.\d+)?\b","?",shape) #Numbers
+    shape=re.sub(r"\s+"," ",shape).strip()
+    shape=re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)","(?)",shape) #Value lists
+    shape=re.sub(r"\(\?\)(?:\s*,\s*\(\?\))+","(?)",shape) #Multi row VALUES
+    return shape
+
+def params_shape(params):
+    '''
+        Description:
+            Function to describe the parameters of a statement without their values
+        Inputs:
+            params (list, tuple or dictionary): Statement parameters
+        Returns:
+            shape (list or dictionary): Type name of each parameter
+    '''
+    if params is None:
+        return None
+    if isinstance(params,dict):
+        return {key:type(value).__name__ for key,value in params.items()}
+    return [type(value).__name__ for value in params]
+
+class QueryShapeStats:
+    '''
+        Description:
+            Running statistics of one query shape
+    '''
+    def __init__(self,shape):
+        self.shape=shape
+        self.calls=0
+        self.slow_calls=0
+        self.total_ms=0.0
+        self.max_ms=0.0
+        self.rows=0
+        self.durations=deque(maxlen=DURATIONS_PER_SHAPE)
+        self.explain_times=deque()
+        self.last_plan=None
+
+    def p99_ms(self):
+        durations=sorted(self.durations)
+        return durations[max(0,math.ceil(len(durations)*0.99)-1)] if durations else 0.0
+
+    def as_dict(self):
+        return {
+            "shape":self.shape,
+            "calls":self.calls,
+            "slow_calls":self.slow_calls,
+            "total_ms":round(self.total_ms,2),
+            "mean_ms":round(self.total_ms/self.calls,2) if self.calls else 0.0,
+            "p99_ms":round(self.p99_ms(),2),
+            "max_ms":round(self.max_ms,2),
+            "rows":self.rows,
+            "last_plan":self.last_plan
+        }
+
+class SlowQueryRecorder:
+    '''
+        Description:
+            Collects the duration of every statement per shape and logs the slow ones with an EXPLAIN plan, sampled and rate limited per shape
+    '''
+    def __init__(self,threshold_ms=SLOW_QUERY_MS,sample_rate=SLOW_QUERY_SAMPLE_RATE,explains_per_minute=SLOW_QUERY_EXPLAINS_PER_MINUTE):
+        self.threshold_ms=threshold_ms
+        self.sample_rate=sample_rate
+        self.explains_per_minute=explains_per_minute
+        self.stats={}
+        self.lock=threading.Lock()
+
+    def allow_explain(self,stats):
+        '''
+            Description:
+                Sampling and per shape rate limit of the EXPLAIN plans. Must be called with the lock held
+        '''
+        if random.random()>=self.sample_rate:
+            return False
+        now=time.monotonic()
+        while stats.explain_times and now-stats.explain_times[0]>60:
+            stats.explain_times.popleft()
+        if len(stats.explain_times)>=self.explains_per_minute:
+            return False
+        stats.explain_times.append(now)
+        return True
+
+    def record(self,connection,query,params,duration_ms,rowcount):
+        '''
+            Description:
+                Record a successful statement. Slow statements are logged and explained on the same connection
+            Inputs:
+                connection (connection): Connection that ran the statement, still inside its transaction
+                query (str): SQL statement
+                params (list, tuple or dictionary): Statement parameters
+                duration_ms (float): Execution time in milliseconds
+                rowcount (int): Rows returned or affected
+        '''
+        shape=normalize_query(query)
+        slow=duration_ms>=self.threshold_ms
+        with self.lock:
+            stats=self.stats.get(shape)
+            if stats is None:
+                stats=self.stats[shape]=QueryShapeStats(shape)
+            stats.calls+=1
+            stats.total_ms+=duration_ms
+            stats.max_ms=max(stats.max_ms,duration_ms)
+            stats.rows+=max(rowcount,0)
+            stats.durations.append(duration_ms)
+            if slow:
+                stats.slow_calls+=1
+            explain=slow and self.allow_explain(stats)
+        if not slow:
+            return
+
+        plan=self.explain(connection,query,params) if explain else None
+        if plan is not None:
+            stats.last_plan=plan
+        logger.warning(f"Slow query: {duration_ms:.1f} ms | rows:{rowcount} | params:{params_shape(params)} | shape:{shape}"
+                       +(f"\n{plan}" if plan is not None else ""))
+
+    def explain(self,connection,query,params):
+        '''
+            Description:
+                EXPLAIN a statement inside a savepoint so a failure does not abort the caller transaction.
+                Statements starting with SELECT or WITH are run again with ANALYZE and BUFFERS, other writes only get the estimated plan.
+                The savepoint is always rolled back: a WITH can modify data, and ANALYZE must leave no rows or notifications behind
+            Returns:
+                plan (str): Plan text. None when the plan could not be obtained
+        '''
+        text=query.decode("utf-8","replace") if isinstance(query,bytes) else query
+        options="(ANALYZE, BUFFERS)" if text.lstrip().lower().startswith(ANALYZE_PREFIXES) else ""
+        try:
+            with connection.cursor(cursor_factory=extensions.cursor) as cursor:
+                cursor.execute("SAVEPOINT slow_query_explain")
+                try:
+                    cursor.execute(f"EXPLAIN {options} {text}",params)
+                    return "\n".join(row[0] for row in cursor.fetchall())
+                finally:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as e:
+            logger.error(f"Unable to explain slow query. {e}")
+            return None
+
+    def top_shapes(self,order_by="total",limit=20):
+        '''
+            Description:
+                Query shapes with the highest total or p99 time
+            Inputs:
+                order_by (str): total or p99
+                limit (int): Number of shapes to return
+            Returns:
+                shapes (list): Statistics of each shape
+        '''
+        if order_by not in ("total","p99"):
+            raise ValueError(f"Order by {order_by} not in total, p99")
+        with self.lock:
+            shapes=[stats.as_dict() for stats in self.stats.values()]
+        return sorted(shapes,key=lambda shape:shape[f"{order_by}_ms"],reverse=True)[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.stats={}
+
+recorder=SlowQueryRecorder()
+
+class RecordingCursorMixin:
+    '''
+        Description:
+            Times every execute of a cursor and reports it to the recorder
+    '''
+    def execute(self,query,vars=None):
+        start=time.perf_counter()
+        result=super().execute(query,vars)
+        recorder.record(self.connection,query,vars,(time.perf_counter()-start)*1000,self.rowcount)
+        return result
+
+class RecordingCursor(RecordingCursorMixin,extensions.cursor):
+    pass
+
+class RecordingRealDictCursor(RecordingCursorMixin,RealDictCursor):
+    pass
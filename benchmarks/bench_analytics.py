@@ -0,0 +1,124 @@
+'''
+Benchmark of the approximate analytics against the exact path.
+
+Seeds --rows generated expenses of the benchmark owner over --years years in the first shard database (removed at the
+end unless --keep), then runs expense_summary and expense_summary_approx with each sample method over date ranges of
+increasing length ending at the last seeded date. Reports the best latency of each path, the largest relative error
+of the category totals and how many exact totals fall inside the reported 95% margins.
+
+Usage:
+    python -m benchmarks.bench_analytics --rows 5000000 --days 30 365 1825 --sample-percent 1
+'''
+import argparse
+import datetime
+import time
+
+from backend import db_helper_postgre,shard_router
+
+BENCH_OWNER ="benchmark"
+CATEGORIES=["Food","Rent","Shopping","Entertainment","Other"]
+
+#%% Functions
+def seed(cursor,num_rows,years,end_date):
+    '''
+        Description:
+            Function to insert the generated expenses. Rows are inserted in date order, as an expenses table grows, so heap pages hold
+            rows of the same days and SYSTEM samples are clustered
+        Inputs:
+            cursor (cursor): Cursor of the first shard
+            num_rows (int): Number of expenses
+            years (int): Years of expenses before end_date
+            end_date (date): Last expense date
+    '''
+    cursor.execute('''
+        INSERT INTO expenses (expense_date,amount,category_id,notes,owner_id)
+        SELECT %s::date-(%s-1-(i*%s/%s))::int,
+               round((random()*random()*(1+(i%%5))*200)::numeric,2),
+               1+(i%%5),
+               'Benchmark expense '||i,
+               %s
+        FROM generate_series(0,%s::bigint-1) AS i
+    ''',(end_date,years*365,years*365,num_rows,BENCH_OWNER,num_rows))
+    cursor.execute("ANALYZE expenses")
+
+def timed(function,repeat):
+    '''
+        Description:
+            Best time in ms of several runs of a function, with its last result
+    '''
+    best=float("inf")
+    for _ in range(repeat):
+        start=time.perf_counter()
+        result=function()
+        best=min(best,time.perf_counter()-start)
+    return round(best*1000,1),result
+
+def accuracy(exact,approximate):
+    '''
+        Description:
+            Function to compare approximate category totals with the exact ones
+        Returns:
+            max_error_pct (float): Largest relative error of a category total in %
+            covered (str): Exact totals inside the reported margin over categories
+    '''
+    exact_totals={row["category"]:row["total_expense"] for row in exact}
+    errors=[]
+    covered=0
+    for row in approximate:
+        exact_total=exact_totals.get(row["category"],0)
+        errors.append(abs(row["total_expense"]-exact_total)/exact_total*100 if exact_total else 0)
+        covered+=abs(row["total_expense"]-exact_total)<=row.get("total_expense_margin",0)+0.01
+    return round(max(errors,default=0),2),f"{covered}/{len(approximate)}"
+
+def bench_range(start_date,end_date,owner,sample_percent,repeat):
+    '''
+        Description:
+            Function to run the exact and approximate analytics of one date range
+        Returns:
+            results (list): One dictionary per path with latency, error and margin coverage
+    '''
+    exact_ms,(exact,_)=timed(lambda:db_helper_postgre.expense_summary(start_date,end_date,owner),repeat)
+    results=[{"days":(end_date-start_date).days+1,"path":"exact","ms":exact_ms,"approximate":False,"max_error_pct":0.0,"covered":"-"}]
+    for method in db_helper_postgre.ALLOWED_SAMPLE_METHODS:
+        approx_ms,(approximate,_,approximation)=timed(lambda:db_helper_postgre.expense_summary_approx(start_date,end_date,owner,sample_percent,method),repeat)
+        max_error_pct,covered=accuracy(exact,approximate)
+        results.append({"days":(end_date-start_date).days+1,"path":method,"ms":approx_ms,"approximate":approximation["approximate"],
+                        "max_error_pct":max_error_pct,"covered":covered})
+    return results
+
+def print_results(results):
+    columns=list(results[0])
+    print(" | ".join(f"{column:>13}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>13}" for column in columns))
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Benchmark of approximate analytics against the exact path")
+    parser.add_argument("--rows",type=int,default=5000000)
+    parser.add_argument("--years",type=int,default=10)
+    parser.add_argument("--days",type=int,nargs="+",default=[30,365,1825])
+    parser.add_argument("--sample-percent",type=float,default=1.0)
+    parser.add_argument("--repeat",type=int,default=3)
+    parser.add_argument("--all-owners",action="store_true",help="Analytics of every owner instead of the benchmark owner")
+    parser.add_argument("--keep",action="store_true",help="Keep the seeded expenses for another run")
+    args=parser.parse_args()
+
+    end_date=datetime.date(2090,12,31) #Far from real expenses
+    shard=shard_router.router.shard_for(BENCH_OWNER)
+    with db_helper_postgre.get_db_cursor(commit=True,shard=shard) as cursor:
+        cursor.execute("SELECT COUNT(*) AS records FROM expenses WHERE owner_id=%s",(BENCH_OWNER,))
+        if cursor.fetchone()["records"]==0:
+            print(f"Seeding {args.rows} expenses")
+            seed(cursor,args.rows,args.years,end_date)
+    try:
+        results=[]
+        for days in args.days:
+            start_date=end_date-datetime.timedelta(days=days-1)
+            results+=bench_range(start_date,end_date,None if args.all_owners else BENCH_OWNER,args.sample_percent,args.repeat)
+        print(f"\n{args.rows} rows | sample {args.sample_percent}%")
+        print_results(results)
+    finally:
+        if not args.keep:
+            with db_helper_postgre.get_db_cursor(commit=True,shard=shard) as cursor:
+                cursor.execute("DELETE FROM expenses WHERE owner_id=%s",(BENCH_OWNER,))
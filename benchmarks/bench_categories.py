@@ -0,0 +1,118 @@
+'''
+Benchmark of the category dimension: category stored as text on every row (before) against a SMALLINT key into the
+categories table (after).
+
+Builds both layouts as temporary tables of --rows generated expenses in the first shard database (nothing is
+written to the real tables) and reports the average row size, table size, category index size and the latency of
+the analytics summary (GROUP BY category over a date range) and of a category filter.
+
+Usage:
+    python -m benchmarks.bench_categories --rows 1000000 --repeat 5
+'''
+import argparse
+import time
+
+import psycopg2
+
+from backend import shard_router
+
+CATEGORIES=["Food","Rent","Shopping","Entertainment","Other"]
+
+#%% Functions
+def build_tables(cursor,num_rows):
+    '''
+        Description:
+            Function to create both layouts as temporary tables with the same generated expenses
+        Inputs:
+            cursor (cursor): Cursor of a dedicated connection, temporary tables live as long as it
+            num_rows (int): Number of expenses
+    '''
+    cursor.execute("CREATE TEMPORARY TABLE bench_categories (id SMALLINT PRIMARY KEY, name VARCHAR(64) NOT NULL UNIQUE)")
+    cursor.execute("INSERT INTO bench_categories (id,name) SELECT ordinality,name FROM unnest(%s::text[]) WITH ORDINALITY AS category(name,ordinality)",(CATEGORIES,))
+    cursor.execute('''
+        CREATE TEMPORARY TABLE bench_text AS
+        SELECT i AS id,DATE '2024-01-01'+(i%%730) AS expense_date,(i%%1000)::real AS amount,
+               (%s::text[])[1+i%%5]::varchar(255) AS category,'Expense note number '||i AS notes,'owner_'||(i%%50) AS owner_id
+        FROM generate_series(1,%s) AS i
+    ''',(CATEGORIES,num_rows))
+    cursor.execute('''
+        CREATE TEMPORARY TABLE bench_ids AS
+        SELECT bench_text.id,expense_date,amount,bench_categories.id AS category_id,notes,owner_id
+        FROM bench_text JOIN bench_categories ON bench_categories.name=bench_text.category
+    ''')
+    for table,column in [("bench_text","category"),("bench_ids","category_id")]:
+        cursor.execute(f"CREATE INDEX {table}_category ON {table} ({column})")
+        cursor.execute(f"CREATE INDEX {table}_owner_date ON {table} (owner_id,expense_date)")
+        cursor.execute(f"ANALYZE {table}")
+
+def sizes(cursor,table,column):
+    '''
+        Description:
+            Function to measure the storage of one layout
+        Returns:
+            sizes (dictionary): Average row and category value size in bytes, table and category index size in MB
+    '''
+    cursor.execute(f"SELECT AVG(pg_column_size({table}.*)),AVG(pg_column_size({column})) FROM {table}")
+    row_bytes,column_bytes=cursor.fetchone()
+    cursor.execute("SELECT pg_relation_size(%s),pg_relation_size(%s)",(table,f"{table}_category"))
+    table_bytes,index_bytes=cursor.fetchone()
+    return {"row_bytes":round(float(row_bytes),1),"category_bytes":round(float(column_bytes),1),
+            "table_mb":round(table_bytes/2**20,1),"category_index_mb":round(index_bytes/2**20,1)}
+
+def timed(cursor,query,params,repeat):
+    '''
+        Description:
+            Best latency in ms of a query over several runs
+    '''
+    best=float("inf")
+    for _ in range(repeat):
+        start=time.perf_counter()
+        cursor.execute(query,params)
+        cursor.fetchall()
+        best=min(best,time.perf_counter()-start)
+    return round(best*1000,1)
+
+def latencies(cursor,layout,repeat):
+    '''
+        Description:
+            Function to time the analytics summary of one year and a category filter in one layout, as the backend runs them
+    '''
+    if layout=="text":
+        summary="SELECT category,SUM(amount) AS total_expense FROM bench_text WHERE expense_date BETWEEN %s AND %s GROUP BY category"
+        summary_params=["2024-01-01","2024-12-31"]
+        category_filter="SELECT * FROM bench_text WHERE category = %s AND owner_id = %s"
+        filter_params=["Rent","owner_7"]
+    else:
+        summary="SELECT category_id,SUM(amount) AS total_expense FROM bench_ids WHERE expense_date BETWEEN %s AND %s GROUP BY category_id"
+        summary_params=["2024-01-01","2024-12-31"]
+        category_filter='''SELECT bench_ids.id,expense_date,amount,bench_categories.name AS category,notes,owner_id
+                           FROM bench_ids JOIN bench_categories ON bench_categories.id=bench_ids.category_id
+                           WHERE category_id = ANY(%s::smallint[]) AND owner_id = %s'''
+        filter_params=[[CATEGORIES.index("Rent")+1],"owner_7"]
+    return {"analytics_ms":timed(cursor,summary,summary_params,repeat),"category_filter_ms":timed(cursor,category_filter,filter_params,repeat)}
+
+def print_results(results):
+    columns=list(results[0])
+    print(" | ".join(f"{column:>18}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>18}" for column in columns))
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Benchmark of category as text against category as SMALLINT key")
+    parser.add_argument("--rows",type=int,default=1000000)
+    parser.add_argument("--repeat",type=int,default=5)
+    args=parser.parse_args()
+
+    connect=psycopg2.connect(shard_router.router.shards[0].dsn)
+    try:
+        cursor=connect.cursor()
+        build_tables(cursor,args.rows)
+        results=[]
+        for layout,table,column in [("text","bench_text","category"),("smallint","bench_ids","category_id")]:
+            results.append({"layout":layout,**sizes(cursor,table,column),**latencies(cursor,layout,args.repeat)})
+        print(f"\n{args.rows} rows")
+        print_results(results)
+    finally:
+        connect.rollback() #Temporary tables are dropped with the transaction
+        connect.close()
@@ -0,0 +1,137 @@
+'''
+Benchmark of response compression for large read results.
+
+For each encoding the server can produce, measures the bytes on the wire, the compression and decompression time of
+custom_query shaped results of 10k and 1M rows serialized as the server does (orjson), and the end-to-end latency
+(compress + transfer at the given link speeds + decompress). With --url the same is measured against a running server
+through real HTTP requests of a custom query.
+
+Usage:
+    python -m benchmarks.bench_compression --rows 10000 1000000 --mbps 10 100 1000
+    python -m benchmarks.bench_compression --url http://127.0.0.1:8000 --where-amount 0
+'''
+import argparse
+import datetime
+import gzip
+import time
+
+import orjson
+
+from backend.compression import available_encodings,bounded_level,compress_body
+
+try:
+    import zstandard
+except ImportError:
+    zstandard=None
+
+try:
+    import brotli
+except ImportError:
+    brotli=None
+
+CATEGORIES=["Food","Rent","Shopping","Entertainment","Other"]
+
+#%% Functions
+def make_body(num_rows):
+    '''
+        Description:
+            Function to generate the json body of a custom query result
+        Inputs:
+            num_rows (int): Number of rows
+        Returns:
+            body (bytes): orjson serialized rows
+    '''
+    start=datetime.date(2024,8,1)
+    rows=[{"id":i,"expense_date":start+datetime.timedelta(days=i%60),"amount":float(i%1000),
+           "category":CATEGORIES[i%5],"notes":f"Expense note number {i}"} for i in range(num_rows)]
+    return orjson.dumps(rows)
+
+def decompress(body,encoding):
+    if encoding=="zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding=="br":
+        return brotli.decompress(body)
+    if encoding=="gzip":
+        return gzip.decompress(body)
+    return body
+
+def timed(function,repeat):
+    '''
+        Description:
+            Best time in ms of several runs of a function, with its last result
+    '''
+    best=float("inf")
+    for _ in range(repeat):
+        start=time.perf_counter()
+        result=function()
+        best=min(best,time.perf_counter()-start)
+    return best*1000,result
+
+def bench_codecs(num_rows,mbps_list,repeat):
+    '''
+        Description:
+            Function to measure every encoding on a generated body
+        Returns:
+            results (list): One dictionary per encoding with bytes, ratio, compress, decompress and end-to-end time per link speed
+    '''
+    body=make_body(num_rows)
+    results=[]
+    for encoding in ["identity"]+available_encodings():
+        if encoding=="identity":
+            compress_ms,compressed=0.0,body
+        else:
+            compress_ms,compressed=timed(lambda:compress_body(body,encoding),repeat)
+        decompress_ms,decompressed=timed(lambda:decompress(compressed,encoding),repeat)
+        assert decompressed==body
+        result={"encoding":encoding,"level":bounded_level(encoding) if encoding!="identity" else None,"bytes":len(compressed),
+                "ratio":round(len(body)/len(compressed),2),"compress_ms":round(compress_ms,1),"decompress_ms":round(decompress_ms,1)}
+        for mbps in mbps_list:
+            transfer_ms=len(compressed)*8/(mbps*1e6)*1000
+            result[f"end_to_end_ms_{mbps}mbps"]=round(compress_ms+transfer_ms+decompress_ms,1)
+        results.append(result)
+    return results
+
+def bench_http(url,where_amount,repeat):
+    '''
+        Description:
+            Function to measure a custom query of a running server with each encoding
+        Returns:
+            results (list): One dictionary per encoding with the bytes on the wire, rows and best latency
+    '''
+    import httpx
+    payload={"where_info":{"amount":where_amount},"operator_info":{"amount":">"}}
+    results=[]
+    with httpx.Client(base_url=url,timeout=300) as client:
+        for encoding in ["identity"]+available_encodings():
+            best=float("inf")
+            for _ in range(repeat):
+                start=time.perf_counter()
+                response=client.post("/expenses/custom_query",json=payload,headers={"Accept-Encoding":encoding})
+                rows=len(response.json())
+                best=min(best,time.perf_counter()-start)
+            results.append({"encoding":response.headers.get("content-encoding","identity"),"bytes":response.num_bytes_downloaded,
+                            "rows":rows,"latency_ms":round(best*1000,1)})
+    return results
+
+def print_results(label,results):
+    print(f"\n{label}")
+    columns=list(results[0])
+    print(" | ".join(f"{column:>20}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>20}" for column in columns))
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Benchmark of response compression")
+    parser.add_argument("--rows",type=int,nargs="+",default=[10000,1000000])
+    parser.add_argument("--mbps",type=float,nargs="+",default=[10,100,1000],help="Link speeds for the end-to-end estimate")
+    parser.add_argument("--repeat",type=int,default=3)
+    parser.add_argument("--url",default=None,help="Measure a running server instead of the codecs alone")
+    parser.add_argument("--where-amount",type=float,default=0,help="Custom query returns the expenses above this amount")
+    args=parser.parse_args()
+
+    if args.url:
+        print_results(f"custom_query on {args.url}",bench_http(args.url,args.where_amount,args.repeat))
+    else:
+        for num_rows in args.rows:
+            print_results(f"{num_rows} rows",bench_codecs(num_rows,args.mbps,args.repeat))
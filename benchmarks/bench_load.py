@@ -0,0 +1,267 @@
+'''
+HTTP load generator for backend.server:server.
+
+Drives the real routes (fetch_date, custom_query, create, update, delete and analytics) with a configurable mix,
+in closed loop (each of --concurrency clients sends its next request when the previous one answers) or open loop
+(--rate requests per second are scheduled whatever the answers, latency counted from the scheduled time so a
+slow server is not hidden by fewer requests). Reports throughput, p50/p95/p99/max latency and error rate per route
+and saves the results as json to compare deployments and worker settings.
+
+Reads use the seeded data of the public owner. Writes use the loadtest owner on dates of LOAD_YEAR and are
+removed at the end of the run.
+
+Usage:
+    python -m benchmarks.bench_load --start-server --workers 4 --concurrency 1 8 32 --duration 30
+    python -m benchmarks.bench_load --url http://127.0.0.1:8000 --rate 200 --concurrency 64 --mix fetch_date=70,analytics=30
+'''
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+#%% Global variables
+ROUTES =["fetch_date","custom_query","create","update","delete","analytics"]
+DEFAULT_MIX ="fetch_date=40,custom_query=20,create=10,update=10,delete=5,analytics=15"
+SEEDED_DATES =["2024-08-01","2024-08-02","2024-08-03","2024-08-04","2024-08-05","2024-08-06","2024-08-15",
+               "2024-09-01","2024-09-02","2024-09-03","2024-09-04","2024-09-05","2024-09-30"]
+CATEGORIES =["Food","Rent","Shopping","Entertainment","Other"]
+LOAD_OWNER ="loadtest"
+LOAD_YEAR =2099 #Writes go to dates no real expense uses
+RESULTS_DIR =os.path.join(os.path.dirname(__file__),"results")
+
+#%% Requests per route
+def load_date():
+    return f"{LOAD_YEAR}-01-{random.randint(1,28):02d}"
+
+def build_request(route):
+    '''
+        Description:
+            Function to build a random request of a route
+        Inputs:
+            route (str): One of ROUTES
+        Returns:
+            method (str), path (str), json payload (dictionary or None), headers (dictionary)
+    '''
+    write_headers={"X-Owner-Id":LOAD_OWNER}
+    if route=="fetch_date":
+        return "GET",f"/expenses/fetch_date/{random.choice(SEEDED_DATES)}",None,{}
+    if route=="custom_query":
+        payload={"where_info":{"amount":random.randint(0,900)},"operator_info":{"amount":">"}}
+        return "POST","/expenses/custom_query",payload,{}
+    if route=="create":
+        entries=[{"amount":random.randint(1,500),"category":random.choice(CATEGORIES),"notes":"load test"} for _ in range(random.randint(1,5))]
+        return "POST","/expenses",{"expense_date":load_date(),"entries":entries},write_headers
+    if route=="update":
+        payload={"set_info":{"notes":f"load test {random.randint(0,1000)}"},
+                 "where_info":{"expense_date":load_date()},"operator_info":{"expense_date":"="}}
+        return "PUT","/expenses",payload,write_headers
+    if route=="delete":
+        payload={"where_info":{"expense_date":load_date()},"operator_info":{"expense_date":"="}}
+        return "DELETE","/expenses",payload,write_headers
+    if route=="analytics":
+        payload={"start_date":f"2024-08-{random.randint(1,15):02d}","end_date":f"2024-09-{random.randint(1,30):02d}"}
+        return "POST","/analytics",payload,{}
+    raise ValueError(f"Route {route} not in {ROUTES}")
+
+def parse_mix(mix):
+    '''
+        Description:
+            Function to parse a route mix as route=weight pairs separated by commas
+        Returns:
+            routes (list), weights (list)
+    '''
+    weights={}
+    for item in mix.split(","):
+        route,weight=item.split("=")
+        if route.strip() not in ROUTES:
+            raise ValueError(f"Route {route} not in {ROUTES}")
+        weights[route.strip()]=float(weight)
+    return list(weights),list(weights.values())
+
+#%% Statistics
+def percentile(sorted_values,fraction):
+    '''
+        Description:
+            Nearest rank percentile of an already sorted list
+    '''
+    if not sorted_values:
+        return None
+    rank=max(0,min(len(sorted_values)-1,math.ceil(fraction*len(sorted_values))-1))
+    return sorted_values[rank]
+
+def summarize(samples,elapsed):
+    '''
+        Description:
+            Function to compute the per route report of a run
+        Inputs:
+            samples (list): (route, latency in seconds, ok) of every request
+            elapsed (float): Duration of the run in seconds
+        Returns:
+            report (dictionary): Route as key with requests, throughput, error_rate and latency percentiles in ms.
+                                 Routes without samples are left out, empty when no request completed
+    '''
+    report={}
+    for route in sorted({sample[0] for sample in samples})+["all"]:
+        route_samples=[sample for sample in samples if route=="all" or sample[0]==route]
+        if not route_samples:
+            continue
+        latencies=sorted(sample[1]*1000 for sample in route_samples)
+        errors=sum(1 for sample in route_samples if not sample[2])
+        report[route]={
+            "requests":len(route_samples),
+            "throughput_rps":round(len(route_samples)/elapsed,2),
+            "error_rate":round(errors/len(route_samples),4),
+            "p50_ms":round(percentile(latencies,0.50),2),
+            "p95_ms":round(percentile(latencies,0.95),2),
+            "p99_ms":round(percentile(latencies,0.99),2),
+            "max_ms":round(latencies[-1],2)
+        }
+    return report
+
+#%% Load generation
+async def send(client,route,samples,scheduled=None):
+    '''
+        Description:
+            Send one request and record its latency. Open loop latency is counted from the scheduled time
+    '''
+    method,path,payload,headers=build_request(route)
+    start=scheduled if scheduled is not None else time.perf_counter()
+    try:
+        response=await client.request(method,path,json=payload,headers=headers)
+        ok=response.status_code<400
+    except httpx.HTTPError:
+        ok=False
+    samples.append((route,time.perf_counter()-start,ok))
+
+async def closed_loop(client,routes,weights,concurrency,duration):
+    samples=[]
+    deadline=time.perf_counter()+duration
+
+    async def user():
+        while time.perf_counter()<deadline:
+            await send(client,random.choices(routes,weights)[0],samples)
+
+    await asyncio.gather(*[user() for _ in range(concurrency)])
+    return samples
+
+async def open_loop(client,routes,weights,rate,duration):
+    samples=[]
+    tasks=[]
+    start=time.perf_counter()
+    next_time=start
+    while next_time<start+duration:
+        await asyncio.sleep(max(0,next_time-time.perf_counter()))
+        tasks.append(asyncio.create_task(send(client,random.choices(routes,weights)[0],samples,scheduled=next_time)))
+        next_time+=random.expovariate(rate) #Poisson arrivals
+    await asyncio.gather(*tasks)
+    return samples
+
+async def run(url,routes,weights,concurrency,duration,rate=None,warmup=2):
+    '''
+        Description:
+            Function to run one load level. Connections are capped at concurrency, in open loop extra requests wait for a free connection
+        Returns:
+            report (dictionary): Per route report, see summarize
+    '''
+    limits=httpx.Limits(max_connections=concurrency,max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url,limits=limits,timeout=60) as client:
+        if warmup:
+            await closed_loop(client,routes,weights,min(concurrency,4),warmup)
+        start=time.perf_counter()
+        if rate:
+            samples=await open_loop(client,routes,weights,rate,duration)
+        else:
+            samples=await closed_loop(client,routes,weights,concurrency,duration)
+        elapsed=time.perf_counter()-start
+    return summarize(samples,elapsed)
+
+async def cleanup(url):
+    '''
+        Description:
+            Remove the expenses created by the load test
+    '''
+    payload={"where_info":{"expense_date":f"{LOAD_YEAR}-01-01"},"operator_info":{"expense_date":">="}}
+    async with httpx.AsyncClient(base_url=url,timeout=60) as client:
+        await client.request("DELETE","/expenses",json=payload,headers={"X-Owner-Id":LOAD_OWNER})
+
+#%% Server management
+def start_server(port,workers):
+    '''
+        Description:
+            Start the production launcher with the backend app and wait until the health endpoint answers
+        Returns:
+            process (Popen): Launcher process
+    '''
+    process=subprocess.Popen([sys.executable,"-m","backend.launcher","--port",str(port),"--workers",str(workers)])
+    deadline=time.time()+30
+    while time.time()<deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code==200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not start in 30 seconds")
+
+def print_report(label,report):
+    print(f"\n{label}")
+    if not report:
+        print("No requests completed")
+        return
+    print(f"{'route':>14} | {'requests':>8} | {'rps':>9} | {'errors':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'max ms':>8}")
+    for route,stats in report.items():
+        print(f"{route:>14} | {stats['requests']:>8} | {stats['throughput_rps']:>9} | {stats['error_rate']:>7.2%} | "
+              f"{stats['p50_ms']:>8} | {stats['p95_ms']:>8} | {stats['p99_ms']:>8} | {stats['max_ms']:>8}")
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="HTTP load test of the expenses API")
+    parser.add_argument("--url",default="http://127.0.0.1:8000")
+    parser.add_argument("--start-server",action="store_true",help="Start the launcher locally on the port of --url")
+    parser.add_argument("--workers",type=int,default=1,help="Worker processes when --start-server is used")
+    parser.add_argument("--mix",default=DEFAULT_MIX,help="route=weight pairs separated by commas")
+    parser.add_argument("--concurrency",type=int,nargs="+",default=[1,8,32])
+    parser.add_argument("--rate",type=float,default=None,help="Requests per second. Open loop when given, closed loop otherwise")
+    parser.add_argument("--duration",type=float,default=20,help="Seconds per concurrency level")
+    parser.add_argument("--label",default="",help="Name of the deployment or setting under test")
+    parser.add_argument("--output",default=None,help="json results path. benchmarks/results/load_<time>.json as default")
+    args=parser.parse_args()
+
+    routes,weights=parse_mix(args.mix)
+    process=start_server(httpx.URL(args.url).port or 8000,args.workers) if args.start_server else None
+    results={
+        "label":args.label,
+        "url":args.url,
+        "mix":args.mix,
+        "mode":"open" if args.rate else "closed",
+        "rate":args.rate,
+        "duration":args.duration,
+        "workers":args.workers if args.start_server else None,
+        "started_at":datetime.datetime.now().isoformat(timespec="seconds"),
+        "levels":{}
+    }
+    try:
+        for concurrency in args.concurrency:
+            report=asyncio.run(run(args.url,routes,weights,concurrency,args.duration,args.rate))
+            results["levels"][str(concurrency)]=report
+            print_report(f"concurrency {concurrency} ({results['mode']} loop)",report)
+        asyncio.run(cleanup(args.url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    output=args.output or os.path.join(RESULTS_DIR,f"load_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)),exist_ok=True)
+    with open(output,"w") as file:
+        json.dump(results,file,indent=2)
+    print(f"\nResults saved to {output}")
@@ -0,0 +1,101 @@
+'''
+Benchmark of the read path used by /expenses/fetch_date and /expenses/custom_query.
+
+Compares the previous path (one RealDictRow per row, pydantic validation of List[expense_model] and the standard
+json encoder) against the compact path (tuples wrapped in __slots__ rows and serialized with orjson).
+Rows are generated in memory with the same shape the cursor returns so only Python side costs are measured.
+
+Usage:
+    python -m benchmarks.bench_read_path --rows 10000 100000
+'''
+import argparse
+import datetime
+import gc
+import json
+import time
+import tracemalloc
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from psycopg2.extras import RealDictRow
+from pydantic import TypeAdapter
+
+from backend.db_helper_postgre import compact_row_type
+from backend.server import FETCH_DATE_COLUMNS, expense_model
+
+CATEGORIES=["Food","Rent","Shopping","Entertainment","Other"]
+
+#%% Functions
+def make_tuples(num_rows):
+    '''
+        Description:
+            Function to generate rows as returned by a tuple cursor for the fetch date columns
+        Inputs:
+            num_rows (int): Number of rows to generate
+        Returns:
+            rows (list): List of tuples (amount, category, notes)
+    '''
+    return [(float(i%1000),CATEGORIES[i%5],f"Expense note number {i}") for i in range(num_rows)]
+
+def dict_path(tuples):
+    '''
+        Description:
+            Previous read path. Dictionary rows, response model validation and standard json encoding
+    '''
+    rows=[]
+    for row in tuples:
+        dict_row=RealDictRow()
+        for column,value in zip(FETCH_DATE_COLUMNS,row):
+            dict_row[column]=value
+        rows.append(dict_row)
+    validated=TypeAdapter(List[expense_model]).validate_python(rows)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+def compact_path(tuples):
+    '''
+        Description:
+            Compact read path. Slots rows serialized with orjson, without revalidation
+    '''
+    row_type=compact_row_type(tuple(FETCH_DATE_COLUMNS))
+    rows=[row_type(*row) for row in tuples]
+    return orjson.dumps(rows)
+
+def measure(path,tuples,repeats):
+    '''
+        Description:
+            Function to measure rows per second (best of repeats) and peak traced memory of a read path
+        Returns:
+            rows_per_second (float), peak_mb (float), payload_bytes (int)
+    '''
+    best=float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        start=time.perf_counter()
+        payload=path(tuples)
+        best=min(best,time.perf_counter()-start)
+
+    gc.collect()
+    tracemalloc.start()
+    path(tuples)
+    _,peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(tuples)/best,peak/1e6,len(payload)
+
+#%% Main
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Read path benchmark")
+    parser.add_argument("--rows",type=int,nargs="+",default=[10_000,100_000])
+    parser.add_argument("--repeats",type=int,default=5)
+    args=parser.parse_args()
+
+    #Both paths must produce the same document
+    sample=make_tuples(100)
+    assert json.loads(dict_path(sample))==orjson.loads(compact_path(sample))
+
+    print(f"{'rows':>10} | {'path':>8} | {'rows/s':>12} | {'peak MB':>8} | {'bytes':>10}")
+    for num_rows in args.rows:
+        tuples=make_tuples(num_rows)
+        for name,path in [("dict",dict_path),("compact",compact_path)]:
+            rows_per_second,peak_mb,payload_bytes=measure(path,tuples,args.repeats)
+            print(f"{num_rows:>10} | {name:>8} | {rows_per_second:>12,.0f} | {peak_mb:>8.1f} | {payload_bytes:>10}")
@@ -0,0 +1,92 @@
+from backend import archive
+import datetime
+import pytest
+
+#%% PRUNING TESTING
+def test_range_may_match():
+    '''
+        Unitary testing for file and row group pruning. A range is skipped only when no value of it can match
+    '''
+    conditions=archive.form_conditions({"amount":"900"},{"amount":">"},"public","2024-08-01","2024-08-31")
+    august=(datetime.date(2024,8,1),datetime.date(2024,8,31))
+    july=(datetime.date(2024,7,1),datetime.date(2024,7,31))
+
+    assert archive.range_may_match("expense_date",*august,conditions)
+    assert not archive.range_may_match("expense_date",*july,conditions)
+    assert not archive.range_may_match("amount",10.0,900.0,conditions)
+    assert archive.range_may_match("amount",10.0,1200.0,conditions)
+    assert not archive.range_may_match("owner_id","a","b",conditions)
+
+#%% FILTER TESTING
+def test_row_matches():
+    '''
+        Unitary testing for archived rows filtering. Same semantics as the SQL where clause, including like and NULL notes
+    '''
+    row={"id":1,"expense_date":datetime.date(2024,8,15),"amount":10.0,"category":"Shopping","notes":"Bought potatoes","owner_id":"public"}
+
+    assert archive.row_matches(row,archive.form_conditions({"notes":"%potato%"},{"notes":"like"},"public"))
+    assert not archive.row_matches(row,archive.form_conditions({"notes":"potato%"},{"notes":"like"},"public"))
+    assert archive.row_matches(row,archive.form_conditions({"expense_date":"2024-08-15"},{"expense_date":"="}))
+    assert not archive.row_matches(row,archive.form_conditions({"category":"Food"},{"category":"="}))
+    assert not archive.row_matches(dict(row,notes=None),archive.form_conditions({"notes":"x"},{"notes":"!="}))
+
+#%% SUMMARY TESTING
+def test_summarize_archive(tmp_path,monkeypatch):
+    '''
+        Unitary testing for archived analytics. Totals and top expenses only count the rows of the owner and date range
+    '''
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(archive,"ARCHIVE_DIR",str(tmp_path))
+    shard=type("Shard",(),{"index":0})()
+    rows=[{"id":i,"expense_date":datetime.date(2024,8,1+i%28),"amount":float(i),"category":["Food","Rent"][i%2],"notes":f"Note {i}",
+           "owner_id":"public" if i<90 else "other"} for i in range(100)]
+    archive.write_month(shard,datetime.date(2024,8,1),rows)
+
+    category_totals,top_expenses=archive.summarize_archive(shard,"public","2024-08-01","2024-08-10")
+    expected=[row for row in rows if row["owner_id"]=="public" and row["expense_date"]<=datetime.date(2024,8,10)]
+    assert sum(row["records"] for row in category_totals)==len(expected)
+    assert sum(row["total_expense"] for row in category_totals)==sum(row["amount"] for row in expected)
+    assert [row["id"] for row in top_expenses]==[row["id"] for row in sorted(expected,key=lambda row:row["amount"],reverse=True)[:5]]
+    assert top_expenses[0]["notes"]==f"Note {top_expenses[0]['id']}"
+
+#%% TIER TESTING
+def test_month_in_both_tiers(tmp_path,monkeypatch):
+    '''
+        1. Unitary testing for an interrupted archive. Rows of a month in Parquet and in Postgres are counted once
+        2. Unitary testing for writes. New expenses can not be created in an archived month
+    '''
+    pytest.importorskip("pyarrow")
+    from backend import db_helper_postgre,shard_router
+    shard=shard_router.router.shard_for(db_helper_postgre.DEFAULT_OWNER)
+    month_rows=db_helper_postgre.retrieve_custom_query({"expense_date":"2024-08-01"},{"expense_date":">="})
+    month_rows=[dict(row) for row in month_rows if row["expense_date"]<=datetime.date(2024,8,31)]
+    date_ids=sorted(row["id"] for row in db_helper_postgre.retrieve_date("2024-08-02"))
+    summary=db_helper_postgre.expense_summary("2024-08-01","2024-08-31",owner=db_helper_postgre.DEFAULT_OWNER)
+
+    #******** 1. Unitary testing
+    monkeypatch.setattr(archive,"ARCHIVE_DIR",str(tmp_path))
+    archive.write_month(shard,datetime.date(2024,8,1),month_rows) #File written, delete not committed
+    assert sorted(row["id"] for row in db_helper_postgre.retrieve_date("2024-08-02"))==date_ids
+    query_ids=[row["id"] for row in db_helper_postgre.retrieve_custom_query({"expense_date":"2024-08-01"},{"expense_date":">="})]
+    assert len(query_ids)==len(set(query_ids))
+    archived_summary=db_helper_postgre.expense_summary("2024-08-01","2024-08-31",owner=db_helper_postgre.DEFAULT_OWNER)
+    assert archived_summary[0]==summary[0]
+    assert [row["amount"] for row in archived_summary[1]]==[row["amount"] for row in summary[1]]
+
+    #******** 2. Unitary testing
+    with pytest.raises(ValueError,match="2024-08"):
+        db_helper_postgre.create_record("2024-08-20",10,"Food","Archived month")
+
+#%% WRITE TESTING
+def test_reject_archived_matches(monkeypatch):
+    '''
+        Unitary testing for writes over archived months. They are rejected only when archived rows match the conditions
+    '''
+    from backend import db_helper_postgre
+    row={"id":1,"expense_date":datetime.date(2024,8,15),"amount":10.0,"category":"Shopping","notes":"Bought potatoes","owner_id":"public"}
+    monkeypatch.setattr(archive,"read_archive",lambda shard,where_dict,operator_dict,owner:[row])
+    with pytest.raises(ValueError,match="2024-08"):
+        db_helper_postgre.reject_archived_matches(None,{"expense_date":"2024-08-15"},{"expense_date":"="},"public","delete")
+
+    monkeypatch.setattr(archive,"read_archive",lambda shard,where_dict,operator_dict,owner:[])
+    db_helper_postgre.reject_archived_matches(None,{"expense_date":"2024-09-15"},{"expense_date":"="},"public","delete")
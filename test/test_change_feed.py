@@ -0,0 +1,51 @@
+from backend.change_feed import REPLAY_PAGE_SIZE,Subscription,replay_and_follow
+import asyncio
+import json
+
+#%% HELPERS
+def make_event(event_id):
+    return {"id":event_id,"owner":"public","action":"create","expense_dates":["2024-08-01"],"categories":["Food"],"records":1}
+
+def collect(last_event_id,stored_ids,live_ids):
+    '''
+        Description:
+            Function to run a stream against stored events and live notifications, returning the ids sent to the client
+    '''
+    async def scenario():
+        subscription=Subscription(asyncio.get_running_loop(),"public")
+        for event_id in live_ids+[None]:
+            subscription.queue.put_nowait(make_event(event_id) if event_id is not None else None)
+
+        def retrieve_page(after,limit):
+            return [make_event(event_id) for event_id in sorted(stored_ids) if event_id>after][:limit]
+
+        async def is_disconnected():
+            return False
+
+        ids=[]
+        async for message in replay_and_follow(subscription,last_event_id,retrieve_page,is_disconnected,1):
+            data=[line[len("data: "):] for line in message.splitlines() if line.startswith("data: ")]
+            ids.append(json.loads(data[0])["id"])
+        return ids
+    return asyncio.run(scenario())
+
+#%% REPLAY TESTING
+def test_replay_pages():
+    '''
+        Unitary testing for the replay of more missed events than one page holds
+    '''
+    stored_ids=list(range(1,2*REPLAY_PAGE_SIZE+6))
+    assert collect(0,stored_ids,[])==stored_ids
+    assert collect(REPLAY_PAGE_SIZE,stored_ids,[])==stored_ids[REPLAY_PAGE_SIZE:]
+
+def test_out_of_order_commits():
+    '''
+        1. Unitary testing for events committing out of id order after the replay, they must all be sent
+        2. Unitary testing for notifications of replayed events, they must be sent once
+    '''
+    #******** 1. Unitary testing
+    assert collect(None,[],[12,10,11])==[12,10,11]
+    assert collect(5,[6,8],[9,7])==[6,8,9,7]
+
+    #******** 2. Unitary testing
+    assert collect(5,[6,8],[8,7,6])==[6,8,7]
@@ -0,0 +1,72 @@
+from backend import compression
+from backend.compression import CompressionMiddleware,select_encoding
+import asyncio
+import gzip
+import threading
+
+#%% NEGOTIATION TESTING
+def test_select_encoding():
+    '''
+        Unitary testing for encoding negotiation. Server preference breaks ties, q=0 and unknown encodings are never selected
+    '''
+    assert select_encoding("gzip, br, zstd",["zstd","br","gzip"])=="zstd"
+    assert select_encoding("gzip;q=1.0, zstd;q=0.5",["zstd","gzip"])=="gzip"
+    assert select_encoding("*",["br","gzip"])=="br"
+    assert select_encoding("gzip;q=0",["gzip"]) is None
+    assert select_encoding("identity",["gzip"]) is None
+    assert select_encoding(None,["gzip"]) is None
+
+#%% MIDDLEWARE TESTING
+def run_middleware(chunks,content_type=b"application/json",status=200,accept_encoding=b"gzip",thread_size=65536):
+    '''
+        Helper to send a response made of chunks through the middleware and collect the messages sent to the client
+    '''
+    async def app(scope,receive,send):
+        await send({"type":"http.response.start","status":status,"headers":[(b"content-type",content_type)]})
+        for index,chunk in enumerate(chunks):
+            await send({"type":"http.response.body","body":chunk,"more_body":index<len(chunks)-1})
+
+    messages=[]
+    async def send(message):
+        messages.append(message)
+
+    scope={"type":"http","headers":[(b"accept-encoding",accept_encoding)]}
+    asyncio.run(CompressionMiddleware(app,minimum_size=1024,encodings=["gzip"],thread_size=thread_size)(scope,None,send))
+    headers=dict(messages[0]["headers"])
+    return headers,b"".join(message.get("body",b"") for message in messages[1:])
+
+def test_compression_middleware():
+    '''
+        1. Unitary testing for streamed responses. Every chunk is compressed and the body decodes to the original
+        2. Unitary testing for skipped responses. Small bodies and server-sent events are sent as they are
+    '''
+    #******** 1. Unitary testing
+    chunks=[b'{"amount":10.0,"category":"Food"},'*100 for _ in range(5)]
+    headers,body=run_middleware(chunks)
+    assert headers[b"content-encoding"]==b"gzip"
+    assert b"accept-encoding" in headers[b"vary"].lower()
+    assert gzip.decompress(body)==b"".join(chunks)
+    assert len(body)<len(b"".join(chunks))
+
+    #******** 2. Unitary testing
+    headers,body=run_middleware([b'{"amount":10.0}'])
+    assert b"content-encoding" not in headers and body==b'{"amount":10.0}'
+    headers,body=run_middleware([b"data: x\n\n"*500],content_type=b"text/event-stream")
+    assert b"content-encoding" not in headers
+
+def test_compression_off_loop(monkeypatch):
+    '''
+        Unitary testing for big bodies. They are compressed in a worker thread, not in the thread running the event loop
+    '''
+    threads=[]
+    def recording_compress_body(body,encoding,level=None):
+        threads.append(threading.get_ident())
+        return gzip.compress(body)
+    monkeypatch.setattr(compression,"compress_body",recording_compress_body)
+
+    body=b'{"amount":10.0,"category":"Food"},'*1000
+    headers,compressed=run_middleware([body],thread_size=len(body))
+    assert gzip.decompress(compressed)==body
+    assert threads and threads[0]!=threading.get_ident()
+    run_middleware([body],thread_size=len(body)+1)
+    assert threads[1]==threading.get_ident()
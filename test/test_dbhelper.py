@@ -1,142 +1,369 @@
-from backend import db_helper_postgre
-import pytest
-import math
-import datetime
-
-#%% CREATE TESTING
-def test_create_record():
-    '''
-        Unitary testing for creating a new record. Creates a record for a non existing date in the table, and checks result 
-    '''
-    date="2025-07-12"
-    
-    #Cleaning leftovers from possible previous runs
-    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
-
-    results=db_helper_postgre.retrieve_date(date)
-
-    db_helper_postgre.create_record("2025-07-12",100,"Food","This is a new record")
-    results=db_helper_postgre.retrieve_date("2025-07-12")
-    assert results[0]["expense_date"]==datetime.date(2025,7,12)
-    assert results[0]["amount"]==100
-    assert results[0]["category"]=="Food"
-    assert results[0]["notes"]=="This is a new record"
-
-def test_read_date():
-    '''
-        Unitary testing for reading the information of a given date
-    '''
-
-    results=db_helper_postgre.retrieve_date("2024-08-15")
-    assert len(results)==1 #Just one element for this date
-    assert results[0]["amount"]==10
-    assert ( "Bought potatoes" in results[0]["notes"])==True 
-
-
-
-#%% READ TESTING
-def test_custom_query():
-    '''
-        1. Unitary testing for reading a custom query. Will retrieve the expenses with amounts >900
-        2. Unitary testing for reading a custom query. Will retrieve the expesnes with amount >200 and category =Food
-    '''
-    
-    #******** 1. Unitary testing
-    where_dict={
-        "amount":"900"
-    }
-
-    operator_dict={
-        "amount":">"
-    }
-
-    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict)
-    assert results[0]["category"]=="Rent"
-    assert results[0]["amount"]==1200
-
-    #******** 2. Unitary testing
-    where_dict={
-        "amount":"200",
-        "category":"Food"
-    }
-
-    operator_dict={
-        "amount":">",
-        "category":"="
-    }
-
-    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict)
-    assert len(results)==6
-
-
-#%% UPDATE AND DELETE TESTING
-def test_update():
-    '''
-        Unitary testing for updating records. Update a fictional record created for 2025-07-12   
-    '''
-    mapping_dict={
-        "notes":"This is an update"
-    }
-
-    where_dict={
-        "expense_date":"2025-07-12"
-    }
-
-    operator_dict={
-        "expense_date":"="
-    }
-
-    _=db_helper_postgre.update_record(mapping_dict,where_dict,operator_dict)
-    results=db_helper_postgre.retrieve_date("2025-07-12")
-    assert results[0]["notes"]=="This is an update"
-
-def test_delete():
-    '''
-        Unitary testing for deleting records. Will delete the fictional record created for 2025-07-12
-    '''
-    where_dict={
-        "expense_date":"2025-07-12"
-    }
-
-    operator_dict={
-        "expense_date":"="
-    }
-    _=db_helper_postgre.delete_record(where_dict,operator_dict)
-    results=db_helper_postgre.retrieve_date("2025-07-12")
-    assert len(results)==0
-
-#%% OPERATORS AND COLUMNS TESTING
-def test_where_operators_validation():
-    '''  
-        1. Unitary testing for Column names
-        2. Unitary testing for operators
-    '''
-
-    #******* 1. Unitary testing
-    where_dict={
-        "date":"2024-08-12"
-    }
-
-    operator_dict={
-        "expense_date":">"
-    }
-
-    with pytest.raises(ValueError):
-        db_helper_postgre.validate_where_clause(where_dict,operator_dict)
-
-    #******* 2. Unitary testing
-    where_dict={
-        "expense_date":"2024-08-12",
-        "amount":100,
-        "category":"Food",
-        "notes":"Whatever"
-    }
-
-    operator_dict={
-        "expense_date":">",
-        "amount":"=",
-        "category":"!=",
-        "notes":"@"
-    }
-    with pytest.raises(ValueError):
-        db_helper_postgre.validate_where_clause(where_dict,operator_dict)
+from backend import db_helper_postgre,shard_router
+import pytest
+import math
+import datetime
+import threading
+
+#%% CREATE TESTING
+def test_create_record():
+    '''
+        Unitary testing for creating a new record. Creates a record for a non existing date in the table, and checks result 
+    '''
+    date="2025-07-12"
+    
+    #Cleaning leftovers from possible previous runs
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+
+    results=db_helper_postgre.retrieve_date(date)
+
+    db_helper_postgre.create_record("2025-07-12",100,"Food","This is a new record")
+    results=db_helper_postgre.retrieve_date("2025-07-12")
+    assert results[0]["expense_date"]==datetime.date(2025,7,12)
+    assert results[0]["amount"]==100
+    assert results[0]["category"]=="Food"
+    assert results[0]["notes"]=="This is a new record"
+
+def test_read_date():
+    '''
+        Unitary testing for reading the information of a given date
+    '''
+
+    results=db_helper_postgre.retrieve_date("2024-08-15")
+    assert len(results)==1 #Just one element for this date
+    assert results[0]["amount"]==10
+    assert ( "Bought potatoes" in results[0]["notes"])==True 
+
+def test_read_date_compact():
+    '''
+        Unitary testing for reading a date as compact rows. Must match the dictionary rows for the selected columns
+    '''
+    columns=["amount","category","notes"]
+    results=db_helper_postgre.retrieve_date("2024-08-15")
+    compact_results=db_helper_postgre.retrieve_date("2024-08-15",columns=columns,compact=True)
+    assert len(compact_results)==len(results)
+    assert compact_results[0].amount==results[0]["amount"]
+    assert compact_results[0].notes==results[0]["notes"]
+
+    with pytest.raises(ValueError):
+        db_helper_postgre.retrieve_date("2024-08-15",columns=["amount; DROP TABLE expenses"])
+
+
+
+#%% READ TESTING
+def test_custom_query():
+    '''
+        1. Unitary testing for reading a custom query. Will retrieve the expenses with amounts >900
+        2. Unitary testing for reading a custom query. Will retrieve the expesnes with amount >200 and category =Food
+    '''
+    
+    #******** 1. Unitary testing
+    where_dict={
+        "amount":"900"
+    }
+
+    operator_dict={
+        "amount":">"
+    }
+
+    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict)
+    assert results[0]["category"]=="Rent"
+    assert results[0]["amount"]==1200
+
+    #******** 2. Unitary testing
+    where_dict={
+        "amount":"200",
+        "category":"Food"
+    }
+
+    operator_dict={
+        "amount":">",
+        "category":"="
+    }
+
+    results=db_helper_postgre.retrieve_custom_query(where_dict,operator_dict)
+    assert len(results)==6
+
+
+#%% UPDATE AND DELETE TESTING
+def test_update():
+    '''
+        Unitary testing for updating records. Update a fictional record created for 2025-07-12   
+    '''
+    mapping_dict={
+        "notes":"This is an update"
+    }
+
+    where_dict={
+        "expense_date":"2025-07-12"
+    }
+
+    operator_dict={
+        "expense_date":"="
+    }
+
+    _=db_helper_postgre.update_record(mapping_dict,where_dict,operator_dict)
+    results=db_helper_postgre.retrieve_date("2025-07-12")
+    assert results[0]["notes"]=="This is an update"
+
+def test_delete():
+    '''
+        Unitary testing for deleting records. Will delete the fictional record created for 2025-07-12
+    '''
+    where_dict={
+        "expense_date":"2025-07-12"
+    }
+
+    operator_dict={
+        "expense_date":"="
+    }
+    _=db_helper_postgre.delete_record(where_dict,operator_dict)
+    results=db_helper_postgre.retrieve_date("2025-07-12")
+    assert len(results)==0
+
+#%% OPERATORS AND COLUMNS TESTING
+def test_where_operators_validation():
+    '''  
+        1. Unitary testing for Column names
+        2. Unitary testing for operators
+    '''
+
+    #******* 1. Unitary testing
+    where_dict={
+        "date":"2024-08-12"
+    }
+
+    operator_dict={
+        "expense_date":">"
+    }
+
+    with pytest.raises(ValueError):
+        db_helper_postgre.validate_where_clause(where_dict,operator_dict)
+
+    #******* 2. Unitary testing
+    where_dict={
+        "expense_date":"2024-08-12",
+        "amount":100,
+        "category":"Food",
+        "notes":"Whatever"
+    }
+
+    operator_dict={
+        "expense_date":">",
+        "amount":"=",
+        "category":"!=",
+        "notes":"@"
+    }
+    with pytest.raises(ValueError):
+        db_helper_postgre.validate_where_clause(where_dict,operator_dict)
+
+#%% AGGREGATE TESTING
+def test_aggregate():
+    '''
+        1. Unitary testing for aggregate query. Will count the Food expenses with amount >200 grouped by category
+        2. Unitary testing for aggregate validation. Percentile of a text column, having over a non requested aggregate and duplicated aliases
+        3. Unitary testing for percentile aliases. Small percentiles give valid names
+    '''
+
+    #******** 1. Unitary testing
+    results=db_helper_postgre.retrieve_aggregate(
+        group_by=["category"],
+        aggregates=[{"function":"count"},{"function":"sum","column":"amount"}],
+        where_dict={"amount":"200","category":"Food"},
+        operator_dict={"amount":">","category":"="}
+    )
+    assert len(results)==1
+    assert results[0]["category"]=="Food"
+    assert results[0]["count"]==6
+
+    #******** 2. Unitary testing
+    with pytest.raises(ValueError):
+        db_helper_postgre.retrieve_aggregate(["category"],[{"function":"percentile","column":"notes","percentile":0.5}])
+
+    with pytest.raises(ValueError):
+        db_helper_postgre.retrieve_aggregate(["category"],[{"function":"count"}],
+                                             having_dict={"sum_amount":100},having_operator_dict={"sum_amount":">"})
+
+    with pytest.raises(ValueError):
+        db_helper_postgre.retrieve_aggregate(["category"],[{"function":"percentile","column":"amount","percentile":0.95},
+                                                           {"function":"percentile","column":"amount","percentile":0.9500001}])
+
+    #******** 3. Unitary testing
+    assert db_helper_postgre.aggregate_alias("percentile","amount",0.999)=="p99_9_amount"
+    results=db_helper_postgre.retrieve_aggregate(["category"],[{"function":"percentile","column":"amount","percentile":1e-7}])
+    assert "p0_amount" in results[0]
+
+#%% CATEGORY TESTING
+def test_categories():
+    '''
+        1. Unitary testing for category conditions. Operators are evaluated on the category names and return their ids
+        2. Unitary testing for category validation. Unknown categories are rejected on write
+        3. Unitary testing for stale caches. A category missing from the cache is found after a reload
+    '''
+    shard=shard_router.router.shard_for(db_helper_postgre.DEFAULT_OWNER)
+    ids=db_helper_postgre.category_ids(shard)
+
+    #******** 1. Unitary testing
+    assert db_helper_postgre.matching_category_ids(shard,"=","Food")==[ids["Food"]]
+    assert sorted(db_helper_postgre.matching_category_ids(shard,"!=","Food"))==sorted(ids[name] for name in ids if name!="Food")
+    assert db_helper_postgre.matching_category_ids(shard,"like","%ent%")==sorted([ids["Rent"],ids["Entertainment"]])
+    assert db_helper_postgre.matching_category_ids(shard,"=","Travel")==[]
+
+    #******** 2. Unitary testing
+    with pytest.raises(ValueError):
+        db_helper_postgre.create_record("2025-07-15",10,"Travel","Unknown category")
+
+    #******** 3. Unitary testing
+    db_helper_postgre.category_cache[shard.index]={name:category for name,category in ids.items() if name!="Food"} #Loaded before Food was added
+    assert db_helper_postgre.matching_category_ids(shard,"=","Food")==[ids["Food"]]
+    db_helper_postgre.category_cache[shard.index]={name:category for name,category in ids.items() if name!="Rent"}
+    assert db_helper_postgre.matching_category_ids(shard,"like","Ren%")==[ids["Rent"]]
+
+#%% UNIT OF WORK TESTING
+def test_unit_of_work():
+    '''
+        1. Unitary testing for unit of work. A create is read back in the same transaction and is committed at the end
+        2. Unitary testing for unit of work. An error rolls back every call of the unit of work
+        3. Unitary testing for nested calls. A failed nested call is undone by its savepoint and the transaction goes on
+    '''
+    date="2025-07-16"
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+
+    #******** 1. Unitary testing
+    with db_helper_postgre.UnitOfWork() as uow:
+        db_helper_postgre.create_record(date,10,"Food","Unit of work",uow=uow)
+        assert len(db_helper_postgre.retrieve_date(date,uow=uow))==1
+    assert len(db_helper_postgre.retrieve_date(date))==1
+
+    #******** 2. Unitary testing
+    with pytest.raises(ZeroDivisionError):
+        with db_helper_postgre.UnitOfWork() as uow:
+            db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="},uow=uow)
+            1/0
+    assert len(db_helper_postgre.retrieve_date(date))==1
+
+    #******** 3. Unitary testing
+    with db_helper_postgre.UnitOfWork() as uow:
+        with db_helper_postgre.get_db_cursor(uow=uow) as cursor:
+            with pytest.raises(Exception):
+                with db_helper_postgre.get_db_cursor(uow=uow) as nested_cursor:
+                    nested_cursor.execute("SELECT * FROM missing_table")
+            cursor.execute("SELECT COUNT(*) AS records FROM expenses WHERE expense_date=%s",(date,))
+            assert cursor.fetchone()["records"]==1
+        db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="},uow=uow)
+    assert len(db_helper_postgre.retrieve_date(date))==0
+
+#%% CHANGE EVENTS TESTING
+def test_change_events():
+    '''
+        Unitary testing for change events. Bulk creation and delete of a fictional date must be recorded in the change events
+    '''
+    date="2025-07-13"
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+    last_event_id=max([event["id"] for event in db_helper_postgre.retrieve_events_since(0,limit=100000)],default=0)
+
+    num_records=db_helper_postgre.create_records(date,[{"amount":10,"category":"Food","notes":"Bulk 1"},
+                                                       {"amount":20,"category":"Other","notes":"Bulk 2"}])
+    assert num_records==2
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+
+    events=db_helper_postgre.retrieve_events_since(last_event_id)
+    assert [event["action"] for event in events]==["create","delete"]
+    assert events[0]["expense_dates"]==[date]
+    assert events[0]["categories"]==["Food","Other"]
+    assert events[1]["records"]==2
+
+def test_events_commit_in_order():
+    '''
+        Unitary testing for event order. An event committing while a client is away must have a lower id than every event committed after it,
+        so the replay after the last id the client received includes it
+    '''
+    date="2025-07-12"
+    last_event_id=max([event["id"] for event in db_helper_postgre.retrieve_events_since(0,limit=100000)],default=0)
+    with db_helper_postgre.UnitOfWork() as uow:
+        with uow.cursor() as cursor:
+            slow_event=db_helper_postgre.record_change(cursor,"create",[{"expense_date":datetime.date(2025,5,12),"category":"Food"}],db_helper_postgre.DEFAULT_OWNER) #Other month, no shared version row
+        writer=threading.Thread(target=db_helper_postgre.create_record,args=(date,10,"Food","Order test"))
+        writer.start()
+        writer.join(0.5)
+        assert writer.is_alive() #The second event waits for the first transaction
+        assert db_helper_postgre.retrieve_events_since(last_event_id)==[]
+    writer.join()
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+
+    events=db_helper_postgre.retrieve_events_since(last_event_id)
+    assert events[0]["id"]==slow_event["id"]
+    assert [event["action"] for event in events]==["create","create","delete"]
+
+def test_content_version():
+    '''
+        Unitary testing for content versions. A create and a delete must change the version of the month of the changed date
+    '''
+    date="2025-07-14"
+    initial_version,_=db_helper_postgre.content_version(date,date)
+    db_helper_postgre.create_record(date,10,"Food","Version test")
+    created_version,last_modified=db_helper_postgre.content_version(date,date)
+    db_helper_postgre.delete_record({"expense_date": date}, {"expense_date": "="})
+    deleted_version,_=db_helper_postgre.content_version(date,date)
+
+    assert created_version!=initial_version
+    assert deleted_version!=created_version
+    assert last_modified is not None
+    assert db_helper_postgre.content_version("2025-06-01","2025-06-30")==db_helper_postgre.content_version("2025-06-01","2025-06-30") #Reads do not change the version
+
+def test_small_range_approximate():
+    '''
+        Unitary testing for approximate analytics of a range too small to sample. The exact totals are returned without a second round
+    '''
+    exact,exact_top=db_helper_postgre.expense_summary("2024-08-01","2024-08-31",owner=db_helper_postgre.DEFAULT_OWNER)
+    total_expenses,top_expenses,approximation=db_helper_postgre.expense_summary_approx("2024-08-01","2024-08-31",owner=db_helper_postgre.DEFAULT_OWNER)
+    assert approximation=={"approximate":False,"sampled_rows":0}
+    assert total_expenses==exact
+    assert top_expenses==exact_top
+
+#%% SHARDED ANALYTICS TESTING
+def test_merge_expense_summaries():
+    '''
+        Unitary testing for merging the analytics of several shards. Category totals are added before the top 5 and percentages are computed
+    '''
+    shard_0=([{"category":"Food","total_expense":100},{"category":"Rent","total_expense":300}],
+             [{"amount":300,"category":"Rent"},{"amount":60,"category":"Food"}])
+    shard_1=([{"category":"Food","total_expense":200},{"category":"Other","total_expense":400}],
+             [{"amount":400,"category":"Other"},{"amount":150,"category":"Food"}])
+
+    total_expenses,top_expenses=db_helper_postgre.merge_expense_summaries([shard_0,shard_1])
+    assert [row["category"] for row in total_expenses]==["Other","Food","Rent"]
+    assert total_expenses[1]["total_expense"]==300
+    assert total_expenses[0]["perc_expense"]==40
+    assert [row["amount"] for row in top_expenses]==[400,300,150,60]
+
+def test_merge_sampled_summaries():
+    '''
+        1. Unitary testing for approximate analytics. A 100% sample gives the exact totals with no margin
+        2. Unitary testing for approximate analytics. A 10% sample scales the totals and reports a margin
+        3. Unitary testing for clustered samples. Categories always sampled in the same proportion have no percentage margin
+    '''
+    shard_0=([{"category":"Food","sampled_rows":10,"sampled_sum":100.0,"sampled_products":{"Food":1000.0}},
+              {"category":"Rent","sampled_rows":1,"sampled_sum":300.0,"sampled_products":{"Rent":90000.0}}],[])
+
+    #******** 1. Unitary testing
+    total_expenses,_,sampled_rows=db_helper_postgre.merge_sampled_summaries([shard_0],100)
+    assert sampled_rows==11
+    assert total_expenses[0]["category"]=="Rent"
+    assert total_expenses[0]["total_expense"]==300
+    assert total_expenses[0]["perc_expense"]==75
+    assert total_expenses[0]["total_expense_margin"]==0
+
+    #******** 2. Unitary testing
+    total_expenses,_,_=db_helper_postgre.merge_sampled_summaries([shard_0],10)
+    assert total_expenses[1]["total_expense"]==1000
+    assert total_expenses[1]["estimated_records"]==100
+    assert total_expenses[1]["total_expense_margin"]>0
+    assert total_expenses[1]["perc_expense"]==25
+
+    #******** 3. Unitary testing
+    pages=[(10.0,30.0),(20.0,60.0)] #Food and Rent sums of each sampled page
+    shard_1=([{"category":"Food","sampled_rows":2,"sampled_sum":30.0,"sampled_products":{"Food":sum(f*f for f,_ in pages),"Rent":sum(f*r for f,r in pages)}},
+              {"category":"Rent","sampled_rows":2,"sampled_sum":90.0,"sampled_products":{"Food":sum(f*r for f,r in pages),"Rent":sum(r*r for _,r in pages)}}],[])
+    total_expenses,_,_=db_helper_postgre.merge_sampled_summaries([shard_1],10)
+    assert total_expenses[0]["total_expense_margin"]>0
+    assert total_expenses[0]["perc_expense_margin"]==0
@@ -0,0 +1,15 @@
+from backend.launcher import pool_size_per_worker
+import pytest
+
+#%% POOL SIZING TESTING
+def test_pool_size_per_worker():
+    '''
+        Unitary testing for pool sizing. Workers times pool and listener connections must stay under the budget
+    '''
+    for budget,workers in [(90,1),(90,4),(90,8),(20,6)]:
+        pool_size=pool_size_per_worker(budget,workers)
+        assert pool_size>=1
+        assert workers*(pool_size+1)<=budget
+
+    with pytest.raises(ValueError):
+        pool_size_per_worker(10,8)
@@ -0,0 +1,24 @@
+from backend.log_setup import ProcessHandler,file_handler
+import logging
+
+#%% LOGGING TESTING
+def test_process_handler(tmp_path):
+    '''
+        Unitary testing for process local logging. The log file is opened on the first record, again in a new process
+    '''
+    path=tmp_path/"server.log"
+    handler=ProcessHandler(lambda: file_handler(str(path)))
+    assert not path.exists()
+
+    record=logging.LogRecord("server",logging.INFO,__file__,1,"Record",None,None)
+    handler.handle(record)
+    first=handler.handler
+    handler.handle(record)
+    assert handler.handler is first
+
+    handler.pid=-1 #As seen from a worker process
+    handler.handle(record)
+    assert handler.handler is not first
+    first.close()
+    handler.handler.close()
+    assert path.read_text().count("Record")==3
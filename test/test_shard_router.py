@@ -0,0 +1,49 @@
+import os
+import threading
+import pytest
+from backend import shard_router
+from backend.shard_router import ShardRouter
+from collections import Counter
+
+#%% ROUTING TESTING
+def test_shard_for():
+    '''
+        1. Unitary testing for routing. The same owner always goes to the same shard and owners spread over all shards
+        2. Unitary testing for consistent hashing. Adding a shard only moves owners to the new shard
+    '''
+    owners=[f"owner_{i}" for i in range(2000)]
+
+    #******** 1. Unitary testing
+    router=ShardRouter(["dsn_0","dsn_1","dsn_2"])
+    assignment={owner:router.shard_for(owner).index for owner in owners}
+    assert all(router.shard_for(owner).index==index for owner,index in assignment.items())
+    counts=Counter(assignment.values())
+    assert set(counts)=={0,1,2}
+    assert min(counts.values())>len(owners)/3*0.7
+
+    #******** 2. Unitary testing
+    bigger_router=ShardRouter(["dsn_0","dsn_1","dsn_2","dsn_3"])
+    for owner,index in assignment.items():
+        new_index=bigger_router.shard_for(owner).index
+        assert new_index==index or new_index==3
+
+def test_single_shard():
+    '''
+        Unitary testing for single shard deployments. Every owner goes to the only shard
+    '''
+    router=ShardRouter(["dsn_0"])
+    assert router.shard_for("public").index==0
+    assert router.shard_for("someone_else").index==0
+
+#%% POOL TESTING
+def test_pool_timeout(monkeypatch):
+    '''
+        Unitary testing for exhausted pools. Waiting for a connection ends with ConnectionError after POOL_TIMEOUT
+    '''
+    monkeypatch.setattr(shard_router,"POOL_TIMEOUT",0.1)
+    shard=ShardRouter(["dsn_0"]).shard_for("public")
+    shard.pool,shard.pid=object(),os.getpid() #Pool already created in this process
+    shard.semaphore=threading.BoundedSemaphore(1)
+    shard.semaphore.acquire() #The only connection is checked out
+    with pytest.raises(ConnectionError):
+        shard.getconn()
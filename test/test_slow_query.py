@@ -0,0 +1,62 @@
+from backend.slow_query import SlowQueryRecorder,normalize_query
+import pytest
+
+#%% SHAPE TESTING
+def test_normalize_query():
+    '''
+        Unitary testing for query shapes. Placeholders, literals and value lists must not split a shape
+    '''
+    assert normalize_query("SELECT *  FROM expenses\n WHERE amount > %s") == "SELECT * FROM expenses WHERE amount > ?"
+    assert normalize_query("SELECT * FROM expenses WHERE category = 'Food' LIMIT 5") == "SELECT * FROM expenses WHERE category = ? LIMIT ?"
+    assert normalize_query(b"INSERT INTO expenses (amount,notes) VALUES (1,'a'),(2,'b''s')") == normalize_query("INSERT INTO expenses (amount,notes) VALUES (%s,%s)")
+
+#%% STATISTICS TESTING
+def test_top_shapes():
+    '''
+        1. Unitary testing for shape statistics. Fast statements are aggregated per shape without EXPLAIN
+        2. Unitary testing for ordering validation
+    '''
+    #******** 1. Unitary testing
+    recorder=SlowQueryRecorder(threshold_ms=1000)
+    for duration in [1,2,3]:
+        recorder.record(None,"SELECT * FROM expenses WHERE amount > %s",(duration,),duration,1)
+    recorder.record(None,"SELECT * FROM expenses WHERE expense_date = %s",("2024-08-01",),10,4)
+
+    shapes=recorder.top_shapes("total")
+    assert shapes[0]["shape"]=="SELECT * FROM expenses WHERE expense_date = ?"
+    assert shapes[1]["calls"]==3
+    assert shapes[1]["total_ms"]==6
+    assert shapes[1]["p99_ms"]==3
+
+    #******** 2. Unitary testing
+    with pytest.raises(ValueError):
+        recorder.top_shapes("mean")
+
+#%% EXPLAIN TESTING
+class RecordingCursor:
+    def __init__(self,statements):
+        self.statements=statements
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        return False
+    def execute(self,query,params=None):
+        self.statements.append(query)
+    def fetchall(self):
+        return [("Delete on expenses",)]
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements=[]
+    def cursor(self,cursor_factory=None):
+        return RecordingCursor(self.statements)
+
+def test_explain_rolls_back():
+    '''
+        Unitary testing for EXPLAIN ANALYZE of a data-modifying WITH. The savepoint is rolled back so nothing it wrote is kept
+    '''
+    connection=RecordingConnection()
+    plan=SlowQueryRecorder().explain(connection,"WITH moved AS (DELETE FROM expenses RETURNING *) SELECT count(*) FROM moved",None)
+    assert plan=="Delete on expenses"
+    assert connection.statements[1].startswith("EXPLAIN (ANALYZE, BUFFERS)")
+    assert connection.statements[2:]==["ROLLBACK TO SAVEPOINT slow_query_explain","RELEASE SAVEPOINT slow_query_explain"]